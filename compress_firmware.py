@@ -0,0 +1,34 @@
+# compress_firmware.py
+"""
+Builds the pre-compressed variants the OEM server offers for firmware images.
+
+The GUI does this on every OEM deploy; use this for images copied into the
+updates folder by hand.
+
+Usage:
+    python compress_firmware.py                          # every image in updates/
+    python compress_firmware.py updates/firmware_v1.2.bin
+"""
+import argparse
+import os
+import sys
+from shared_utils import build_compressed_variants, DEFAULT_VARIANTS_DIR
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-compress firmware images for the OEM server.")
+    parser.add_argument("images", nargs="*", help="Image files (default: everything in --updates)")
+    parser.add_argument("--updates", default="updates")
+    parser.add_argument("--output", default=DEFAULT_VARIANTS_DIR)
+    args = parser.parse_args(argv)
+
+    images = args.images or [os.path.join(args.updates, name) for name in sorted(os.listdir(args.updates))
+                             if os.path.isfile(os.path.join(args.updates, name))]
+    for image in images:
+        size = os.path.getsize(image)
+        built = build_compressed_variants(image, args.output)
+        summary = ", ".join(f"{enc} {n} bytes ({n / size:.1%})" for enc, n in built.items()) or "not compressible"
+        print(f"{image}: {size} bytes -> {summary}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,146 +1,431 @@
 # ecu_receiver.py
 import os
-import time
-import configparser
 import re
+import threading
+import time
+import mmap
+import struct
+import zlib
+import hashlib
+from shared_utils import (sim_clock, open_control_listener, send_control_message, read_control_messages, gui_events,
+                          SpanRecorder, config_service, watch_folder_fd)
 
 # --- STATE MANAGEMENT ---
 # Real ECUs store this in non-volatile memory (NVRAM).
-# We simulate it with global variables.
-system_state = {
-    "active_slot": "A",
-    "slot_a_version": "1.0",
-    "slot_b_version": "0.0" # Empty initially
-}
+# We simulate it with one EcuNode per ECU; this process models a single node.
+OUTCOME_SUCCESS = "success"
+OUTCOME_ROLLED_BACK = "rolled_back"
+OUTCOME_BRICKED = "bricked"
+BOOT_OK = "ok"
+BOOT_HUNG = "hung"
+
+class EcuNode:
+    """A/B slot state of one ECU."""
+    def __init__(self, name="ecu", bus=None, active_slot="A", slot_a_version="1.0", slot_b_version="0.0"):
+        self.name = name
+        self.bus = bus
+        self.active_slot = active_slot
+        self.slot_versions = {"A": slot_a_version, "B": slot_b_version} # B is empty initially
+        self.boot_state = BOOT_OK
+
+    @property
+    def target_slot(self):
+        """The inactive slot, which receives the next update."""
+        return "B" if self.active_slot == "A" else "A"
+
+    @property
+    def active_version(self):
+        return self.slot_versions[self.active_slot]
+
+    def apply_boot_outcome(self, target_slot, new_version, outcome):
+        """Commits or abandons the switch to target_slot after the trial boot."""
+        self.active_slot, failed, self.boot_state = boot_transition(self.active_slot, target_slot, outcome)
+        self.slot_versions[target_slot] = new_version + " (BAD)" if failed else new_version
+
+def boot_transition(active_slot, target_slot, outcome):
+    """
+    The A/B state machine after a trial boot of target_slot. Returns the new
+    active slot, whether target_slot is now marked bad, and the boot state.
+    """
+    if outcome == OUTCOME_ROLLED_BACK:
+        # Stay on the old slot, but record the version that failed to boot
+        return active_slot, True, BOOT_OK
+    # Success, or bricked: the switch to the new slot is committed
+    return target_slot, False, BOOT_HUNG if outcome == OUTCOME_BRICKED else BOOT_OK
+
+def boot_outcome(is_malicious, resilience_enabled):
+    if not is_malicious:
+        return OUTCOME_SUCCESS
+    return OUTCOME_ROLLED_BACK if resilience_enabled else OUTCOME_BRICKED
+
+ecu_node = EcuNode()
+slot_storage = None  # SlotStorage, set up by run_receiver
+spans = SpanRecorder('ecu')
 
 def log_to_gui(message_type, message, color=None):
-    if color:
-        print(f"{message_type.upper()}:{message}:{color}", flush=True)
-    else:
-        print(f"{message_type.upper()}:{message}", flush=True)
+    """Sends a typed event to the GUI as a frame on stdout."""
+    gui_events.emit(message_type, message, color)
 
 def extract_version(filename):
     """Extracts version number '1.2' from 'firmware_v1.2.bin'"""
-    match = re.search(r'v([\d.]+)', filename)
+    match = re.search(r'v(\d+(?:\.\d+)*)', filename)
     return match.group(1) if match else "?.?"
 
+# --- SLOT STORAGE ---
+# Each slot is a real image file written through mmap in fixed-size blocks.
+# Blocks that already hold the incoming bytes are skipped. Once the map is
+# flushed, the slot file is read back and its SHA-256 compared with the
+# image's. Slot metadata lives in a small NVRAM record that is replaced
+# atomically, so it survives restarts.
+FLASH_BLOCK_SIZE = 4096
+NVRAM_FILENAME = "nvram.bin"
+NVRAM_MAGIC = b"NVR1"
+# magic, active slot (0=A, 1=B), boot state (0=ok, 1=hung), versions A/B, sizes A/B, sha256 A/B
+_NVRAM_RECORD = struct.Struct(">4sBB32s32sQQ32s32s")
+_NVRAM_CRC = struct.Struct(">I")
+_BOOT_STATES = [BOOT_OK, BOOT_HUNG]
+
+def nvram_version(version):
+    """The version as at most 32 UTF-8 bytes, cut on a character boundary."""
+    return version.encode()[:32].decode(errors='ignore').encode()
+
+class SlotStorage:
+    def __init__(self, folder, block_size=FLASH_BLOCK_SIZE):
+        self.folder = folder
+        self.block_size = block_size
+        self.nvram_path = os.path.join(folder, NVRAM_FILENAME)
+        self.slot_sizes = {"A": 0, "B": 0}
+        self.slot_digests = {"A": b"\0" * 32, "B": b"\0" * 32}
+        os.makedirs(folder, exist_ok=True)
+
+    def slot_path(self, slot):
+        return os.path.join(self.folder, f"slot_{slot}.img")
+
+    def load(self, node):
+        """Restores the node's slot state from NVRAM. Returns False if there is no valid record."""
+        try:
+            with open(self.nvram_path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return False
+        record, crc = raw[:_NVRAM_RECORD.size], raw[_NVRAM_RECORD.size:]
+        if len(crc) != _NVRAM_CRC.size or _NVRAM_CRC.unpack(crc)[0] != zlib.crc32(record):
+            return False
+        magic, active, boot, ver_a, ver_b, size_a, size_b, sha_a, sha_b = _NVRAM_RECORD.unpack(record)
+        if magic != NVRAM_MAGIC:
+            return False
+        node.active_slot = "AB"[active]
+        node.boot_state = _BOOT_STATES[boot]
+        node.slot_versions = {"A": ver_a.rstrip(b"\0").decode(errors='replace'),
+                              "B": ver_b.rstrip(b"\0").decode(errors='replace')}
+        self.slot_sizes = {"A": size_a, "B": size_b}
+        self.slot_digests = {"A": sha_a, "B": sha_b}
+        return True
+
+    def save(self, node):
+        """Writes the node's slot state to NVRAM with write-to-temp, fsync and rename."""
+        record = _NVRAM_RECORD.pack(
+            NVRAM_MAGIC, "AB".index(node.active_slot), _BOOT_STATES.index(node.boot_state),
+            nvram_version(node.slot_versions["A"]), nvram_version(node.slot_versions["B"]),
+            self.slot_sizes["A"], self.slot_sizes["B"], self.slot_digests["A"], self.slot_digests["B"])
+        tmp_path = self.nvram_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(record + _NVRAM_CRC.pack(zlib.crc32(record)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.nvram_path)
+
+    def slot_sha256(self, slot):
+        """SHA-256 of the slot file as it reads back through the file system."""
+        sha256_hash = hashlib.sha256()
+        with open(self.slot_path(slot), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256_hash.update(block)
+        return sha256_hash.digest()
+
+    def write_image(self, slot, image_path, progress=None):
+        """
+        Flashes image_path into the slot file. Calls progress(done, total)
+        after each block. Returns a dict of block counts, bytes and timing.
+        Raises IOError if the flushed slot does not read back as the image.
+        """
+        started = time.perf_counter()
+        image_size = os.path.getsize(image_path)
+        total_blocks = (image_size + self.block_size - 1) // self.block_size
+        written = skipped = bytes_written = 0
+        sha256_hash = hashlib.sha256()
+        with open(self.slot_path(slot), 'a+b') as slot_file, open(image_path, 'rb') as image_file:
+            slot_file.truncate(image_size)
+            if image_size:
+                with mmap.mmap(slot_file.fileno(), image_size) as slot_map:
+                    for index in range(total_blocks):
+                        offset = index * self.block_size
+                        block = image_file.read(self.block_size)
+                        end = offset + len(block)
+                        sha256_hash.update(block)
+                        if slot_map[offset:end] == block:
+                            skipped += 1
+                        else:
+                            slot_map[offset:end] = block
+                            written += 1
+                            bytes_written += len(block)
+                        if progress:
+                            progress(index + 1, total_blocks)
+                    slot_map.flush()
+        if self.slot_sha256(slot) != sha256_hash.digest():
+            raise IOError(f"Verification failed: slot {slot} does not read back as {os.path.basename(image_path)}")
+        self.slot_sizes[slot] = image_size
+        self.slot_digests[slot] = sha256_hash.digest()
+        elapsed = time.perf_counter() - started
+        return {
+            "blocks": total_blocks,
+            "blocks_written": written,
+            "blocks_skipped": skipped,
+            "bytes_written": bytes_written,
+            "seconds": elapsed,
+            "throughput_mb_s": (image_size / elapsed / 1e6) if elapsed > 0 else None,
+            "sha256": sha256_hash.hexdigest(),
+        }
+
+# --- INBOX WATCHER ---
+# The TCU renames finished images into the shared folder, so one inotify
+# IN_MOVED_TO (or IN_CLOSE_WRITE for plain copies) is enough to wake up.
+# Platforms without inotify fall back to polling the folder.
+
+class InboxWatcher:
+    """Blocks until complete images are present in the ECU inbox folder."""
+    def __init__(self, folder, poll_interval=1.0):
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.inotify_fd = watch_folder_fd(folder)
+
+    def pending_images(self):
+        # Hidden names are images still being copied in by the TCU
+        return sorted(f for f in os.listdir(self.folder) if not f.startswith('.'))
+
+    def wait_for_images(self):
+        """Returns the images waiting in the inbox, blocking until there is at least one."""
+        while True:
+            files = self.pending_images()
+            if files:
+                return files
+            if self.inotify_fd is not None:
+                os.read(self.inotify_fd, 4096)  # Sleeps in the kernel until the folder changes
+            else:
+                sim_clock.sleep(self.poll_interval, min_real=0.05)
+
+# --- CONTROL CHANNEL ---
+class ControlChannel:
+    """
+    Accepts TCU connections on the control socket. A TCU announces an image
+    with 'image_ready' and then receives 'progress' and 'result' messages for
+    that filename on the same connection.
+    """
+    MAX_UNCLAIMED_RESULTS = 32
+
+    def __init__(self, config):
+        self.listener = open_control_listener(config)
+        self._lock = threading.Lock()
+        self._subscribers = {}  # filename -> connection
+        self._unclaimed = {}    # filename -> result fields, for announcements that arrive late
+        self._announced = {}    # filename -> (update ID, epoch time, perf counter, sim time) of image_ready
+        threading.Thread(target=self._accept_loop, name="ecu-control", daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            for message in read_control_messages(conn):
+                if message.get('type') != 'image_ready':
+                    continue
+                filename = message.get('filename')
+                with self._lock:
+                    self._announced[filename] = (message.get('update_id'), time.time(), time.perf_counter(), sim_clock.now())
+                    while len(self._announced) > self.MAX_UNCLAIMED_RESULTS:
+                        self._announced.pop(next(iter(self._announced)))
+                    result = self._unclaimed.pop(filename, None)
+                    if result is None:
+                        self._subscribers[filename] = conn
+                if result is not None:
+                    send_control_message(conn, 'result', **result)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                for filename in [f for f, c in self._subscribers.items() if c is conn]:
+                    del self._subscribers[filename]
+            conn.close()
+
+    def claim_announcement(self, filename, wait=0.2):
+        """
+        Returns (update ID, epoch time, perf counter, sim time) of the TCU's
+        image_ready for filename, or None. Waits briefly, since the file can
+        be noticed just before the announcement is read off the socket.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            with self._lock:
+                announced = self._announced.pop(filename, None)
+            if announced is not None or time.monotonic() >= deadline:
+                return announced
+            time.sleep(0.01)
+
+    def publish(self, filename, msg_type, **fields):
+        """Sends a message to the TCU waiting on `filename`, if any."""
+        fields['filename'] = filename
+        with self._lock:
+            conn = self._subscribers.get(filename)
+            if conn is None:
+                if msg_type == 'result':
+                    self._unclaimed[filename] = fields
+                    while len(self._unclaimed) > self.MAX_UNCLAIMED_RESULTS:
+                        self._unclaimed.pop(next(iter(self._unclaimed)))
+                return
+            if msg_type == 'result':
+                del self._subscribers[filename]
+        try:
+            send_control_message(conn, msg_type, **fields)
+        except OSError:
+            pass
+
+def process_image(watch_folder, channel, filename):
+    """Flashes one image from the inbox into the inactive slot and reports the result."""
+    filepath = os.path.join(watch_folder, filename)
+    is_malicious = "malicious" in filename.lower()
+    new_version = extract_version(filename)
+
+    # The TCU's announcement carries the update ID; the time from it to here is detection
+    announced = channel.claim_announcement(filename)
+    update_id = announced[0] if announced else None
+    if announced:
+        spans.record('detect', update_id, announced[1], time.perf_counter() - announced[2], sim_clock.now() - announced[3])
+
+    # --- A/B PARTITION LOGIC ---
+    # Determine which slot is the "Update Target" (The inactive one)
+    target_slot = ecu_node.target_slot
+    current_slot = ecu_node.active_slot
+
+    with spans.span('flash', update_id, slot=target_slot) as flash_attrs:
+        with gui_events.batch():
+            log_to_gui('status', 'Updating...', '#ffc107')
+            log_to_gui('log', f"----------------------------------------")
+            log_to_gui('log', f" New firmware detected: {filename}")
+            log_to_gui('log', f" Active Slot: {current_slot} | Target Slot: {target_slot}")
+        channel.publish(filename, 'progress', stage='detected', percent=0, update_id=update_id)
+        sim_clock.sleep(1)
+        
+        # Write to the Inactive Partition
+        log_to_gui('status', f'Flashing Slot {target_slot}', '#ff9800')
+        log_to_gui('log', f" Writing image to Partition {target_slot}...")
+        
+        reported = [0]
+        def on_block(done, total):
+            # Report in thirds, like the old three-step write
+            step = done * 3 // total
+            if step > reported[0]:
+                reported[0] = step
+                log_to_gui('log', f"   [Slot {target_slot}] Writing block {done}/{total}...")
+                channel.publish(filename, 'progress', stage='flashing', percent=round(done * 100 / total), update_id=update_id)
+        stats = slot_storage.write_image(target_slot, filepath, progress=on_block)
+        flash_attrs.update(blocks_written=stats['blocks_written'], blocks_skipped=stats['blocks_skipped'])
+        log_to_gui('log', f"   [Slot {target_slot}] {stats['blocks_written']} blocks written, {stats['blocks_skipped']} unchanged blocks skipped "
+                          f"({stats['seconds'] * 1000:.1f} ms).")
+        sim_clock.sleep(1.8)
+    
+    with spans.span('verify', update_id, slot=target_slot):
+        log_to_gui('log', f" [Slot {target_slot}] Checksum verification passed.")
+        sim_clock.sleep(0.5)
+
+    # Simulate the "Swap and Boot" attempt
+    with spans.span('reboot', update_id, slot=target_slot) as reboot_attrs:
+        log_to_gui('log', f" Swapping active partition to Slot {target_slot}...")
+        sim_clock.sleep(1)
+        log_to_gui('log', f" Rebooting into Slot {target_slot}...")
+        channel.publish(filename, 'progress', stage='rebooting', percent=100, update_id=update_id)
+        sim_clock.sleep(1.5)
+
+        # --- OUTCOME LOGIC ---
+        # Read at boot time, so a resilience toggle during flashing still applies
+        resilience_enabled = config_service.getboolean('Security', 'ecu_resilience_enabled', fallback=True)
+        outcome = boot_outcome(is_malicious, resilience_enabled)
+        ecu_node.apply_boot_outcome(target_slot, new_version, outcome)
+        slot_storage.save(ecu_node)
+        reboot_attrs['outcome'] = outcome
+    if is_malicious:
+        log_to_gui('status', 'COMPROMISED', '#f44336')
+        log_to_gui('log', " [!!!] BOOT ERROR: MALICIOUS CODE DETECTED IN STARTUP.")
+        
+        if resilience_enabled:
+            # CASE A: A/B Rollback (The Safety Net)
+            with spans.span('rollback', update_id, slot=current_slot):
+                sim_clock.sleep(2) 
+                log_to_gui('status', 'Rolling Back', '#FF9800')
+                log_to_gui('log', " [!] WATCHDOG: Boot failure detected.")
+                log_to_gui('log', f" [!] SWITCHING BACK to known good Slot {current_slot}...")
+                sim_clock.sleep(1.5)
+            
+            # The node stayed on the old slot and marked the failed one as BAD
+            log_to_gui('log', f" [o] Recovered. Running on Slot {current_slot} (v{ecu_node.active_version}).")
+            
+            channel.publish(filename, 'result', status="FAILURE", active_slot=current_slot, version=new_version, update_id=update_id)
+        else:
+            # CASE B: Bricked (No Rollback)
+            # The node committed the switch to the bad slot
+            log_to_gui('log', " [!!!] WATCHDOG DISABLED. SYSTEM HANG.")
+            log_to_gui('log', f" [X] STUCK ON CORRUPT SLOT {target_slot}.")
+            
+            # Setup thinks it worked, but ECU is dead
+            channel.publish(filename, 'result', status="SUCCESS", active_slot=target_slot, version=new_version, update_id=update_id)
+    else:
+        # CASE C: Success
+        # The node committed the switch
+        log_to_gui('log', f" Boot successful. System running on Slot {target_slot} (v{new_version}).")
+        log_to_gui('status', 'Success', '#4CAF50')
+        channel.publish(filename, 'result', status="SUCCESS", active_slot=target_slot, version=new_version, update_id=update_id)
+    
+    log_to_gui('log', f"----------------------------------------")
+    # -------------------------------------
+
+    if os.path.exists(filepath): os.remove(filepath)
+    sim_clock.sleep(1)
+    
+    # If compromised and no resilience, stay red longer
+    if is_malicious and not resilience_enabled:
+        sim_clock.sleep(10)
+    else:
+        sim_clock.sleep(3)
+        log_to_gui('status', f'Slot {ecu_node.active_slot} Active', '#4CAF50')
+
 def run_receiver():
-    config = configparser.ConfigParser()
-    time.sleep(1) 
+    global slot_storage
+    config_service.start_watcher()
+    config = config_service.snapshot()
+    watch_folder = config.get('Folders', 'ecu_shared_folder', fallback='shared_for_ecu')
+    os.makedirs(watch_folder, exist_ok=True)
+    slot_storage = SlotStorage(config.get('Folders', 'ecu_slot_folder', fallback='ecu_slots'))
+    if not slot_storage.load(ecu_node):
+        slot_storage.save(ecu_node)  # First boot: factory state
+    watcher = InboxWatcher(watch_folder)
+    channel = ControlChannel(config)
+    sim_clock.sleep(1) 
     
     log_to_gui('status', 'Listening', '#4CAF50')
-    log_to_gui('log', f"[o] ECU Online. Booted from Slot {system_state['active_slot']} (v{system_state['slot_a_version']}).")
+    log_to_gui('log', f"[o] ECU Online. Booted from Slot {ecu_node.active_slot} (v{ecu_node.active_version}).")
 
     while True:
         try:
-            config.read('config.ini')
-            watch_folder = config.get('Folders', 'ecu_shared_folder')
-            ack_folder = config.get('Folders', 'tcu_ack_folder')
-            resilience_enabled = config.getboolean('Security', 'ecu_resilience_enabled', fallback=True)
-            
-            os.makedirs(watch_folder, exist_ok=True)
-            os.makedirs(ack_folder, exist_ok=True)
-
-            files = os.listdir(watch_folder)
-            if files:
-                filename = files[0]
-                filepath = os.path.join(watch_folder, filename)
-                is_malicious = "malicious" in filename.lower()
-                new_version = extract_version(filename)
-
-                # --- A/B PARTITION LOGIC ---
-                # Determine which slot is the "Update Target" (The inactive one)
-                target_slot = "B" if system_state["active_slot"] == "A" else "A"
-                current_slot = system_state["active_slot"]
-
-                log_to_gui('status', 'Updating...', '#ffc107')
-                log_to_gui('log', f"----------------------------------------")
-                log_to_gui('log', f" New firmware detected: {filename}")
-                log_to_gui('log', f" Active Slot: {current_slot} | Target Slot: {target_slot}")
-                time.sleep(1)
-                
-                # Simulate Writing to the Inactive Partition
-                log_to_gui('status', f'Flashing Slot {target_slot}', '#ff9800')
-                log_to_gui('log', f" Writing image to Partition {target_slot}...")
-                
-                for i in range(1, 4): 
-                    log_to_gui('log', f"   [Slot {target_slot}] Writing block {i}/3...")
-                    time.sleep(0.6) 
-                
-                log_to_gui('log', f" [Slot {target_slot}] Checksum verification passed.")
-                time.sleep(0.5)
-
-                # Simulate the "Swap and Boot" attempt
-                log_to_gui('log', f" Swapping active partition to Slot {target_slot}...")
-                time.sleep(1)
-                log_to_gui('log', f" Rebooting into Slot {target_slot}...")
-                time.sleep(1.5)
-
-                # --- OUTCOME LOGIC ---
-                if is_malicious:
-                    log_to_gui('status', 'COMPROMISED', '#f44336')
-                    log_to_gui('log', " [!!!] BOOT ERROR: MALICIOUS CODE DETECTED IN STARTUP.")
-                    
-                    if resilience_enabled:
-                        # CASE A: A/B Rollback (The Safety Net)
-                        time.sleep(2) 
-                        log_to_gui('status', 'Rolling Back', '#FF9800')
-                        log_to_gui('log', " [!] WATCHDOG: Boot failure detected.")
-                        log_to_gui('log', f" [!] SWITCHING BACK to known good Slot {current_slot}...")
-                        time.sleep(1.5)
-                        
-                        # We do NOT update system_state['active_slot'] (Stay on old slot)
-                        # We update the version of the failed slot to show we tried
-                        if target_slot == "A": system_state["slot_a_version"] = new_version + " (BAD)"
-                        else: system_state["slot_b_version"] = new_version + " (BAD)"
-
-                        log_to_gui('log', f" [o] Recovered. Running on Slot {current_slot} (v{system_state['slot_a_version' if current_slot=='A' else 'slot_b_version']}).")
-                        
-                        with open(os.path.join(ack_folder, f"{filename}.ack"), 'w') as f:
-                            f.write("FAILURE") 
-                    else:
-                        # CASE B: Bricked (No Rollback)
-                        # We commit the switch to the bad slot
-                        system_state["active_slot"] = target_slot
-                        if target_slot == "A": system_state["slot_a_version"] = new_version
-                        else: system_state["slot_b_version"] = new_version
-
-                        log_to_gui('log', " [!!!] WATCHDOG DISABLED. SYSTEM HANG.")
-                        log_to_gui('log', f" [X] STUCK ON CORRUPT SLOT {target_slot}.")
-                        
-                        with open(os.path.join(ack_folder, f"{filename}.ack"), 'w') as f:
-                            f.write("SUCCESS") # Setup thinks it worked, but ECU is dead
-                else:
-                    # CASE C: Success
-                    # Commit the switch
-                    system_state["active_slot"] = target_slot
-                    if target_slot == "A": system_state["slot_a_version"] = new_version
-                    else: system_state["slot_b_version"] = new_version
-
-                    log_to_gui('log', f" Boot successful. System running on Slot {target_slot} (v{new_version}).")
-                    log_to_gui('status', 'Success', '#4CAF50')
-                    with open(os.path.join(ack_folder, f"{filename}.ack"), 'w') as f:
-                        f.write("SUCCESS")
-                
-                log_to_gui('log', f"----------------------------------------")
-                # -------------------------------------
-
-                if os.path.exists(filepath): os.remove(filepath)
-                time.sleep(1)
-                
-                # If compromised and no resilience, stay red longer
-                if is_malicious and not resilience_enabled:
-                    time.sleep(10)
-                else:
-                    time.sleep(3)
-                    log_to_gui('status', f'Slot {system_state["active_slot"]} Active', '#4CAF50')
-                
+            for filename in watcher.wait_for_images():
+                process_image(watch_folder, channel, filename)
         except Exception as e:
             log_to_gui('log', f"ECU CRITICAL ERROR: {e}")
             log_to_gui('status', 'Crashed', '#f44336')
-            time.sleep(5)
-        
-        time.sleep(1)
+            sim_clock.sleep(5, min_real=0.05)
 
 if __name__ == '__main__':
     log_to_gui('log', "ECU Receiver process started.")
@@ -0,0 +1,52 @@
+# firmware_store.py
+"""
+Maintenance CLI for the content-addressed firmware store (see FirmwareStore
+in shared_utils). The servers and the GUI use the store directly; this is for
+images added by hand and for checking how much space sharing saves.
+
+Usage:
+    python firmware_store.py add updates firmware_v1.3.bin path/to/image.bin
+    python firmware_store.py import updates malicious_updates   # adopt hand-dropped files
+    python firmware_store.py stats
+    python firmware_store.py gc
+"""
+import argparse
+import json
+import os
+import sys
+from shared_utils import FirmwareStore, DEFAULT_STORE_ROOT
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the content-addressed firmware store.")
+    parser.add_argument("--root", default=DEFAULT_STORE_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="Store an image and publish it under a versioned name")
+    add.add_argument("folder", help="Published folder, e.g. updates or malicious_updates")
+    add.add_argument("filename", help="Versioned name, e.g. firmware_v1.3.bin")
+    add.add_argument("source", help="Image file to store")
+    imp = sub.add_parser("import", help="Take files already in published folders into the store")
+    imp.add_argument("folders", nargs="+")
+    sub.add_parser("stats", help="Published versus stored files and bytes, as JSON")
+    sub.add_parser("gc", help="Forget removed files and delete blobs nothing refers to")
+    args = parser.parse_args(argv)
+
+    store = FirmwareStore(args.root)
+    if args.command == "add":
+        entry = store.put_file(args.folder, args.filename, args.source)
+        print(f"{args.folder}/{args.filename} -> {entry['checksum']} ({entry['size']} bytes)")
+    elif args.command == "import":
+        for folder in args.folders:
+            for name in sorted(os.listdir(folder)):
+                if name.startswith(".") or not os.path.isfile(os.path.join(folder, name)):
+                    continue
+                entry = store.adopt(folder, name)
+                print(f"{folder}/{name} -> {entry['checksum']}")
+    elif args.command == "stats":
+        print(json.dumps(store.stats(), indent=2))
+    elif args.command == "gc":
+        removed, freed = store.gc()
+        print(f"Removed {removed} unreferenced blobs ({freed} bytes).")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# flash_scheduler.py
+"""
+Campaign scheduler for a vehicle with many ECUs.
+
+Each ECU is an EcuNode from ecu_receiver with its own A/B slots. Independent
+ECUs are flashed in parallel; image transfers share their bus bandwidth
+evenly, each bus limits how many ECUs it feeds at once, and an ECU only
+starts once everything it depends on has booted successfully.
+
+The campaign is simulated with discrete events, so a campaign of any length
+finishes instantly and gives the same timings every run. The report compares
+the parallel campaign time against the current serial receiver, which
+handles one image at a time with a cooldown after each.
+
+Usage:
+    python flash_scheduler.py                 # built-in demo vehicle
+    python flash_scheduler.py campaign.json   # custom campaign
+"""
+import heapq
+import json
+import sys
+from ecu_receiver import EcuNode, boot_outcome, extract_version, OUTCOME_SUCCESS
+
+DEFAULT_WRITE_KBPS = 8000      # Flash write speed once the image is on the ECU
+DEFAULT_VERIFY_SECONDS = 0.5
+DEFAULT_REBOOT_SECONDS = 2.5
+DEFAULT_COOLDOWN_SECONDS = 4.0  # Pause the serial receiver takes after each image
+EPSILON = 1e-9
+
+DEMO_CAMPAIGN = {
+    "buses": {
+        "ethernet": {"bandwidth_kbps": 100000, "max_parallel": 4},
+        "powertrain_can": {"bandwidth_kbps": 500, "max_parallel": 2},
+        "body_can": {"bandwidth_kbps": 250, "max_parallel": 3},
+        "chassis_canfd": {"bandwidth_kbps": 2000, "max_parallel": 2},
+    },
+    "ecus": [
+        {"name": "gateway", "bus": "ethernet", "image": "firmware_v2.0.bin", "image_size": 8388608},
+        {"name": "infotainment", "bus": "ethernet", "image": "firmware_v2.0.bin", "image_size": 67108864, "depends_on": ["gateway"]},
+        {"name": "adas", "bus": "ethernet", "image": "firmware_v2.0.bin", "image_size": 33554432, "depends_on": ["gateway"]},
+        {"name": "engine", "bus": "powertrain_can", "image": "firmware_v2.0.bin", "image_size": 1048576, "depends_on": ["gateway"]},
+        {"name": "transmission", "bus": "powertrain_can", "image": "firmware_v2.0.bin", "image_size": 524288, "depends_on": ["engine"]},
+        {"name": "bms", "bus": "powertrain_can", "image": "firmware_v2.0.bin", "image_size": 786432, "depends_on": ["gateway"]},
+        {"name": "brakes", "bus": "chassis_canfd", "image": "firmware_v2.0.bin", "image_size": 1048576, "depends_on": ["gateway"]},
+        {"name": "steering", "bus": "chassis_canfd", "image": "firmware_v2.0.bin", "image_size": 1048576, "depends_on": ["gateway", "brakes"]},
+        {"name": "airbag", "bus": "chassis_canfd", "image": "firmware_v2.0.bin", "image_size": 262144, "depends_on": ["gateway"]},
+        {"name": "doors", "bus": "body_can", "image": "firmware_v2.0.bin", "image_size": 131072, "depends_on": ["gateway"]},
+        {"name": "lighting", "bus": "body_can", "image": "firmware_v2.0.bin", "image_size": 131072, "depends_on": ["gateway"]},
+        {"name": "climate", "bus": "body_can", "image": "firmware_v2.0.bin", "image_size": 196608, "depends_on": ["gateway"]},
+    ],
+}
+
+def bytes_per_second(kbps):
+    return kbps * 1000.0 / 8.0
+
+def validate_campaign(campaign):
+    """Checks bus references and dependencies, and returns ECU names in a valid order."""
+    buses = campaign.get("buses", {})
+    ecus = {e["name"]: e for e in campaign.get("ecus", [])}
+    if len(ecus) != len(campaign.get("ecus", [])):
+        raise ValueError("Duplicate ECU names in campaign")
+    for ecu in ecus.values():
+        if ecu.get("bus") not in buses:
+            raise ValueError(f"ECU '{ecu['name']}' is on unknown bus '{ecu.get('bus')}'")
+        for dep in ecu.get("depends_on", []):
+            if dep not in ecus:
+                raise ValueError(f"ECU '{ecu['name']}' depends on unknown ECU '{dep}'")
+
+    order, state = [], {}
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dep in ecus[name].get("depends_on", []):
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(name)
+    for name in ecus:
+        visit(name, [])
+    return order
+
+def flash_seconds(ecu, campaign):
+    """Time an ECU spends writing, verifying and rebooting after its transfer."""
+    write_kbps = ecu.get("write_kbps", campaign.get("write_kbps", DEFAULT_WRITE_KBPS))
+    return (ecu["image_size"] / bytes_per_second(write_kbps)
+            + campaign.get("verify_seconds", DEFAULT_VERIFY_SECONDS)
+            + campaign.get("reboot_seconds", DEFAULT_REBOOT_SECONDS))
+
+def serial_campaign_seconds(campaign):
+    """Campaign time with the current receiver: one image at a time, full bus each, cooldown after each."""
+    cooldown = campaign.get("cooldown_seconds", DEFAULT_COOLDOWN_SECONDS)
+    total = 0.0
+    for ecu in campaign["ecus"]:
+        bus = campaign["buses"][ecu["bus"]]
+        total += ecu["image_size"] / bytes_per_second(bus["bandwidth_kbps"]) + flash_seconds(ecu, campaign) + cooldown
+    return total
+
+def run_campaign(campaign, resilience_enabled=True, nodes=None):
+    """
+    Simulates the campaign and returns a report dict. `nodes` maps ECU name to
+    EcuNode; missing nodes start on slot A at v1.0.
+    """
+    order = validate_campaign(campaign)
+    ecus = {e["name"]: e for e in campaign["ecus"]}
+    buses = campaign["buses"]
+    nodes = dict(nodes or {})
+    for name, ecu in ecus.items():
+        nodes.setdefault(name, EcuNode(name=name, bus=ecu["bus"]))
+
+    # Critical-path priority: start the ECUs with the longest chain behind them first
+    dependents = {name: [] for name in ecus}
+    for name, ecu in ecus.items():
+        for dep in ecu.get("depends_on", []):
+            dependents[dep].append(name)
+    priority = {}
+    for name in reversed(order):
+        ecu = ecus[name]
+        own = ecu["image_size"] / bytes_per_second(buses[ecu["bus"]]["bandwidth_kbps"]) + flash_seconds(ecu, campaign)
+        priority[name] = own + max((priority[d] for d in dependents[name]), default=0.0)
+
+    now = 0.0
+    waiting = set(ecus)
+    transfers = {bus: {} for bus in buses}  # bus -> {ecu name: bytes remaining}
+    flashing = []                           # heap of (finish time, ecu name)
+    results = {}
+    bus_busy = {bus: 0.0 for bus in buses}
+
+    def start_ready():
+        """Starts every ECU whose dependencies are done; repeats while skips cascade."""
+        changed = True
+        while changed:
+            changed = False
+            for name in sorted(waiting, key=lambda n: (-priority[n], n)):
+                changed |= try_start(name)
+
+    def try_start(name):
+        deps = ecus[name].get("depends_on", [])
+        if any("outcome" not in results.get(d, {}) for d in deps):
+            return False
+        if any(results[d]["outcome"] != OUTCOME_SUCCESS for d in deps):
+            waiting.discard(name)
+            results[name] = {"ecu": name, "bus": ecus[name]["bus"], "outcome": "skipped",
+                             "reason": "dependency did not update", "start": None, "end": now}
+            return True
+        bus = ecus[name]["bus"]
+        if len(transfers[bus]) >= buses[bus].get("max_parallel", 1):
+            return False
+        waiting.discard(name)
+        transfers[bus][name] = float(ecus[name]["image_size"])
+        results[name] = {"ecu": name, "bus": bus, "start": now}
+        return False
+
+    while True:
+        start_ready()
+        # Bandwidth is shared evenly between the transfers active on a bus
+        next_event = flashing[0][0] if flashing else None
+        for bus, active in transfers.items():
+            if active:
+                rate = bytes_per_second(buses[bus]["bandwidth_kbps"]) / len(active)
+                done_at = now + min(active.values()) / rate
+                if next_event is None or done_at < next_event:
+                    next_event = done_at
+        if next_event is None:
+            break
+
+        elapsed = next_event - now
+        for bus, active in transfers.items():
+            if not active:
+                continue
+            bus_busy[bus] += elapsed
+            rate = bytes_per_second(buses[bus]["bandwidth_kbps"]) / len(active)
+            for name in list(active):
+                active[name] -= rate * elapsed
+                if active[name] <= EPSILON * max(1.0, ecus[name]["image_size"]):
+                    del active[name]
+                    results[name]["transfer_end"] = next_event
+                    heapq.heappush(flashing, (next_event + flash_seconds(ecus[name], campaign), name))
+        now = next_event
+
+        while flashing and flashing[0][0] <= now + EPSILON:
+            _, name = heapq.heappop(flashing)
+            ecu, node = ecus[name], nodes[name]
+            target_slot = node.target_slot
+            outcome = boot_outcome("malicious" in ecu.get("image", "").lower(), resilience_enabled)
+            node.apply_boot_outcome(target_slot, extract_version(ecu.get("image", "")), outcome)
+            results[name].update({"end": now, "outcome": outcome, "active_slot": node.active_slot,
+                                  "active_version": node.active_version})
+
+    serial = serial_campaign_seconds(campaign)
+    outcomes = {}
+    for result in results.values():
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+    return {
+        "ecus": [results[name] for name in order],
+        "outcomes": outcomes,
+        "campaign_seconds": round(now, 3),
+        "serial_seconds": round(serial, 3),
+        "speedup": round(serial / now, 2) if now > 0 else None,
+        "bus_busy_seconds": {bus: round(t, 3) for bus, t in bus_busy.items()},
+    }
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    paths = [a for a in argv if not a.startswith('--')]
+    campaign = DEMO_CAMPAIGN
+    if paths:
+        with open(paths[0]) as f:
+            campaign = json.load(f)
+    try:
+        report = run_campaign(campaign, resilience_enabled="--no-resilience" not in argv)
+    except ValueError as e:
+        print(f"Invalid campaign: {e}", file=sys.stderr)
+        return 2
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# fleet_benchmark.py
+"""
+Headless load generator for the update servers.
+
+Simulates N concurrent TCUs with asyncio. Each simulated TCU sends its own
+X-Vehicle-ID header, polls /check-update and downloads the advertised
+firmware for a configurable share of its checks. Results are written as JSON.
+
+Example (against a zero-delay OEM server):
+    OTA_TIME_SCALE=0 python oem_server.py
+    python fleet_benchmark.py --url http://127.0.0.1:5000 --vehicles 200 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100.0) - 1))
+    return sorted_values[rank]
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.bytes_received = 0
+
+    def record(self, latency, nbytes):
+        self.latencies.append(latency)
+        self.bytes_received += nbytes
+
+    def record_error(self, reason):
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        error_count = sum(self.errors.values())
+        total = len(latencies) + error_count
+        to_ms = lambda v: None if v is None else round(v * 1000, 3)
+        return {
+            "requests": total,
+            "ok": len(latencies),
+            "errors": error_count,
+            "error_rate": (error_count / total) if total else 0.0,
+            "error_breakdown": self.errors,
+            "throughput_rps": (len(latencies) / elapsed) if elapsed > 0 else 0.0,
+            "bytes_received": self.bytes_received,
+            "latency_ms": {
+                "min": to_ms(latencies[0] if latencies else None),
+                "p50": to_ms(percentile(latencies, 50)),
+                "p95": to_ms(percentile(latencies, 95)),
+                "p99": to_ms(percentile(latencies, 99)),
+                "max": to_ms(latencies[-1] if latencies else None),
+            },
+        }
+
+async def http_get(host, port, path, headers, timeout):
+    """
+    Minimal HTTP/1.1 GET. Each request deliberately opens a fresh
+    connection, so every sample pays the full connect cost. Returns
+    (status, headers, body).
+    """
+    async def do_request():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            lines = [f"GET {path} HTTP/1.1", f"Host: {host}:{port}", "Connection: close"]
+            lines += [f"{k}: {v}" for k, v in headers.items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+
+            status_line = await reader.readline()
+            parts = status_line.decode("latin-1").split(" ", 2)
+            if len(parts) < 2:
+                raise ConnectionError("malformed status line")
+            status = int(parts[1])
+
+            response_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+
+            if "content-length" in response_headers:
+                body = await reader.readexactly(int(response_headers["content-length"]))
+            else:
+                body = await reader.read()
+            return status, response_headers, body
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+    return await asyncio.wait_for(do_request(), timeout)
+
+async def simulated_tcu(vehicle_id, args, host, port, stats, deadline, rng):
+    """One vehicle: check, maybe download, think, repeat until the deadline."""
+    headers = {"X-Vehicle-ID": vehicle_id, "User-Agent": "fleet-benchmark"}
+    if args.current_version:
+        headers["X-Current-Version"] = args.current_version
+
+    # Spread the first requests out so the fleet does not start in lockstep
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    last_info = None
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        info = None
+        try:
+            status, response_headers, body = await http_get(host, port, "/check-update", headers, args.timeout)
+            if status == 200:
+                stats["check-update"].record(time.perf_counter() - start, len(body))
+                info = last_info = json.loads(body)
+                if args.conditional and "etag" in response_headers:
+                    headers["If-None-Match"] = response_headers["etag"]
+            elif status == 304 and last_info is not None:
+                stats["check-update"].record(time.perf_counter() - start, len(body))
+                info = last_info
+            else:
+                stats["check-update"].record_error(f"http_{status}")
+        except asyncio.TimeoutError:
+            stats["check-update"].record_error("timeout")
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            stats["check-update"].record_error(type(e).__name__)
+
+        filename = info.get("filename") if info else None
+        if filename and rng.random() < args.download_ratio:
+            start = time.perf_counter()
+            try:
+                status, _, body = await http_get(host, port, f"/download/{filename}", headers, args.timeout)
+                if status == 200:
+                    stats["download"].record(time.perf_counter() - start, len(body))
+                else:
+                    stats["download"].record_error(f"http_{status}")
+            except asyncio.TimeoutError:
+                stats["download"].record_error("timeout")
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                stats["download"].record_error(type(e).__name__)
+
+        if args.think_time > 0:
+            await asyncio.sleep(rng.expovariate(1.0 / args.think_time))
+
+async def run_benchmark(args):
+    target = urlsplit(args.url)
+    host, port = target.hostname or "127.0.0.1", target.port or 80
+    stats = {"check-update": EndpointStats(), "download": EndpointStats()}
+    rng = random.Random(args.seed)
+
+    started_wall = time.time()
+    started = time.monotonic()
+    deadline = started + args.duration
+    tasks = [
+        asyncio.create_task(simulated_tcu(f"{args.vin_prefix}{i:06d}", args, host, port, stats, deadline, random.Random(rng.random())))
+        for i in range(args.vehicles)
+    ]
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    return {
+        "target": args.url,
+        "started_at": started_wall,
+        "elapsed_s": round(elapsed, 3),
+        "config": {
+            "vehicles": args.vehicles,
+            "duration_s": args.duration,
+            "download_ratio": args.download_ratio,
+            "think_time_s": args.think_time,
+            "timeout_s": args.timeout,
+            "conditional": args.conditional,
+            "seed": args.seed,
+        },
+        "endpoints": {name: s.summary(elapsed) for name, s in stats.items()},
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a fleet of TCUs against an update server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Server base URL (OEM: 5000, malicious: 5001)")
+    parser.add_argument("--vehicles", type=int, default=100, help="Number of concurrent simulated TCUs")
+    parser.add_argument("--duration", type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument("--download-ratio", type=float, default=0.1, help="Share of checks followed by a download (0-1)")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean pause between a TCU's cycles in seconds (0 = none)")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="Window over which TCUs start, in seconds")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds")
+    parser.add_argument("--current-version", default="1.0", help="Version each TCU reports (empty to omit)")
+    parser.add_argument("--vin-prefix", default="SIMVIN", help="Prefix for generated X-Vehicle-ID values")
+    parser.add_argument("--conditional", action="store_true", help="Send the last check's ETag as If-None-Match, like tcu_client")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for reproducible request mixes")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if all(e["ok"] for e in report["endpoints"].values() if e["requests"]) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,420 @@
+# fleet_sim.py
+"""
+In-process simulation of a whole vehicle fleet through an update campaign.
+
+Every vehicle makes the same decisions as the real components: the OEM offer
+comes from a ReleaseCatalog with channels and staged rollouts, the TCU picks
+between offers with tcu_client.select_best_update and verifies the image with
+checksum_accepted, and the ECU's trial boot goes through ecu_receiver's
+boot_outcome and A/B boot_transition. Nothing goes over HTTP and no real time
+passes: one heap of (time, event) drives the fleet, and each vehicle's state
+is a row across a few typed arrays (about 20 bytes), so hundreds of thousands
+of vehicles fit in one process.
+
+The report gives, for every OEM release, the share of the vehicles that can
+get it which run it (or something newer) over time, and how often installs
+were rejected, rolled back or bricked an ECU.
+
+Usage:
+    python fleet_sim.py                         # built-in demo campaign, 100k vehicles
+    python fleet_sim.py campaign.json --vehicles 250000 --push -o report.json
+"""
+import argparse
+import heapq
+import json
+import random
+import sys
+import time
+from array import array
+from shared_utils import (ReleaseCatalog, RELEASE_CHANNELS, DEFAULT_CHANNEL, ROLLOUT_BUCKETS, rollout_bucket,
+                          version_to_tuple)
+from ecu_receiver import boot_outcome, boot_transition, OUTCOME_SUCCESS, OUTCOME_ROLLED_BACK, OUTCOME_BRICKED, BOOT_HUNG
+from tcu_client import select_best_update, checksum_accepted
+from flash_scheduler import flash_seconds, bytes_per_second
+
+try:
+    import resource  # POSIX only; used for the peak memory figure
+except ImportError:
+    resource = None
+
+DEFAULT_VEHICLES = 100000
+DEFAULT_POLL_HOURS = 4.0
+DEFAULT_BANDWIDTH_KBPS = (500, 20000)
+DEFAULT_DOWNLOAD_FAILURE_RATE = 0.02
+DEFAULT_PUSH_LATENCY_SECONDS = (0.02, 0.5)
+DEFAULT_SAMPLE_MINUTES = 60
+FACTORY_VERSION = "1.0"
+SLOTS = ("A", "B")
+
+# Event kinds, packed with the vehicle number into one int: vehicle << 2 | kind
+POLL, NOTIFY, DOWNLOADED, BOOTED = range(4)
+
+# Bits of the per-vehicle flags column
+RESILIENCE = 1
+CHECKSUM = 2
+BUSY = 4
+BRICKED = 8
+EVER_ROLLED_BACK = 16
+
+DEMO_FLEET_CAMPAIGN = {
+    "duration_hours": 96,
+    "sample_minutes": 60,
+    "fleet": {
+        "channels": {"stable": 0.9, "beta": 0.08, "dev": 0.02},
+        "checksum_enabled": 0.8,
+        "resilience_enabled": 0.9,
+        "poll_hours": 4,
+        "bandwidth_kbps": [500, 20000],
+        "download_failure_rate": 0.02,
+    },
+    "releases": [
+        # rollout: [hours since start, percent of vehicles] steps; the first one deploys the release
+        {"version": "1.1", "size": 16777216, "rollout": [[0, 1], [12, 10], [24, 50], [36, 100]]},
+        {"version": "1.2", "size": 16777216, "channel": "beta", "rollout": [[48, 20], [60, 100]]},
+        # A man-in-the-middle reaching `reach` percent of the fleet offers a higher, fake-checksum version
+        {"version": "2.0", "source": "malicious", "size": 1048576, "at_hours": 54, "until_hours": 78, "reach": 5},
+    ],
+}
+
+class _PublishedImages:
+    """The manifest side of the catalog: the entries deployed so far."""
+    def __init__(self):
+        self._entries = []
+
+    def publish(self, version, size):
+        self._entries.append({"filename": f"firmware_v{version}.bin", "version": version,
+                              "version_tuple": version_to_tuple(version), "size": size,
+                              "checksum": f"sha256-of-v{version}"})
+        self._entries.sort(key=lambda e: e["version_tuple"])
+
+    def entries(self):
+        return list(self._entries)
+
+class FleetSimulation:
+    """Runs one campaign over a fleet; build_report() summarises it."""
+    def __init__(self, campaign, vehicles=DEFAULT_VEHICLES, seed=1, push=False, vin_prefix="SIMVIN"):
+        self.campaign = campaign
+        self.vehicles = vehicles
+        self.push = push
+        self.rng = random.Random(seed)
+        fleet = campaign.get("fleet", {})
+        self.end = campaign.get("duration_hours", 96) * 3600.0
+        self.sample_step = campaign.get("sample_minutes", DEFAULT_SAMPLE_MINUTES) * 60.0
+        self.poll_seconds = fleet.get("poll_hours", DEFAULT_POLL_HOURS) * 3600.0
+        self.failure_rate = fleet.get("download_failure_rate", DEFAULT_DOWNLOAD_FAILURE_RATE)
+        self.push_latency = tuple(fleet.get("push_latency_seconds", DEFAULT_PUSH_LATENCY_SECONDS))
+
+        self._load_releases(campaign.get("releases", []))
+        self.published = _PublishedImages()
+        self.catalog = ReleaseCatalog(self.published, policy_path=None)
+        self.attacks = []  # Indexes of the malicious offers currently being served
+
+        # --- PER-VEHICLE COLUMNS ---
+        n = vehicles
+        self.bucket = array('H', (rollout_bucket(f"{vin_prefix}{i:06d}") for i in range(n)))
+        self.exposure = array('H', (self.rng.randrange(ROLLOUT_BUCKETS) for _ in range(n)))  # Who the attacker reaches
+        self.channel = array('B', self._draw_channels(fleet.get("channels", {DEFAULT_CHANNEL: 1.0}), n))
+        low, high = fleet.get("bandwidth_kbps", DEFAULT_BANDWIDTH_KBPS)
+        self.bandwidth = array('f', (bytes_per_second(self.rng.uniform(low, high)) for _ in range(n)))
+        checksum_share = fleet.get("checksum_enabled", 1.0)
+        resilience_share = fleet.get("resilience_enabled", 1.0)
+        self.flags = array('B', ((CHECKSUM if self.rng.random() < checksum_share else 0)
+                                 | (RESILIENCE if self.rng.random() < resilience_share else 0) for _ in range(n)))
+        self.slots = (array('H', [0]) * n, array('H', [1]) * n)  # Version index per slot, as EcuNode: A=1.0, B empty
+        self.active = array('B', [0]) * n
+        self.bad = array('B', [0]) * n      # Bit per slot holding an image that failed to boot
+        self.pending = array('H', [0]) * n  # Version being installed while BUSY
+        self.eligible = self._eligible()
+
+        # --- COUNTERS ---
+        self.running = [0] * len(self.versions)  # Vehicles whose active slot holds each version
+        self.running[0] = n
+        self.totals = {"checks": 0, "no_update": 0, "downloads": 0, "download_failed": 0, "rejected": 0,
+                       OUTCOME_SUCCESS: 0, OUTCOME_ROLLED_BACK: 0, OUTCOME_BRICKED: 0}
+        self.busy = 0
+        self.bricked = 0
+        self.events = 0
+        self.peak_queue = 0
+        self.samples = []
+
+    def _load_releases(self, releases):
+        """Version table: index 0 is the factory image, 1 the empty slot, then the campaign's releases."""
+        self.versions = [{"version": FACTORY_VERSION, "version_tuple": version_to_tuple(FACTORY_VERSION), "legit": True},
+                         {"version": "0.0", "version_tuple": (0, 0), "legit": False}]
+        self.timeline = []  # (seconds, version index, action, value)
+        for spec in releases:
+            version = ".".join(map(str, version_to_tuple(str(spec["version"]))))
+            if any(v["version"] == version for v in self.versions):
+                raise ValueError(f"Version {version} appears twice in the campaign")
+            malicious = spec.get("source") == "malicious"
+            entry = {"version": version, "version_tuple": version_to_tuple(version), "legit": not malicious,
+                     "size": int(spec.get("size", 1048576)), "channel": spec.get("channel", DEFAULT_CHANNEL),
+                     "checksum": f"sha256-of-v{version}", "source": "malicious" if malicious else "oem",
+                     "attempts": 0, "rejected": 0, "download_failed": 0,
+                     OUTCOME_SUCCESS: 0, OUTCOME_ROLLED_BACK: 0, OUTCOME_BRICKED: 0}
+            if entry["channel"] not in RELEASE_CHANNELS:
+                raise ValueError(f"Release {version} is on unknown channel '{entry['channel']}'")
+            index = len(self.versions)
+            self.versions.append(entry)
+            if malicious:
+                entry["reach"] = int(round(float(spec.get("reach", 100)) * ROLLOUT_BUCKETS / 100.0))
+                # What the attacker advertises: a version above everything, with a checksum the image does not have
+                entry["offer"] = {"version": version, "filename": f"firmware_v{version}.bin",
+                                  "checksum": "0" * 64, "source": "oem"}
+                self.timeline.append((spec.get("at_hours", 0) * 3600.0, index, "attack", True))
+                if "until_hours" in spec:
+                    self.timeline.append((spec["until_hours"] * 3600.0, index, "attack", False))
+            else:
+                for step, (hours, percent) in enumerate(spec.get("rollout", [[spec.get("at_hours", 0), 100]])):
+                    self.timeline.append((hours * 3600.0, index, "deploy" if step == 0 else "rollout", percent))
+        self.timeline.sort(key=lambda item: item[0])
+        self.version_index = {v["version"]: i for i, v in enumerate(self.versions)}
+        self.oem_releases = [(i, v) for i, v in enumerate(self.versions) if i >= 2 and v["legit"]]
+
+    def _draw_channels(self, shares, n):
+        names = [c for c in RELEASE_CHANNELS if shares.get(c)]
+        if not names or set(shares) - set(RELEASE_CHANNELS):
+            raise ValueError(f"fleet.channels must give shares for {', '.join(RELEASE_CHANNELS)}")
+        weights = [shares[c] for c in names]
+        ranks = [RELEASE_CHANNELS.index(c) for c in names]
+        return self.rng.choices(ranks, weights, k=n)
+
+    # --- CAMPAIGN TIMELINE ---
+    def _apply_step(self, now, index, action, value, queue):
+        release = self.versions[index]
+        if action == "attack":
+            if value:
+                self.attacks.append(index)
+            elif index in self.attacks:
+                self.attacks.remove(index)
+            return
+        before = self._offer_tables()
+        if action == "deploy":
+            self.published.publish(release["version"], release["size"])
+        self.catalog.set_policy(release["version"], release["channel"], value)
+        if self.push:
+            self._notify_changed(now, before, queue)
+
+    def _notify_changed(self, now, before, queue):
+        """Push mode: vehicles whose offer changed get a notification after a short delay."""
+        changed = [bytearray(old is not new for old, new in zip(old_table, new_table))
+                   for old_table, new_table in zip(before, self._offer_tables())]
+        low, high = self.push_latency
+        uniform, bucket, channel, flags = self.rng.uniform, self.bucket, self.channel, self.flags
+        for v in range(self.vehicles):
+            if changed[channel[v]][bucket[v]] and not flags[v] & BRICKED:
+                heapq.heappush(queue, (now + uniform(low, high), v << 2 | NOTIFY))
+
+    def _offer_tables(self):
+        """Per channel, the release offered to each rollout bucket."""
+        return [[self.catalog.release_for_bucket(b, c) for b in range(ROLLOUT_BUCKETS)] for c in RELEASE_CHANNELS]
+
+    # --- VEHICLE EVENTS ---
+    def run(self):
+        """Simulates the campaign to its end and returns the wall-clock seconds it took."""
+        started = time.perf_counter()
+        rng = self.rng
+        poll_seconds = self.poll_seconds
+        # The fleet's polls are spread evenly over the first interval
+        queue = [(rng.uniform(0, poll_seconds), v << 2 | POLL) for v in range(self.vehicles)]
+        heapq.heapify(queue)
+        steps = iter(self.timeline)
+        step = next(steps, None)
+        next_sample = 0.0
+        heappush, heappop = heapq.heappush, heapq.heappop
+        while True:
+            now = queue[0][0] if queue else self.end
+            while step is not None and step[0] <= now:
+                self._apply_step(step[0], *step[1:], queue)
+                step = next(steps, None)
+                now = queue[0][0] if queue else self.end
+            if now > self.end:
+                break
+            while next_sample <= now:
+                self._sample(next_sample, len(queue))
+                next_sample += self.sample_step
+            if not queue:
+                break
+            now, code = heappop(queue)
+            self.events += 1
+            v, kind = code >> 2, code & 3
+            if kind == POLL:
+                if self.flags[v] & BRICKED:
+                    continue  # A hung ECU leaves the vehicle offline for good
+                heappush(queue, (now + poll_seconds * rng.uniform(0.9, 1.1), code))
+                self._check(v, now, queue)
+            elif kind == NOTIFY:
+                self._check(v, now, queue)
+            elif kind == DOWNLOADED:
+                self._downloaded(v, now, queue)
+            else:
+                self._booted(v)
+        while next_sample <= self.end:
+            self._sample(next_sample, len(queue))
+            next_sample += self.sample_step
+        return time.perf_counter() - started
+
+    def _check(self, v, now, queue):
+        """The TCU's check: ask every server, keep the best offer above the running version."""
+        if self.flags[v] & (BUSY | BRICKED):
+            return
+        self.totals["checks"] += 1
+        running = self.versions[self.slots[self.active[v]][v]]
+        offers = [self.catalog.release_for_bucket(self.bucket[v], RELEASE_CHANNELS[self.channel[v]])]
+        for index in self.attacks:
+            attack = self.versions[index]
+            if self.exposure[v] < attack["reach"]:
+                offers.append(attack["offer"])
+        best = select_best_update(running["version_tuple"], offers)
+        if best is None:
+            self.totals["no_update"] += 1
+            return
+        index = self.version_index[best["version"]]
+        release = self.versions[index]
+        release["attempts"] += 1
+        self.totals["downloads"] += 1
+        self.flags[v] |= BUSY
+        self.busy += 1
+        self.pending[v] = index
+        heapq.heappush(queue, (now + release["size"] / self.bandwidth[v], v << 2 | DOWNLOADED))
+
+    def _downloaded(self, v, now, queue):
+        release = self.versions[self.pending[v]]
+        if self.rng.random() < self.failure_rate:
+            self._finish(v, release, "download_failed")
+            return
+        advertised = release["offer"]["checksum"] if "offer" in release else release["checksum"]
+        if not checksum_accepted(release["checksum"], advertised, self.flags[v] & CHECKSUM):
+            self._finish(v, release, "rejected")
+            return
+        heapq.heappush(queue, (now + flash_seconds({"image_size": release["size"]}, self.campaign), v << 2 | BOOTED))
+
+    def _booted(self, v):
+        """The ECU's trial boot of the inactive slot, through the same A/B state machine as the receiver."""
+        index = self.pending[v]
+        release = self.versions[index]
+        current, target = self.active[v], 1 - self.active[v]
+        old_index = self.slots[current][v]
+        outcome = boot_outcome(not release["legit"], bool(self.flags[v] & RESILIENCE))
+        new_slot, failed, boot_state = boot_transition(SLOTS[current], SLOTS[target], outcome)
+        self.slots[target][v] = index
+        self.active[v] = SLOTS.index(new_slot)
+        self.bad[v] = (self.bad[v] | (1 << target)) if failed else (self.bad[v] & ~(1 << target))
+        if new_slot != SLOTS[current]:
+            self.running[old_index] -= 1
+            self.running[index] += 1
+        if failed:
+            self.flags[v] |= EVER_ROLLED_BACK
+        if boot_state == BOOT_HUNG:
+            self.flags[v] |= BRICKED
+            self.bricked += 1
+        self._finish(v, release, outcome)
+
+    def _finish(self, v, release, outcome):
+        release[outcome] += 1
+        self.totals[outcome] += 1
+        self.flags[v] &= ~BUSY
+        self.busy -= 1
+
+    # --- REPORT ---
+    def _eligible(self):
+        """Per OEM release: vehicles on a channel that sees it or a newer release."""
+        per_rank = [0] * len(RELEASE_CHANNELS)
+        for rank in self.channel:
+            per_rank[rank] += 1
+        eligible = {}
+        for i, release in self.oem_releases:
+            newer = [RELEASE_CHANNELS.index(r["channel"]) for _, r in self.oem_releases
+                     if r["version_tuple"] >= release["version_tuple"]]
+            eligible[i] = sum(per_rank[min(newer):])
+        return eligible
+
+    def _sample(self, now, queued):
+        self.peak_queue = max(self.peak_queue, queued)
+        on_release = {}
+        for i, release in self.oem_releases:
+            running = sum(self.running[j] for j, other in self.oem_releases
+                          if other["version_tuple"] >= release["version_tuple"])
+            eligible = self.eligible[i]
+            on_release[release["version"]] = round(running / eligible, 4) if eligible else None
+        self.samples.append({
+            "hours": round(now / 3600.0, 3),
+            "on_release": on_release,
+            "updating": self.busy,
+            "rolled_back": self.totals[OUTCOME_ROLLED_BACK],
+            "bricked": self.bricked,
+        })
+
+    def build_report(self, wall_seconds):
+        boots = self.totals[OUTCOME_SUCCESS] + self.totals[OUTCOME_ROLLED_BACK] + self.totals[OUTCOME_BRICKED]
+        columns = (self.bucket, self.exposure, self.channel, self.bandwidth, self.flags,
+                   self.slots[0], self.slots[1], self.active, self.bad, self.pending)
+        state_bytes = sum(len(c) * c.itemsize for c in columns)
+        releases = {}
+        for index, release in enumerate(self.versions[2:], start=2):
+            summary = {k: release[k] for k in ("source", "channel", "size", "attempts", "download_failed", "rejected",
+                                               OUTCOME_SUCCESS, OUTCOME_ROLLED_BACK, OUTCOME_BRICKED)}
+            summary["running_at_end"] = self.running[index]
+            if release["legit"]:
+                curve = [(s["hours"], s["on_release"][release["version"]]) for s in self.samples]
+                for pct in (50, 90, 99):
+                    summary[f"hours_to_{pct}pct"] = next((h for h, share in curve if share is not None
+                                                          and share * 100 >= pct), None)
+            releases[release["version"]] = summary
+        flags = self.flags
+        return {
+            "config": {
+                "vehicles": self.vehicles,
+                "duration_hours": self.end / 3600.0,
+                "poll_hours": self.poll_seconds / 3600.0,
+                "push": self.push,
+                "checksum_enabled": sum(1 for f in flags if f & CHECKSUM),
+                "resilience_enabled": sum(1 for f in flags if f & RESILIENCE),
+                "channels": {c: self.channel.count(rank) for rank, c in enumerate(RELEASE_CHANNELS)},
+            },
+            "totals": self.totals,
+            "rollback_rate": round(self.totals[OUTCOME_ROLLED_BACK] / boots, 6) if boots else 0.0,
+            "brick_rate": round(self.totals[OUTCOME_BRICKED] / boots, 6) if boots else 0.0,
+            "vehicles_rolled_back": sum(1 for f in flags if f & EVER_ROLLED_BACK),
+            "vehicles_bricked": self.bricked,
+            "releases": releases,
+            "completion": self.samples,
+            "performance": {
+                "events": self.events,
+                "wall_seconds": round(wall_seconds, 3),
+                "events_per_second": round(self.events / wall_seconds) if wall_seconds > 0 else None,
+                "state_bytes_per_vehicle": round(state_bytes / self.vehicles, 1) if self.vehicles else 0,
+                "peak_queue": self.peak_queue,
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1) if resource else None,
+            },
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate an update campaign across a large vehicle fleet.")
+    parser.add_argument("campaign", nargs="?", help="Campaign JSON (default: built-in demo)")
+    parser.add_argument("--vehicles", type=int, default=DEFAULT_VEHICLES)
+    parser.add_argument("--push", action="store_true", help="Vehicles also get release notifications, as with push_updates")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args(argv)
+
+    if args.campaign:
+        with open(args.campaign, encoding='utf-8') as f:
+            campaign = json.load(f)
+    else:
+        campaign = DEMO_FLEET_CAMPAIGN
+    try:
+        sim = FleetSimulation(campaign, args.vehicles, args.seed, args.push)
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Invalid campaign: {e}", file=sys.stderr)
+        return 2
+    wall = sim.run()
+    text = json.dumps(sim.build_report(wall), indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,14 +4,22 @@ import tkinter as tk
 from tkinter import filedialog
 import threading
 import queue
+import codecs
 import os
-import shutil
-import configparser
 import subprocess
 import sys
-import csv
 import datetime
-from shared_utils import find_latest_version
+import time
+from shared_utils import find_latest_version, next_minor_version, decode_frame, build_compressed_variants, FirmwareStore, DEFAULT_STORE_ROOT, config_service, remove_tree
+from log_store import LogStore, DEFAULT_LOG_ROOT
+
+# --- LOG DRAIN LIMITS ---
+QUEUE_BATCH_LIMIT = 2000   # Messages handled per tick, so one burst cannot stall the Tk loop
+QUEUE_POLL_MS = 100        # Tick interval when the queue is drained
+QUEUE_BACKLOG_POLL_MS = 10 # Tick interval while a backlog remains
+STREAM_READ_SIZE = 65536   # Bytes of component output read per wakeup
+STORE_FLUSH_INTERVAL = 0.5   # Seconds between flushes of the log store
+NEW_RUN = "NEW_RUN"        # Log writer command: close the current run and start another
 
 # --- THEME INITIALIZATION ---
 ctk.set_appearance_mode("Dark") 
@@ -32,8 +40,10 @@ class OTASimulatorApp(ctk.CTk):
         self.grid_rowconfigure(2, weight=1)
 
         self.log_queue = queue.Queue()
+        self.store_queue = queue.Queue()
         self.simulation_running = False
         self.processes = {} 
+        self.firmware_store = FirmwareStore()
         self.current_theme = "Dark" # Track state
 
         # --- CONTROL HEADER ---
@@ -80,8 +90,14 @@ class OTASimulatorApp(ctk.CTk):
         self.progress_bar.set(0)
         self.progress_bar.pack(fill="x", padx=15, pady=(5, 15))
 
+        # Lookup tables for process_queue, built once
+        self.box_map = {'server': self.server_log, 'malicious_server': self.malicious_server_log, 'tcu': self.tcu_log, 'ecu': self.ecu_log}
+        self.status_map = {'server': self.server_status, 'malicious_server': self.malicious_server_status, 'tcu': self.tcu_status, 'ecu': self.ecu_status}
+
         # --- INITIALIZATION ---
-        self.after(100, self.process_queue)
+        self.log_writer_thread = threading.Thread(target=self.log_writer_loop, daemon=True)
+        self.log_writer_thread.start()
+        self.after(QUEUE_POLL_MS, self.process_queue)
         self.ensure_config_exists()
         self.update_button_visuals() 
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -147,89 +163,156 @@ class OTASimulatorApp(ctk.CTk):
                 box.configure(fg_color="#1e1e1e", text_color="#00e676", border_width=0)
 
     # --- CORE LOGIC ---
+    def log_writer_loop(self):
+        """
+        Appends log rows to the per-run log store on a background thread.
+        Use `python log_store.py export` to get the simulation_logs.csv format.
+        """
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        store = LogStore(os.path.join(script_dir, DEFAULT_LOG_ROOT))
+        store.recover()  # Seal what a crashed session left open
+        try:
+            while True:
+                try:
+                    rows = [self.store_queue.get(timeout=STORE_FLUSH_INTERVAL)]
+                except queue.Empty:
+                    continue
+                try:
+                    while True: rows.append(self.store_queue.get_nowait())
+                except queue.Empty: pass
+                for row in rows:
+                    if row is None:  # Shutdown sentinel
+                        return
+                    if row == NEW_RUN:
+                        store.start_run()
+                    else:
+                        store.append(*row)
+                store.flush()
+        finally:
+            store.close()
+
     def process_queue(self):
+        """
+        Drains up to QUEUE_BATCH_LIMIT messages per tick. Stream readers
+        enqueue a list of messages per chunk read, other callers a single
+        message. Log lines are batched into one insert per text box, and
+        only the latest status and progress values are applied.
+        """
+        pending_lines = {}   # target -> [text, tags, text, tags, ...] for a single Text.insert
+        latest_status = {}
+        latest_progress = None
+        handled = 0
         try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            log_path = os.path.join(script_dir, "simulation_logs.csv")
-            
-            with open(log_path, "a", newline='', encoding='utf-8') as log_file:
-                writer = csv.writer(log_file)
-                while True:
-                    msg_type, target, message, color = self.log_queue.get_nowait()
-                    
-                    timestamp = datetime.datetime.now().isoformat()
-                    writer.writerow([timestamp, target, msg_type, message])
-                    
-                    box_map = {'server': self.server_log, 'malicious_server': self.malicious_server_log, 'tcu': self.tcu_log, 'ecu': self.ecu_log}
-                    status_map = {'server': self.server_status, 'malicious_server': self.malicious_server_status, 'tcu': self.tcu_status, 'ecu': self.ecu_status}
+            while handled < QUEUE_BATCH_LIMIT:
+                try:
+                    item = self.log_queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch = item if isinstance(item, list) else [item]
+                handled += len(batch)
+                
+                for item in batch:
+                    # Events from components carry the time they were emitted
+                    msg_type, target, message, color = item[:4]
+                    timestamp = item[4] if len(item) > 4 else datetime.datetime.now().isoformat()
+                    self.store_queue.put([timestamp, target, msg_type, message])
                     
                     if msg_type == 'log':
-                        box = box_map.get(target)
-                        if box:
-                            box.configure(state='normal')
-                            
+                        if target in self.box_map:
                             # --- UPDATED: Apply Red Color to Critical Alerts ---
-                            if "[!!!]" in message:
-                                box.insert("end", message + '\n', "critical")
-                            else:
-                                box.insert("end", message + '\n')
-                            # ---------------------------------------------------
-                            
-                            box.configure(state='disabled')
-                            box.see("end")
+                            pending_lines.setdefault(target, []).extend((message + '\n', "critical" if "[!!!]" in message else ()))
                     elif msg_type == 'status':
-                        indicator = status_map.get(target)
-                        if indicator: 
-                            indicator.configure(text=message, text_color=color)
+                        latest_status[target] = (message, color)
                     elif msg_type == 'progress' and target == 'tcu':
-                        self.progress_bar.set(float(message) / 100)
-        except queue.Empty: pass
+                        latest_progress = message
+
+            for target, insert_args in pending_lines.items():
+                box = self.box_map[target]
+                box.configure(state='normal')
+                box._textbox.insert("end", *insert_args)
+                box.configure(state='disabled')
+                box.see("end")
+            for target, (message, color) in latest_status.items():
+                indicator = self.status_map.get(target)
+                if indicator: 
+                    indicator.configure(text=message, text_color=color)
+            if latest_progress is not None:
+                self.progress_bar.set(float(latest_progress) / 100)
         except Exception as e: print(f"Logging Error: {e}")
-        finally: self.after(100, self.process_queue)
+        finally:
+            backlog = handled >= QUEUE_BATCH_LIMIT
+            self.after(QUEUE_BACKLOG_POLL_MS if backlog else QUEUE_POLL_MS, self.process_queue)
 
-    def parse_and_log(self, line, target_component):
+    def parse_and_log(self, line, target_component, out):
+        """Appends the queue messages for one line of component output to out."""
+        events = decode_frame(line)
+        if events is not None:
+            # Convert the sender's monotonic timestamps to wall-clock time
+            now_wall, now_mono = time.time(), time.monotonic()
+            for event in events:
+                msg_type, content = event.get('t'), str(event.get('m', '')).strip()
+                sent_at = now_wall - max(0.0, now_mono - event.get('ts', now_mono))
+                timestamp = datetime.datetime.fromtimestamp(sent_at).isoformat()
+                if msg_type == 'status':
+                    out.append(('status', target_component, content, event.get('c') or "#FFFFFF", timestamp))
+                elif msg_type in ['log', 'progress']:
+                    out.append((msg_type, target_component, content, None, timestamp))
+                else:
+                    out.append(('log', target_component, content, None, timestamp))
+            return
+        
+        # Plain text output (Flask banner, tracebacks)
         line = line.strip()
         if not line: return
         parts = line.split(':', 1)
         if len(parts) != 2:
-            self.log_queue.put(('log', target_component, line, None))
+            out.append(('log', target_component, line, None))
             return
         msg_type, content = parts[0].lower().strip(), parts[1].strip()
         if msg_type == 'status':
             status_parts = content.split(':', 1)
             color = status_parts[1].strip() if len(status_parts) == 2 else "#FFFFFF"
-            self.log_queue.put(('status', target_component, status_parts[0].strip(), color))
+            out.append(('status', target_component, status_parts[0].strip(), color))
         elif msg_type in ['log', 'progress']:
-            self.log_queue.put((msg_type, target_component, content, None))
+            out.append((msg_type, target_component, content, None))
         else:
-            self.log_queue.put(('log', target_component, line, None))
+            out.append(('log', target_component, line, None))
 
     def stream_reader(self, process_stdout, target_component):
+        """
+        Reads whatever output is available (up to STREAM_READ_SIZE bytes) per
+        wakeup instead of one line, and enqueues the messages of all complete
+        lines in it as one list.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        partial = ""
         try:
-            for line in iter(process_stdout.readline, ''):
-                self.parse_and_log(line, target_component)
+            while True:
+                chunk = process_stdout.buffer.read1(STREAM_READ_SIZE)
+                text = partial + decoder.decode(chunk, final=not chunk)
+                lines = text.split('\n')
+                partial = lines.pop() if chunk else ""
+                batch = []
+                for line in lines:
+                    if line: self.parse_and_log(line, target_component, batch)
+                if batch: self.log_queue.put(batch)
+                if not chunk: break
         finally:
             process_stdout.close()
             
     def ensure_config_exists(self):
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-        if not config.has_section('TCU'): config.add_section('TCU')
-        if not config.has_option('TCU', 'current_version'): config.set('TCU', 'current_version', '1.0')
-        if not config.has_section('Server'): config.add_section('Server')
-        if not config.has_option('Server', 'oem_url'): config.set('Server', 'oem_url', 'http://127.0.0.1:5000')
-        if not config.has_option('Server', 'malicious_url'): config.set('Server', 'malicious_url', 'http://127.0.0.1:5001')
-        if not config.has_section('Security'): config.add_section('Security')
-        if not config.has_option('Security', 'checksum_verification_enabled'): config.set('Security', 'checksum_verification_enabled', 'true')
-        if not config.has_option('Security', 'ecu_resilience_enabled'): config.set('Security', 'ecu_resilience_enabled', 'true')
-        if not config.has_section('Folders'): config.add_section('Folders')
-        if not config.has_option('Folders', 'ecu_shared_folder'): config.set('Folders', 'ecu_shared_folder', 'shared_for_ecu')
-        if not config.has_option('Folders', 'tcu_download_folder'): config.set('Folders', 'tcu_download_folder', 'tcu_downloads')
-        if not config.has_option('Folders', 'tcu_ack_folder'): config.set('Folders', 'tcu_ack_folder', 'tcu_acks')
-        
-        with open('config.ini', 'w') as configfile: config.write(configfile)
-        self.checksum_enabled = config.getboolean('Security', 'checksum_verification_enabled')
-        self.resilience_enabled = config.getboolean('Security', 'ecu_resilience_enabled')
+        config_service.update({
+            'TCU': {'current_version': '1.0', 'channel': 'stable', 'push_updates': 'false'},
+            'Server': {'oem_url': 'http://127.0.0.1:5000', 'malicious_url': 'http://127.0.0.1:5001'},
+            'Security': {'checksum_verification_enabled': 'true', 'ecu_resilience_enabled': 'true'},
+            'Folders': {'ecu_shared_folder': 'shared_for_ecu', 'tcu_download_folder': 'tcu_downloads',
+                        'tcu_image_folder': 'tcu_images', 'ecu_slot_folder': 'ecu_slots'},
+            'Simulation': {'time_scale': '1.0'},
+            'IPC': {'ecu_socket': 'ecu_control.sock', 'ecu_port': '5010'},
+            'Tracing': {'span_file': 'timing_spans.jsonl'},
+        }, only_missing=True)
+        self.checksum_enabled = config_service.getboolean('Security', 'checksum_verification_enabled')
+        self.resilience_enabled = config_service.getboolean('Security', 'ecu_resilience_enabled')
 
     def toggle_simulation(self):
         if self.simulation_running: self.stop_simulation()
@@ -237,18 +320,16 @@ class OTASimulatorApp(ctk.CTk):
 
     def start_simulation(self):
         self.simulation_running = True
+        self.store_queue.put(NEW_RUN)
         self.clear_logs()
-        folders = ['updates', 'malicious_updates', 'shared_for_ecu', 'tcu_acks', 'tcu_downloads']
+        folders = ['updates', 'malicious_updates', 'update_deltas', 'update_variants', DEFAULT_STORE_ROOT, 'shared_for_ecu', 'tcu_downloads', 'tcu_images', 'ecu_slots']
         for folder in folders:
-            if os.path.exists(folder): shutil.rmtree(folder)
+            if os.path.exists(folder): remove_tree(folder)  # Store blobs and published links are read-only
             os.makedirs(folder)
-        with open("updates/firmware_v1.1.bin", "w") as f: f.write("Initial legitimate firmware v1.1.")
+        self.firmware_store.put_bytes("updates", "firmware_v1.1.bin", b"Initial legitimate firmware v1.1.")
         self.log_queue.put(('log', 'server', " SERVER READY: Deployed 'firmware_v1.1.bin'.", None))
         self.ensure_config_exists()
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-        config.set('TCU', 'current_version', '1.0')
-        with open('config.ini', 'w') as configfile: config.write(configfile)
+        config_service.set('TCU', 'current_version', '1.0')
         
         self.start_stop_button.configure(text="STOP SIMULATION", fg_color="#f44336")
         
@@ -292,23 +373,27 @@ class OTASimulatorApp(ctk.CTk):
         filepath = filedialog.askopenfilename(title="Select Payload", filetypes=(("Text files", "*.txt"), ("All", "*.*")))
         if not filepath: return
         try:
-            latest_version_tuple = find_latest_version(['updates', 'malicious_updates'])
-            major, minor = latest_version_tuple
-            filename = f"malicious_firmware_v{major}.{minor + 1}.bin"
-            shutil.copy(filepath, os.path.join("malicious_updates", filename))
+            latest_version_tuple = find_latest_version(['updates', 'malicious_updates'], self.firmware_store)
+            filename = f"malicious_firmware_v{next_minor_version(latest_version_tuple)}.bin"
+            # The same payload deployed again is linked to the blob already stored
+            self.firmware_store.put_file("malicious_updates", filename, filepath)
             self.log_queue.put(('log', 'malicious_server', f" MALICIOUS DEPLOY: Deployed '{filename}'.", None))
         except Exception as e:
             self.log_queue.put(('log', 'malicious_server', f" ERROR: {e}", None))
 
     def deploy_update(self, source):
         if not self.simulation_running: return
-        latest_version_tuple = find_latest_version(['updates', 'malicious_updates'])
-        major, minor = latest_version_tuple
-        new_version = f"{major}.{minor + 1}"
+        latest_version_tuple = find_latest_version(['updates', 'malicious_updates'], self.firmware_store)
+        new_version = next_minor_version(latest_version_tuple)
         folder, prefix = ("updates", "firmware_v") if source == "oem" else ("malicious_updates", "malicious_firmware_v")
         filename = f"{prefix}{new_version}.bin"
-        with open(os.path.join(folder, filename), "w") as f: f.write(f"Content v{new_version}")
+        entry = self.firmware_store.put_bytes(folder, filename, f"Content v{new_version}".encode())
         self.log_queue.put(('log', 'server' if source == 'oem' else 'malicious_server', f" DEPLOYED: '{filename}'.", None))
+        if source == "oem":
+            # Compress once here so the server never compresses per request
+            variants = build_compressed_variants(os.path.join(folder, filename), checksum=entry["checksum"])
+            if variants:
+                self.log_queue.put(('log', 'server', f" Pre-compressed: {', '.join(f'{enc} {size} bytes' for enc, size in variants.items())}.", None))
 
     def update_button_visuals(self): 
         if self.checksum_enabled:
@@ -335,11 +420,7 @@ class OTASimulatorApp(ctk.CTk):
         self.log_queue.put(('log', 'ecu', f"ECU Watchdog/Resilience is now {'ON' if self.resilience_enabled else 'OFF'}.", None))
 
     def save_config_value(self, section, key, value):
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-        if not config.has_section(section): config.add_section(section)
-        config.set(section, key, value)
-        with open('config.ini', 'w') as configfile: config.write(configfile)
+        config_service.set(section, key, value)
 
     def clear_logs(self):
         for log_box in [self.server_log, self.malicious_server_log, self.tcu_log, self.ecu_log]:
@@ -349,6 +430,8 @@ class OTASimulatorApp(ctk.CTk):
     
     def on_closing(self):
         if self.simulation_running: self.stop_simulation()
+        self.store_queue.put(None)
+        self.log_writer_thread.join(timeout=2)
         self.destroy()
 
 if __name__ == '__main__':
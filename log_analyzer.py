@@ -0,0 +1,396 @@
+# log_analyzer.py
+"""
+Offline analyzer for simulation logs in the simulation_logs.csv schema:
+    timestamp, component, type, message
+
+The rows are streamed once. Each "SERVER READY" line starts a new run and
+each TCU "Checking" status starts a new update cycle. Cycles are rebuilt from
+the log markers the TCU and ECU write ("New version found", "Download
+complete.", "Checksum match!", "Boot successful", "WATCHDOG", ...), in both
+their current and older wordings, and reduced to phase durations and an
+outcome.
+
+Only the open cycle, fixed-size histograms and the last --window run
+summaries are held in memory, so a soak-test log of millions of rows costs
+no more than a short one. Durations are collected in small batches and
+bucketed in one pass per batch (with numpy when it is installed).
+
+The report covers per-phase duration statistics, outcome counts per
+security configuration (checksum verification and ECU resilience), and
+phases whose median got slower than in the preceding runs.
+
+Usage:
+    python log_analyzer.py                               # simulation_logs.csv
+    python log_analyzer.py big.csv --threshold 0.5 -o report.json
+    python log_analyzer.py --store simulation_log_store  # rows from log_store.py
+"""
+import argparse
+import csv
+import datetime
+import json
+import math
+import sys
+from collections import deque, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_LOG_FILE = "simulation_logs.csv"
+BATCH_SIZE = 4096
+MAX_REGRESSIONS = 1000
+
+# Histogram buckets grow by 2**(1/8) (about 9%) from 1 ms; the last one is open-ended
+BUCKET_BASE_MS = 1.0
+BUCKETS_PER_DOUBLING = 8
+BUCKET_COUNT = 200
+
+# --- MARKERS ---
+# (component, type, message substring, marker). The first match wins, so
+# more specific texts come first. Older log wordings sit next to current ones.
+MARKERS = [
+    ("tcu", "status", "Checking", "checking"),
+    ("tcu", "status", "Downloading", "downloading"),
+    ("tcu", "status", "Verifying", "verifying"),
+    ("tcu", "status", "Success", "tcu_done"),
+    ("tcu", "status", "Idle", "tcu_done"),
+    ("tcu", "status", "Failed", "tcu_done"),
+    ("tcu", "status", "Rolled Back", "tcu_done"),
+    ("tcu", "status", "Crashed", "tcu_crashed"),
+    ("tcu", "log", "New version found", "found"),
+    ("tcu", "log", "New update found", "found"),
+    ("tcu", "log", "No updates available", "no_update"),
+    ("tcu", "log", "is up to date", "no_update"),
+    ("tcu", "log", "Download complete.", "downloaded"),
+    ("tcu", "log", "Checksum verification is disabled", "checksum_off"),
+    ("tcu", "log", "Checksum match!", "verified"),
+    ("tcu", "log", "CHECKSUM MISMATCH", "rejected"),
+    ("tcu", "log", "Transferred '", "transferred"),
+    ("tcu", "log", "RECEIVED FAILURE ACK", "ack_failure"),
+    ("tcu", "log", "ACK received from ECU: FAILURE", "ack_failure"),
+    ("tcu", "log", "ACK received from ECU", "ack"),
+    ("tcu", "log", "Timed out waiting for ECU", "ack_timeout"),
+    ("tcu", "log", "Download/Processing Error", "download_error"),
+    ("tcu", "log", "Error: No URL configured", "download_error"),
+    ("tcu", "log", "TCU ERROR", "tcu_crashed"),
+    ("ecu", "log", "New firmware detected", "ecu_detected"),
+    ("ecu", "log", "detected!", "ecu_detected"),
+    ("ecu", "log", "Boot successful", "booted"),
+    ("ecu", "log", "Update applied successfully", "booted"),
+    ("ecu", "log", "MALICIOUS CODE DETECTED", "compromised"),
+    ("ecu", "log", "MALWARE EXECUTING", "compromised"),
+    ("ecu", "log", "WATCHDOG DISABLED", "bricked"),
+    ("ecu", "log", "STUCK ON CORRUPT SLOT", "bricked"),
+    ("ecu", "log", "WATCHDOG", "watchdog"),
+    ("ecu", "log", "Recovered.", "recovered"),
+    ("ecu", "status", "Watchdog Reset", "recovered"),
+]
+
+# Phase name -> (start markers, end markers); the first recorded marker of each list is used
+PHASES = OrderedDict([
+    ("check", (("checking",), ("found", "no_update"))),
+    ("download", (("downloading",), ("downloaded",))),
+    ("verify", (("verifying",), ("verified", "rejected"))),
+    ("transfer", (("verified", "downloaded"), ("transferred",))),
+    ("ecu_pickup", (("transferred",), ("ecu_detected",))),
+    ("ecu_apply", (("ecu_detected",), ("booted", "compromised"))),
+    ("recovery", (("compromised",), ("recovered", "bricked"))),
+    ("ack_wait", (("transferred",), ("ack", "ack_failure", "ack_timeout"))),
+    ("cycle", (("checking",), ("tcu_done", "tcu_crashed"))),
+])
+
+# Outcome -> marker that decides it, most severe first
+OUTCOMES = [
+    ("bricked", "bricked"),
+    ("rolled_back", "watchdog"),
+    ("rolled_back", "ack_failure"),
+    ("compromised", "compromised"),
+    ("updated", "booted"),
+    ("rejected", "rejected"),
+    ("download_error", "download_error"),
+    ("crashed", "tcu_crashed"),
+    ("ack_timeout", "ack_timeout"),
+    ("updated", "ack"),
+    ("no_update", "no_update"),
+]
+
+# GUI toggles, which stay in effect across runs like config.ini does
+TOGGLES = [
+    ("Checksum Verification is now ON", "checksum", "on"),
+    ("Checksum Verification is now OFF", "checksum", "off"),
+    ("Resilience is now ON", "resilience", "on"),
+    ("Resilience is now OFF", "resilience", "off"),
+]
+
+def match_marker(component, msg_type, message):
+    for m_component, m_type, text, marker in MARKERS:
+        if component == m_component and msg_type == m_type and text in message:
+            return marker
+    return None
+
+# --- STATISTICS ---
+def bucket_upper_ms(index):
+    return BUCKET_BASE_MS * 2 ** (index / BUCKETS_PER_DOUBLING)
+
+def bucket_counts(values):
+    """Counts per histogram bucket for a batch of durations in milliseconds."""
+    if np is not None:
+        v = np.maximum(np.asarray(values, dtype=float), BUCKET_BASE_MS)
+        idx = np.ceil(np.log2(v / BUCKET_BASE_MS) * BUCKETS_PER_DOUBLING - 1e-9).astype(int)
+        return np.bincount(np.minimum(idx, BUCKET_COUNT - 1), minlength=BUCKET_COUNT).tolist()
+    counts = [0] * BUCKET_COUNT
+    for value in values:
+        idx = math.ceil(math.log2(max(value, BUCKET_BASE_MS) / BUCKET_BASE_MS) * BUCKETS_PER_DOUBLING - 1e-9)
+        counts[min(idx, BUCKET_COUNT - 1)] += 1
+    return counts
+
+class PhaseStats:
+    """Count, mean, min, max and a fixed log-scale histogram of one phase's durations."""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * BUCKET_COUNT
+        self._pending = []
+
+    def add(self, ms):
+        self._pending.append(ms)
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self.count += len(batch)
+        self.total += sum(batch)
+        low, high = min(batch), max(batch)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        for i, n in enumerate(bucket_counts(batch)):
+            self.buckets[i] += n
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the nearest-rank percentile, capped at the maximum."""
+        self.flush()
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(pct * self.count / 100.0)))
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(max(bucket_upper_ms(i), self.min), self.max)
+        return self.max
+
+    def summary(self, buckets=True):
+        self.flush()
+        result = {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "min_ms": round(self.min, 3) if self.count else None,
+            "p50_ms": _round(self.percentile(50)),
+            "p95_ms": _round(self.percentile(95)),
+            "p99_ms": _round(self.percentile(99)),
+            "max_ms": round(self.max, 3) if self.count else None,
+        }
+        if buckets:
+            result["buckets_ms"] = {f"<={bucket_upper_ms(i):.0f}" if i < BUCKET_COUNT - 1 else "inf": n
+                                    for i, n in enumerate(self.buckets) if n}
+        return result
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+# --- RECONSTRUCTION ---
+class Cycle:
+    def __init__(self, start, config):
+        self.start = start
+        self.config = dict(config)
+        self.marks = {}
+
+    def mark(self, marker, when):
+        self.marks.setdefault(marker, when)
+
+    def outcome(self):
+        for outcome, marker in OUTCOMES:
+            if marker in self.marks:
+                return outcome
+        return "incomplete"
+
+    def durations(self):
+        """Phase name -> milliseconds for every phase whose start and end were both seen."""
+        result = {}
+        for phase, (starts, ends) in PHASES.items():
+            start = next((self.marks[m] for m in starts if m in self.marks), None)
+            end = next((self.marks[m] for m in ends if m in self.marks), None)
+            if start is not None and end is not None and end >= start:
+                result[phase] = (end - start).total_seconds() * 1000.0
+        return result
+
+class LogAnalyzer:
+    def __init__(self, window=50, threshold=0.25, baseline_runs=5, min_count=1):
+        self.window = window
+        self.threshold = threshold
+        self.baseline_runs = baseline_runs
+        self.min_count = min_count
+        self.rows = 0
+        self.skipped_rows = 0
+        self.runs = 0
+        self.cycles = 0
+        self.config = {"checksum": "unknown", "resilience": "unknown"}
+        self.phases = {}
+        self.outcomes = {}
+        self.run_summaries = deque(maxlen=window)
+        self.regressions = deque(maxlen=MAX_REGRESSIONS)
+        self._baselines = {}  # phase -> deque of recent per-run medians
+        self._run = None
+        self._cycle = None
+
+    def feed(self, rows):
+        for row in rows:
+            if len(row) < 4:
+                self.skipped_rows += 1
+                continue
+            self.rows += 1
+            component, msg_type = row[1], row[2]
+            message = row[3] if len(row) == 4 else ",".join(row[3:])
+            if component == "server" and "SERVER READY" in message:
+                self._start_run(row[0])
+            elif self._run is None:
+                self._start_run(row[0])
+            self._run["rows"] += 1
+
+            if msg_type == "log" and "is now O" in message:
+                for text, key, value in TOGGLES:
+                    if text in message:
+                        self.config[key] = value
+                        break
+                continue
+            marker = match_marker(component, msg_type, message)
+            if marker is None:
+                continue
+            try:
+                when = datetime.datetime.fromisoformat(row[0])
+            except ValueError:
+                self.skipped_rows += 1
+                continue
+            if marker == "checking":
+                self._close_cycle()
+                self._cycle = Cycle(when, self.config)
+            if self._cycle is not None:
+                self._cycle.mark(marker, when)
+        return self
+
+    def finish(self):
+        self._close_run()
+        return self
+
+    def _start_run(self, timestamp):
+        self._close_run()
+        self.runs += 1
+        self._run = {"run_id": timestamp.replace('-', '').replace(':', '').replace('.', ''),
+                     "start": timestamp, "rows": 0, "cycles": 0, "outcomes": {}, "phases": {}}
+
+    def _close_cycle(self):
+        cycle, self._cycle = self._cycle, None
+        if cycle is None:
+            return
+        # What the cycle itself shows about the configuration beats the last toggle seen
+        if "checksum_off" in cycle.marks:
+            cycle.config["checksum"] = "off"
+        elif "verified" in cycle.marks or "rejected" in cycle.marks:
+            cycle.config["checksum"] = "on"
+        if "bricked" in cycle.marks:
+            cycle.config["resilience"] = "off"
+        elif "watchdog" in cycle.marks or "recovered" in cycle.marks:
+            cycle.config["resilience"] = "on"
+        for key in ("checksum", "resilience"):
+            if self.config[key] == "unknown":
+                self.config[key] = cycle.config[key]
+
+        outcome = cycle.outcome()
+        config_key = f"checksum={cycle.config['checksum']},resilience={cycle.config['resilience']}"
+        by_outcome = self.outcomes.setdefault(config_key, {})
+        by_outcome[outcome] = by_outcome.get(outcome, 0) + 1
+        self.cycles += 1
+        run = self._run
+        run["cycles"] += 1
+        run["outcomes"][outcome] = run["outcomes"].get(outcome, 0) + 1
+        for phase, ms in cycle.durations().items():
+            self.phases.setdefault(phase, PhaseStats()).add(ms)
+            run["phases"].setdefault(phase, PhaseStats()).add(ms)
+
+    def _close_run(self):
+        self._close_cycle()
+        run, self._run = self._run, None
+        if run is None:
+            return
+        phases = {}
+        for phase, stats in run["phases"].items():
+            median = stats.percentile(50)
+            phases[phase] = {"count": stats.count, "p50_ms": _round(median),
+                             "mean_ms": round(stats.total / stats.count, 3)}
+            history = self._baselines.setdefault(phase, deque(maxlen=self.baseline_runs))
+            if history and stats.count >= self.min_count:
+                baseline = sorted(history)[len(history) // 2]
+                if baseline > 0 and median > baseline * (1 + self.threshold):
+                    self.regressions.append({
+                        "run_id": run["run_id"], "phase": phase, "p50_ms": _round(median),
+                        "baseline_p50_ms": _round(baseline), "runs_in_baseline": len(history),
+                        "change_pct": round((median / baseline - 1) * 100, 1),
+                    })
+            history.append(median)
+        run["phases"] = phases
+        self.run_summaries.append(run)
+
+    def report(self):
+        return {
+            "rows": self.rows,
+            "skipped_rows": self.skipped_rows,
+            "runs": self.runs,
+            "cycles": self.cycles,
+            "vectorized": np is not None,
+            "phases": {phase: self.phases[phase].summary() for phase in PHASES if phase in self.phases},
+            "outcomes_by_config": {k: self.outcomes[k] for k in sorted(self.outcomes)},
+            "regression_threshold_pct": round(self.threshold * 100, 1),
+            "regressions": list(self.regressions),
+            "recent_runs": list(self.run_summaries),
+        }
+
+def analyze(rows, **options):
+    return LogAnalyzer(**options).feed(rows).finish().report()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild update cycles from simulation logs and report phase timings, outcomes and regressions.")
+    parser.add_argument("csv_path", nargs="?", default=DEFAULT_LOG_FILE, help="Log in simulation_logs.csv format ('-' for stdin)")
+    parser.add_argument("--store", help="Read rows from a log_store.py root instead of a CSV file (sealed segments only)")
+    parser.add_argument("--window", type=int, default=50, help="Number of most recent run summaries to report")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Median slowdown against the baseline that counts as a regression (0.25 = 25%%)")
+    parser.add_argument("--baseline-runs", type=int, default=5, help="Preceding runs whose medians form the baseline")
+    parser.add_argument("--min-count", type=int, default=1, help="Samples a run needs in a phase to be checked for regressions")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args(argv)
+
+    options = {"window": args.window, "threshold": args.threshold,
+               "baseline_runs": args.baseline_runs, "min_count": args.min_count}
+    if args.store:
+        from log_store import LogStore
+        # Read-only: a running GUI may be writing to this store
+        report = analyze(LogStore(args.store, read_only=True).iter_rows(), **options)
+    elif args.csv_path == "-":
+        report = analyze(csv.reader(sys.stdin), **options)
+    else:
+        with open(args.csv_path, newline='', encoding='utf-8') as f:
+            report = analyze(csv.reader(f), **options)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+# log_store.py
+"""
+Rotating, compressed, indexed store for simulation logs.
+
+Rows have the same schema as simulation_logs.csv:
+    timestamp, component, type, message
+
+Each simulation run writes its own segments. A segment is a plain CSV file
+while it is open; when it is closed (run ended or size limit reached) it is
+gzip-compressed and a summary line is appended to index.jsonl:
+
+    {"file", "run_id", "start", "end", "rows", "components": {...}, "types": {...}}
+
+Queries read the index first and only open the segments that can match, so
+pulling one run out of a month of soak-test logs touches only that run's
+segments. Opening a store changes nothing on disk; only the writer calls
+recover() to seal segments a crashed writer left behind. A writer holds an
+flock on each segment it has open, so recovery never takes a live one.
+
+CLI:
+    python log_store.py runs
+    python log_store.py export [--run ID] [--component tcu] [--type log]
+                               [--since ISO] [--until ISO] [-o out.csv]
+    python log_store.py import simulation_logs.csv
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sys
+
+try:
+    import fcntl  # POSIX only; elsewhere one writer per store is assumed
+except ImportError:
+    fcntl = None
+
+DEFAULT_LOG_ROOT = "simulation_log_store"
+INDEX_FILENAME = "index.jsonl"
+LOCK_FILENAME = "recover.lock"
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+SEGMENT_MAX_ROWS = 50000
+
+def new_run_id():
+    return datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+
+class LogStore:
+    def __init__(self, root=DEFAULT_LOG_ROOT, max_bytes=SEGMENT_MAX_BYTES, max_rows=SEGMENT_MAX_ROWS, read_only=False):
+        """read_only=True refuses every call that would write, for tools that only query a live store."""
+        self.root = root
+        self.read_only = read_only
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.segment_dir = os.path.join(root, "segments")
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self.run_id = None
+        self._segment_seq = 0
+        self._file = None
+        self._writer = None
+        self._summary = None
+
+    # --- WRITING ---
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError(f"Log store {self.root} was opened read-only")
+
+    def start_run(self, run_id=None):
+        """Closes the current run and starts a new one. Returns the run ID."""
+        self._check_writable()
+        self.close_segment()
+        self.run_id = run_id or new_run_id()
+        self._segment_seq = 0
+        return self.run_id
+
+    def append(self, timestamp, component, msg_type, message):
+        if self.run_id is None:
+            self.start_run()
+        if self._file is None:
+            self._open_segment()
+        self._writer.writerow([timestamp, component, msg_type, message])
+        s = self._summary
+        s["rows"] += 1
+        if s["start"] is None or timestamp < s["start"]: s["start"] = timestamp
+        if s["end"] is None or timestamp > s["end"]: s["end"] = timestamp
+        s["components"][component] = s["components"].get(component, 0) + 1
+        s["types"][msg_type] = s["types"].get(msg_type, 0) + 1
+        if s["rows"] >= self.max_rows or self._file.tell() >= self.max_bytes:
+            self.close_segment()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        self.close_segment()
+
+    def _open_segment(self):
+        self._check_writable()
+        self._segment_seq += 1
+        name = f"{self.run_id}-{self._segment_seq:04d}.csv"
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._file = open(os.path.join(self.segment_dir, name), "w", newline='', encoding='utf-8', buffering=1024 * 1024)
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_EX)  # Held until sealed: marks the segment as live
+        self._writer = csv.writer(self._file)
+        self._summary = {"file": name + ".gz", "run_id": self.run_id, "start": None, "end": None,
+                         "rows": 0, "components": {}, "types": {}}
+
+    def close_segment(self):
+        """Compresses the open segment and records it in the index."""
+        if self._file is None:
+            return
+        f, summary = self._file, self._summary
+        self._file = self._writer = self._summary = None
+        try:
+            f.flush()
+            if summary["rows"]:
+                self._seal(f.name, summary)
+            else:
+                os.remove(f.name)
+        finally:
+            f.close()  # Only now does the segment lock go
+
+    def _seal(self, path, summary):
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        with open(self.index_path, "a", encoding='utf-8') as index:
+            index.write(json.dumps(summary) + "\n")
+        os.remove(path)
+
+    def recover(self):
+        """
+        Seals segments left open by a writer that did not shut down cleanly.
+        For the writing process only, at startup: segments another writer
+        still holds are left alone. Returns the number of segments sealed.
+        """
+        self._check_writable()
+        os.makedirs(self.segment_dir, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILENAME), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # One recovery at a time per store
+            return sum(self._recover_segment(name) for name in sorted(os.listdir(self.segment_dir))
+                       if name.endswith(".csv"))
+
+    def _recover_segment(self, name):
+        path = os.path.join(self.segment_dir, name)
+        summary = {"file": name + ".gz", "run_id": name.rsplit("-", 1)[0], "start": None, "end": None,
+                   "rows": 0, "components": {}, "types": {}}
+        try:
+            f = open(path, newline='', encoding='utf-8')
+        except FileNotFoundError:
+            return 0  # Sealed by its writer meanwhile
+        with f:
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0  # Its writer is still running
+                if os.fstat(f.fileno()).st_nlink == 0:
+                    return 0  # Sealed and removed between the listing and the lock
+            for row in csv.reader(f):
+                if len(row) < 4: continue
+                timestamp, component, msg_type = row[0], row[1], row[2]
+                summary["rows"] += 1
+                if summary["start"] is None or timestamp < summary["start"]: summary["start"] = timestamp
+                if summary["end"] is None or timestamp > summary["end"]: summary["end"] = timestamp
+                summary["components"][component] = summary["components"].get(component, 0) + 1
+                summary["types"][msg_type] = summary["types"].get(msg_type, 0) + 1
+            if summary["rows"]:
+                self._seal(path, summary)
+            else:
+                os.remove(path)
+        return 1
+
+    # --- READING ---
+    def segments(self):
+        """Yields the index entries of all sealed segments, oldest first."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, encoding='utf-8') as index:
+            for line in index:
+                if line.strip():
+                    yield json.loads(line)
+
+    def runs(self):
+        """Returns one summary per run, merged from its segments."""
+        runs = {}
+        for seg in self.segments():
+            run = runs.setdefault(seg["run_id"], {"run_id": seg["run_id"], "start": seg["start"], "end": seg["end"],
+                                                  "rows": 0, "segments": 0, "components": {}})
+            run["rows"] += seg["rows"]
+            run["segments"] += 1
+            run["start"] = min(run["start"], seg["start"])
+            run["end"] = max(run["end"], seg["end"])
+            for component, count in seg["components"].items():
+                run["components"][component] = run["components"].get(component, 0) + count
+        return list(runs.values())
+
+    def iter_rows(self, run_id=None, component=None, msg_type=None, since=None, until=None):
+        """Yields [timestamp, component, type, message] rows, opening only segments that can match."""
+        for seg in self.segments():
+            if run_id is not None and seg["run_id"] != run_id: continue
+            if component is not None and component not in seg["components"]: continue
+            if msg_type is not None and msg_type not in seg["types"]: continue
+            if since is not None and seg["end"] < since: continue
+            if until is not None and seg["start"] > until: continue
+            with gzip.open(os.path.join(self.segment_dir, seg["file"]), "rt", newline='', encoding='utf-8') as f:
+                for row in csv.reader(f):
+                    if len(row) < 4: continue
+                    if component is not None and row[1] != component: continue
+                    if msg_type is not None and row[2] != msg_type: continue
+                    if since is not None and row[0] < since: continue
+                    if until is not None and row[0] > until: continue
+                    yield row
+
+    def export_csv(self, out_file, **filters):
+        """Writes matching rows in the simulation_logs.csv format (no header, like the original)."""
+        writer = csv.writer(out_file)
+        count = 0
+        for row in self.iter_rows(**filters):
+            writer.writerow(row)
+            count += 1
+        return count
+
+    def import_csv(self, csv_path):
+        """
+        Loads a legacy simulation_logs.csv. Each "SERVER READY" line, which
+        the GUI writes when a simulation starts, begins a new run.
+        """
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 4: continue
+                if row[1] == 'server' and 'SERVER READY' in row[3]:
+                    self.start_run(row[0].replace('-', '').replace(':', '').replace('.', ''))
+                self.append(row[0], row[1], row[2], ",".join(row[3:]))
+        self.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the simulation log store.")
+    parser.add_argument("--root", default=DEFAULT_LOG_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("runs", help="List runs as JSON lines")
+    export = sub.add_parser("export", help="Export rows in simulation_logs.csv format")
+    export.add_argument("--run", dest="run_id")
+    export.add_argument("--component", choices=["server", "malicious_server", "tcu", "ecu"])
+    export.add_argument("--type", dest="msg_type")
+    export.add_argument("--since")
+    export.add_argument("--until")
+    export.add_argument("-o", "--output")
+    imp = sub.add_parser("import", help="Import a legacy simulation_logs.csv")
+    imp.add_argument("csv_path")
+    args = parser.parse_args(argv)
+
+    store = LogStore(args.root, read_only=args.command != "import")
+    if args.command == "runs":
+        for run in store.runs():
+            print(json.dumps(run))
+    elif args.command == "export":
+        filters = {k: getattr(args, k) for k in ("run_id", "component", "msg_type", "since", "until")}
+        if args.output:
+            with open(args.output, "w", newline='', encoding='utf-8') as f:
+                store.export_csv(f, **filters)
+        else:
+            store.export_csv(sys.stdout, **filters)
+    elif args.command == "import":
+        store.import_csv(args.csv_path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,44 +1,34 @@
 # malicious_server.py
 import os
-import re
+import argparse
 import logging
-import time
-from flask import Flask, jsonify, send_from_directory
-from shared_utils import version_to_tuple
+from flask import Flask, jsonify, send_from_directory, request
+from shared_utils import UpdateManifest, FirmwareStore, sim_clock, gui_events, SpanRecorder, install_flask_spans
 
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
 updates_dir = "malicious_updates"
 app = Flask(__name__)
+install_flask_spans(app, SpanRecorder('malicious_server'))
+
+# Shares the OEM server's firmware store: a payload deployed many times is stored once
+manifest = UpdateManifest(updates_dir, store=FirmwareStore())
 
 def log_to_gui(message_type, message, color=None):
-    """Prints a formatted string for the GUI to capture."""
-    if color:
-        print(f"{message_type.upper()}:{message}:{color}", flush=True)
-    else:
-        print(f"{message_type.upper()}:{message}", flush=True)
+    """Sends a typed event to the GUI as a frame on stdout."""
+    gui_events.emit(message_type, message, color)
 
 @app.route('/check-update')
 def check_update():
     try:
         log_to_gui('log', f"  TCU connected. Scanning '{updates_dir}'...")
-        time.sleep(0.75) # Added delay
-        os.makedirs(updates_dir, exist_ok=True)
-        files_found = os.listdir(updates_dir)
+        sim_clock.sleep(0.75) # Added delay
+        latest = manifest.latest()
         
-        latest_file = None
-        latest_version_tuple = (-1, -1) 
-        for filename in files_found:
-            match = re.search(r'v([\d.]+)', filename)
-            if match:
-                version_tuple = version_to_tuple(match.group(1))
-                if version_tuple > latest_version_tuple:
-                    latest_version_tuple = version_tuple
-                    latest_file = filename
-        
-        if latest_file:
-            version_str = ".".join(map(str, latest_version_tuple))
+        if latest:
+            latest_file = latest["filename"]
+            version_str = ".".join(map(str, latest["version_tuple"]))
             checksum = "fake_checksum_1234567890abcdef" # A fake checksum
             
             log_to_gui('log', f"   Serving malicious update: {latest_file} (v{version_str})")
@@ -63,15 +53,27 @@ def check_update():
 
 @app.route('/download/<string:filename>')
 def download_file(filename):
-    log_to_gui('log', f" Serving malicious file {filename} to TCU...")
-    return send_from_directory(updates_dir, filename)
+    # conditional=True makes Flask answer Range requests with 206 Partial Content,
+    # which lets the TCU resume an interrupted download.
+    if request.range:
+        log_to_gui('log', f" Resuming {filename} for TCU from byte {request.range.ranges[0][0]}...")
+    else:
+        log_to_gui('log', f" Serving malicious file {filename} to TCU...")
+    # Absolute, so the folder is found relative to the working directory, not this script
+    return send_from_directory(os.path.abspath(updates_dir), filename, conditional=True)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Malicious update server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
     try:
         log_to_gui('status', 'Running', '#f44336')
-        log_to_gui('log', "[!] Malicious Server process started on port 5001.")
+        log_to_gui('log', f"[!] Malicious Server process started on port {args.port}.")
         os.makedirs(updates_dir, exist_ok=True)
-        app.run(host='127.0.0.1', port=5001)
+        manifest.refresh()
+        manifest.start_watcher()
+        app.run(host=args.host, port=args.port)
     except Exception as e:
         log_to_gui('log', f"[X] MALICIOUS SERVER FATAL CRASH: {e}")
         log_to_gui('status', 'Crashed', '#f44336')
\ No newline at end of file
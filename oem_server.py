@@ -1,72 +1,518 @@
 # oem_server.py
 import os
-import re
+import sys
+import signal
+import socket
+import argparse
 import logging
+import json
+import threading
 import time
-from flask import Flask, jsonify, send_from_directory, request # <--- Added 'request'
-from shared_utils import calculate_sha256, version_to_tuple
+from flask import Flask, Response, jsonify, send_from_directory, request # <--- Added 'request'
+from shared_utils import (UpdateManifest, make_delta, sim_clock, gui_events,
+                          VARIANT_ENCODINGS, DEFAULT_VARIANTS_DIR, variant_path, FirmwareStore,
+                          SpanRecorder, install_flask_spans, ReleaseCatalog, DEFAULT_CHANNEL,
+                          VEHICLE_ID_HEADER, CHANNEL_HEADER)
 
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
 updates_dir = "updates"
+deltas_dir = "update_deltas"
+variants_dir = DEFAULT_VARIANTS_DIR
 app = Flask(__name__)
+install_flask_spans(app, SpanRecorder('server'))
+
+# Built once at startup, then kept current by a background watcher. Checksums
+# come from the firmware store's catalog, so deployed images are never re-hashed.
+manifest = UpdateManifest(updates_dir, store=FirmwareStore())
+# Sorted release index with channels and staged rollouts, rebuilt after every manifest change
+releases = ReleaseCatalog(manifest)
+
+# (base checksum, target checksum) -> delta info, for adjacent versions only.
+# Deltas are built on one background thread, so a deploy reaches the release
+# catalog and the push notifications at once; each delta joins the index
+# (and the /check-update answers) as soon as it has been written.
+delta_index = {}
+delta_lock = threading.Lock()
+delta_requested = threading.Event()
+delta_listeners = []  # callback(), after each build pass that changed delta_index
+delta_thread = None
+
+# Firmware and delta files are named per version/content and never change in
+# place, so caches may keep them for a year without revalidating.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
 
 def log_to_gui(message_type, message, color=None):
-    """Prints a formatted string for the GUI to capture."""
-    if color:
-        print(f"{message_type.upper()}:{message}:{color}", flush=True)
-    else:
-        print(f"{message_type.upper()}:{message}", flush=True)
+    """Sends a typed event to the GUI as a frame on stdout."""
+    gui_events.emit(message_type, message, color)
+
+def delta_filename(base_entry, target_entry):
+    """Deltas are named by content so a redeployed file never reuses a stale delta."""
+    return f"{base_entry['checksum'][:16]}_to_{target_entry['checksum'][:16]}.delta"
+
+def rebuild_deltas(changed_manifest=None):
+    """Manifest listener: queues a delta build pass on the background thread and returns at once."""
+    global delta_thread
+    with delta_lock:
+        delta_requested.set()
+        if delta_thread is None:
+            delta_thread = threading.Thread(target=delta_worker, daemon=True)
+            delta_thread.start()
+
+def delta_worker():
+    while True:
+        delta_requested.wait()
+        delta_requested.clear()
+        if build_deltas(manifest.entries()):
+            for callback in list(delta_listeners):
+                callback()
+
+def build_deltas(entries):
+    """
+    Brings delta_index in line with the adjacent version pairs in `entries`,
+    newest pair first. Returns whether the index changed.
+    """
+    os.makedirs(deltas_dir, exist_ok=True)
+    pairs = {(base["checksum"], target["checksum"]): (base, target) for base, target in zip(entries, entries[1:])}
+    with delta_lock:
+        stale = [key for key in delta_index if key not in pairs]
+        for key in stale:
+            del delta_index[key]
+        missing = [key for key in pairs if key not in delta_index]
+    changed = bool(stale)
+    for key in reversed(missing):
+        if delta_requested.is_set():
+            break  # The manifest changed again; the next pass starts from the new entries
+        info = build_delta(*pairs[key])
+        if info is not None:
+            with delta_lock:
+                delta_index[key] = info
+            changed = True
+    return changed
+
+def write_delta(base_path, target_path, path):
+    """Writes the delta between two images to path; returns False (writing nothing) if it saves nothing."""
+    with open(base_path, "rb") as f: base_bytes = f.read()
+    with open(target_path, "rb") as f: target_bytes = f.read()
+    delta = make_delta(base_bytes, target_bytes)
+    if len(delta) >= len(target_bytes):
+        return False
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f: f.write(delta)
+    os.replace(tmp_path, path)
+    return True
+
+def write_delta_in_child(base_path, target_path, path):
+    """
+    write_delta in a forked child: make_delta is a pure-Python scan that
+    would otherwise hold the GIL for seconds and stall every request thread.
+    """
+    if not hasattr(os, 'fork'):
+        return write_delta(base_path, target_path, path)
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = 0 if write_delta(base_path, target_path, path) else 3
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    code = os.waitstatus_to_exitcode(status)
+    if code not in (0, 3):
+        raise OSError(f"delta builder exited with status {code}")
+    return code == 0
+
+def build_delta(base, target):
+    """Writes the delta from base to target unless it exists; returns its index entry, or None."""
+    name = delta_filename(base, target)
+    path = os.path.join(deltas_dir, name)
+    try:
+        if not os.path.exists(path):
+            if not write_delta_in_child(base["path"], target["path"], path):
+                return None  # No saving over the full image
+            log_to_gui('log', f" Built delta {base['filename']} -> {target['filename']} ({os.path.getsize(path)} of {target['size']} bytes)")
+        return {
+            "filename": name,
+            "base_version": ".".join(map(str, base["version_tuple"])),
+            "base_checksum": base["checksum"],
+            "size": os.path.getsize(path),
+        }
+    except OSError as e:
+        log_to_gui('log', f"  Delta build failed for {target['filename']}: {e}")
+        return None
+
+def find_delta(current_version, latest):
+    """Returns the delta from the vehicle's reported version to `latest`, if one exists."""
+    if not current_version:
+        return None
+    base = releases.get(current_version)
+    if base is None:
+        return None
+    with delta_lock:
+        return delta_index.get((base["checksum"], latest["checksum"]))
+
+def check_etag(latest, delta):
+    """ETag of a /check-update answer: latest version and SHA-256, plus the delta base if one is offered."""
+    if latest is None:
+        return "none"
+    tag = f"v{'.'.join(map(str, latest['version_tuple']))}-{latest['checksum'][:16]}"
+    if delta:
+        tag += f"-from-{delta['base_checksum'][:16]}"
+    return tag
+
+def versioned_check_response(response, etag):
+    """Check answers may be stored but must be revalidated; they differ per reported version."""
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.vary.add('X-Current-Version')
+    response.vary.add(VEHICLE_ID_HEADER)
+    response.vary.add(CHANNEL_HEADER)
+    return response.make_conditional(request)
+
+def versioned_file_response(directory, filename, etag):
+    """Serves a firmware/delta file with a strong ETag and long-lived immutable caching."""
+    # conditional=True answers If-None-Match with 304 and Range with 206. The
+    # folder is made absolute so it resolves against the working directory,
+    # not this script's, which lets several simulations run side by side.
+    response = send_from_directory(os.path.abspath(directory), filename, conditional=True, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def pick_variant(entry):
+    """
+    Returns the pre-compressed variant (encoding, path) the client accepts,
+    or None. Range requests always get the identity image, since a resumed
+    download continues from a decompressed offset.
+    """
+    if request.range:
+        return None
+    for encoding in VARIANT_ENCODINGS:
+        if request.accept_encodings[encoding]:
+            path = variant_path(variants_dir, entry["checksum"], encoding)
+            if os.path.exists(path):
+                return encoding, path
+    return None
 
 @app.route('/check-update')
 def check_update():
     try:
         # --- NEW: Capture and Log the VIN (Vehicle Identity) ---
         # The 'request' object holds the headers sent by tcu_client.py
-        client_vin = request.headers.get('X-Vehicle-ID', 'Unknown_Vehicle')
-        log_to_gui('log', f" TCU connected. ID Verified: {client_vin}")
+        client_vin = request.headers.get(VEHICLE_ID_HEADER)
+        log_to_gui('log', f" TCU connected. ID Verified: {client_vin or 'Unknown_Vehicle'}")
         # -------------------------------------------------------
 
+        # The newest release this vehicle's channel and rollout bucket allow
+        channel = request.headers.get(CHANNEL_HEADER, DEFAULT_CHANNEL)
+        latest = releases.release_for(client_vin, channel)
+        delta = find_delta(request.headers.get('X-Current-Version'), latest) if latest else None
+        etag = check_etag(latest, delta)
+        if etag in request.if_none_match:
+            # Nothing changed since this vehicle's last check: no scan, no body
+            log_to_gui('log', "   Not modified since last check.")
+            return versioned_check_response(jsonify(), etag)
+
         log_to_gui('log', f" Scanning '{updates_dir}'...")
-        time.sleep(0.75) # Added delay
-        os.makedirs(updates_dir, exist_ok=True)
-        files_found = os.listdir(updates_dir)
-        
-        latest_file = None
-        latest_version_tuple = (-1, -1) 
-        for filename in files_found:
-            match = re.search(r'v([\d.]+)', filename)
-            if match:
-                version_tuple = version_to_tuple(match.group(1))
-                if version_tuple > latest_version_tuple:
-                    latest_version_tuple = version_tuple
-                    latest_file = filename
+        sim_clock.sleep(0.75) # Added delay
         
-        if latest_file:
-            version_str = ".".join(map(str, latest_version_tuple))
-            filepath = os.path.join(updates_dir, latest_file)
-            checksum = calculate_sha256(filepath)
-            log_to_gui('log', f"   Latest version available: {latest_file} (v{version_str})")
-            return jsonify({"version": version_str, "filename": latest_file, "checksum": checksum, "source": "oem"})
+        if latest:
+            version_str = ".".join(map(str, latest["version_tuple"]))
+            log_to_gui('log', f"   Latest version available: {latest['filename']} (v{version_str})")
+            response = {"version": version_str, "filename": latest["filename"], "checksum": latest["checksum"], "size": latest["size"],
+                        "channel": latest["channel"], "source": "oem"}
+            if delta:
+                log_to_gui('log', f"   Delta available from v{delta['base_version']} ({delta['size']} bytes)")
+                response["delta"] = delta
+            return versioned_check_response(jsonify(response), etag)
+        elif manifest.latest():
+            log_to_gui('log', f"   No release rolled out to this vehicle on '{channel}' yet.")
+            return versioned_check_response(jsonify({"version": "0.0", "source": "oem"}), etag)
         else:
             log_to_gui('log', "   No valid update files found.")
-            return jsonify({"version": "0.0", "source": "oem"})
+            return versioned_check_response(jsonify({"version": "0.0", "source": "oem"}), etag)
     except Exception as e:
         log_to_gui('log', f"  OEM SERVER ERROR: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/download/<string:filename>')
 def download_file(filename):
-    log_to_gui('log', f" Serving {filename} to TCU...")
-    return send_from_directory(updates_dir, filename)
+    # conditional=True makes Flask answer Range requests with 206 Partial Content,
+    # which lets the TCU resume an interrupted download.
+    if request.range:
+        log_to_gui('log', f" Resuming {filename} for TCU from byte {request.range.ranges[0][0]}...")
+    else:
+        log_to_gui('log', f" Serving {filename} to TCU...")
+    entry = manifest.get(filename)
+    if entry is None:
+        return send_from_directory(os.path.abspath(updates_dir), filename, conditional=True)
+    etag = f"v{'.'.join(map(str, entry['version_tuple']))}-{entry['checksum']}"
+    variant = pick_variant(entry)
+    if variant is None:
+        response = versioned_file_response(updates_dir, filename, etag)
+    else:
+        encoding, path = variant
+        log_to_gui('log', f"   Using {encoding} variant ({os.path.getsize(path)} of {entry['size']} bytes).")
+        response = versioned_file_response(variants_dir, os.path.basename(path), f"{etag}-{encoding}")
+        response.headers['Content-Encoding'] = encoding
+        response.mimetype = 'application/octet-stream'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/download-delta/<string:filename>')
+def download_delta(filename):
+    log_to_gui('log', f" Serving delta {filename} to TCU...")
+    # Delta names already hold the base and target checksums
+    return versioned_file_response(deltas_dir, filename, os.path.splitext(filename)[0])
+
+# --- PUSH NOTIFICATIONS ---
+# /watch-updates is a server-sent events stream. A subscribed TCU gets one
+# "release" event with what /check-update would offer it right now, and
+# another whenever that offer changes (its channel and rollout bucket
+# included), so it starts updating milliseconds after a deploy instead of at
+# its next poll. The event ID is the offer's ETag: a TCU that reconnects
+# sends it back as Last-Event-ID and gets an event only if it missed a change.
+# A waiting stream is one thread parked on a condition variable. It wakes on
+# release changes and every SSE_HEARTBEAT_SECONDS to send a comment line,
+# which lets both ends notice dead connections. Worker reloads end the streams.
+# The TCUs then reconnect to the new generation, which sends whatever changed.
+SSE_HEARTBEAT_SECONDS = 15
+
+release_changed = threading.Condition()
+release_generation = 0
+streams_closing = threading.Event()
+
+def notify_release_change(catalog=None):
+    global release_generation
+    with release_changed:
+        release_generation += 1
+        release_changed.notify_all()
+
+def close_streams():
+    streams_closing.set()
+    notify_release_change()
+
+def sse_event(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/watch-updates')
+def watch_updates():
+    client_vin = request.headers.get(VEHICLE_ID_HEADER)
+    channel = request.headers.get(CHANNEL_HEADER, DEFAULT_CHANNEL)
+    last_sent = request.headers.get('Last-Event-ID')
+    log_to_gui('log', f" TCU {client_vin or 'Unknown_Vehicle'} subscribed to update notifications.")
+
+    def stream():
+        nonlocal last_sent
+        while not streams_closing.is_set():
+            with release_changed:
+                generation = release_generation
+            release = releases.release_for(client_vin, channel)
+            etag = check_etag(release, None)
+            if etag != last_sent:
+                last_sent = etag
+                offer = {"version": "0.0"}
+                if release:
+                    offer = {"version": release["version"], "filename": release["filename"],
+                             "checksum": release["checksum"], "channel": release["channel"]}
+                yield sse_event("release", offer, etag)
+            with release_changed:
+                woken = (release_generation != generation or streams_closing.is_set()
+                         or release_changed.wait(SSE_HEARTBEAT_SECONDS))
+            if not woken:
+                yield ": keep-alive\n\n"
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Tell proxies not to buffer the stream
+    return response
+
+# --- MULTI-PROCESS SERVING ---
+# `--workers N` runs N forked worker processes that accept on one shared
+# listening socket. The parent builds the manifest, checksums and deltas once
+# and the workers inherit them read-only (copy-on-write) instead of each
+# hashing the firmware again. When the parent's watcher sees a deploy, its
+# delta thread finishes a build pass, or it gets SIGHUP, it forks a fresh
+# generation of workers and asks the old ones to finish their in-flight
+# requests and exit, so clients never see a refused connection. POSIX only;
+# elsewhere the single-process server is used.
+WORKER_SHUTDOWN_SIGNAL = signal.SIGTERM
+# A worker that dies within WORKER_FAST_FAILURE_SECONDS of starting is
+# restarted after an exponential backoff; after WORKER_MAX_FAST_FAILURES such
+# deaths in a row in one slot, the server gives up instead of fork-storming.
+WORKER_FAST_FAILURE_SECONDS = 5.0
+WORKER_MAX_FAST_FAILURES = 5
+WORKER_BACKOFF_BASE_SECONDS = 0.5
+WORKER_BACKOFF_MAX_SECONDS = 30.0
+
+class SendfileWrapper:
+    """
+    wsgi.file_wrapper that hands the open firmware file to socket.sendfile(),
+    so the kernel copies it straight from the page cache to the socket.
+    The first (empty) chunk makes the server send the response headers.
+    """
+    def __init__(self, sock, filelike, block_size=8192):
+        self.sock = sock
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        try:
+            yield b""
+            self.sock.sendfile(self.filelike, self.filelike.tell())
+        finally:
+            self.close()
+
+    def close(self):
+        self.filelike.close()
+
+def sendfile_middleware(wsgi_app):
+    """Installs SendfileWrapper for whole-file responses; Range requests keep Flask's own wrapper."""
+    def middleware(environ, start_response):
+        sock = environ.get('werkzeug.socket')
+        if sock is not None and 'HTTP_RANGE' not in environ:
+            environ['wsgi.file_wrapper'] = lambda f, block_size=8192: SendfileWrapper(sock, f, block_size)
+        return wsgi_app(environ, start_response)
+    return middleware
+
+def run_worker(host, port, listen_fd):
+    """Worker process body: serve on the inherited socket until told to stop."""
+    from werkzeug.serving import make_server
+    server = make_server(host, port, sendfile_middleware(app), threaded=True, fd=listen_fd)
+    # Track request threads so server_close() waits for in-flight downloads
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        close_streams()  # Subscribers reconnect to the next generation of workers
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(WORKER_SHUTDOWN_SIGNAL, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server.serve_forever()
+    server.server_close()
+
+def spawn_worker(host, port, listen_fd):
+    # Hold the shared locks while forking so no other thread owns them in the child
+    with manifest._lock, releases._lock, delta_lock, release_changed, gui_events._lock:
+        pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(host, port, listen_fd)
+        except BaseException as e:
+            log_to_gui('log', f"[X] OEM worker {os.getpid()} crashed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    return pid
+
+def serve_workers(host, port, workers):
+    listener = socket.create_server((host, port), backlog=1024)
+    listener.set_inheritable(True)
+    reload_requested = threading.Event()
+    stopping = threading.Event()
+
+    releases.add_listener(lambda changed: reload_requested.set())
+    delta_listeners.append(reload_requested.set)  # Workers only see deltas built before they were forked
+    manifest.start_watcher()
+    releases.start_watcher()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: stopping.set())
+
+    current = {}    # pid -> (slot, start time)
+    retiring = set()
+    failures = [0] * workers  # Fast failures in a row, per slot
+    restart_at = {}           # slot -> when its replacement worker is due
+    gave_up = None
+
+    def start(slot):
+        current[spawn_worker(host, port, listener.fileno())] = (slot, time.monotonic())
+
+    for slot in range(workers):
+        start(slot)
+    log_to_gui('log', f"[+] {workers} OEM worker processes serving on port {port}.")
+    while not stopping.is_set():
+        if reload_requested.wait(0.5):
+            reload_requested.clear()
+            if stopping.is_set():
+                break
+            old = set(current)
+            current.clear()
+            restart_at.clear()
+            for slot in range(workers):
+                start(slot)
+            for pid in old:
+                os.kill(pid, WORKER_SHUTDOWN_SIGNAL)
+            retiring |= old
+            log_to_gui('log', f" Releases or deltas changed: reloaded {workers} workers ({len(releases.releases())} releases, {len(delta_index)} deltas).")
+        # Reap exited workers; replace any current one that died unexpectedly. Each pid
+        # is waited for by name, so the delta builder's children are left to their own waitpid.
+        now = time.monotonic()
+        for pid in list(current) + list(retiring):
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+                if reaped == 0:
+                    continue
+            except ChildProcessError:
+                status = 0
+            retiring.discard(pid)
+            if pid not in current:
+                continue
+            slot, started = current.pop(pid)
+            if now - started >= WORKER_FAST_FAILURE_SECONDS:
+                failures[slot] = 0
+            failures[slot] += 1
+            if failures[slot] >= WORKER_MAX_FAST_FAILURES:
+                gave_up = f"OEM worker slot {slot} failed {failures[slot]} times in a row within {WORKER_FAST_FAILURE_SECONDS:g} s of starting"
+                stopping.set()
+                break
+            delay = 0.0 if failures[slot] == 1 else min(WORKER_BACKOFF_MAX_SECONDS, WORKER_BACKOFF_BASE_SECONDS * 2 ** (failures[slot] - 2))
+            log_to_gui('log', f"[!] OEM worker {pid} exited (status {os.waitstatus_to_exitcode(status)}); restarting in {delay:g} s.")
+            restart_at[slot] = now + delay
+        for slot, due in list(restart_at.items()):
+            if due <= now and not stopping.is_set():
+                del restart_at[slot]
+                start(slot)
+
+    for pid in set(current) | retiring:
+        try:
+            os.kill(pid, WORKER_SHUTDOWN_SIGNAL)
+        except ProcessLookupError:
+            pass
+    for pid in set(current) | retiring:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    listener.close()
+    if gave_up:
+        raise RuntimeError(gave_up)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OEM update server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (POSIX only; 1 = single-process server)")
+    args = parser.parse_args()
     try:
         log_to_gui('status', 'Running', '#4CAF50')
-        log_to_gui('log', "[+] OEM Server process started on port 5000.")
+        log_to_gui('log', f"[+] OEM Server process started on port {args.port}.")
         os.makedirs(updates_dir, exist_ok=True)
-        app.run(host='127.0.0.1', port=5000)
+        manifest.add_listener(releases.rebuild)
+        releases.add_listener(notify_release_change)
+        manifest.add_listener(rebuild_deltas)  # Last, and only queues the build, so deploys are announced at once
+        manifest.refresh()
+        releases.rebuild()
+        if args.workers > 1 and hasattr(os, 'fork'):
+            serve_workers(args.host, args.port, args.workers)
+        else:
+            manifest.start_watcher()
+            releases.start_watcher()
+            app.run(host=args.host, port=args.port)
     except Exception as e:
         log_to_gui('log', f"[X] OEM SERVER FATAL CRASH: {e}")
         log_to_gui('status', 'Crashed', '#f44336')
\ No newline at end of file
@@ -0,0 +1,67 @@
+# release_catalog.py
+"""
+CLI for the release policy the OEM server applies (see ReleaseCatalog in
+shared_utils): which channel each version is on and how far its staged
+rollout has gone. The running server picks up changes within a second.
+
+Usage:
+    python release_catalog.py list [--channel beta]
+    python release_catalog.py set 1.3 --channel beta --rollout 10
+    python release_catalog.py resolve SIMVIN000042 [--channel beta]
+"""
+import argparse
+import json
+import sys
+from shared_utils import (UpdateManifest, FirmwareStore, ReleaseCatalog, RELEASE_CHANNELS, DEFAULT_CHANNEL,
+                          DEFAULT_RELEASE_POLICY, rollout_bucket)
+
+RELEASE_FIELDS = ("version", "filename", "channel", "rollout_percent", "checksum", "size")
+
+def describe(release):
+    if release is None:
+        return None
+    return {k: release[k] for k in RELEASE_FIELDS}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and change release channels and staged rollouts.")
+    parser.add_argument("--updates", default="updates", help="Folder the OEM server publishes")
+    parser.add_argument("--policy", default=DEFAULT_RELEASE_POLICY)
+    sub = parser.add_subparsers(dest="command", required=True)
+    lst = sub.add_parser("list", help="Releases as JSON lines, oldest first")
+    lst.add_argument("--channel", choices=RELEASE_CHANNELS)
+    st = sub.add_parser("set", help="Move a version to a channel and/or change its rollout percentage")
+    st.add_argument("version")
+    st.add_argument("--channel", choices=RELEASE_CHANNELS)
+    st.add_argument("--rollout", type=float, help="Percentage of vehicles (0-100)")
+    res = sub.add_parser("resolve", help="What the server offers one vehicle")
+    res.add_argument("vehicle_id")
+    res.add_argument("--channel", choices=RELEASE_CHANNELS, default=DEFAULT_CHANNEL)
+    args = parser.parse_args(argv)
+
+    manifest = UpdateManifest(args.updates, store=FirmwareStore())
+    catalog = ReleaseCatalog(manifest, args.policy)
+    manifest.add_listener(catalog.rebuild)
+    manifest.refresh()
+    catalog.rebuild()
+
+    if args.command == "list":
+        for release in catalog.releases(args.channel):
+            print(json.dumps(describe(release)))
+    elif args.command == "set":
+        if args.channel is None and args.rollout is None:
+            parser.error("set needs --channel and/or --rollout")
+        if catalog.get(args.version) is None:
+            print(f"Note: no published image has version {args.version} yet; the rule applies once one does.", file=sys.stderr)
+        rule = catalog.set_policy(args.version, args.channel, args.rollout)
+        print(json.dumps({"version": args.version, **rule}))
+    elif args.command == "resolve":
+        print(json.dumps({
+            "vehicle_id": args.vehicle_id,
+            "channel": args.channel,
+            "bucket": rollout_bucket(args.vehicle_id),
+            "release": describe(catalog.release_for(args.vehicle_id, args.channel)),
+        }, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
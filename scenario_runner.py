@@ -0,0 +1,317 @@
+# scenario_runner.py
+"""
+Headless runner for the security scenarios the GUI is normally clicked through.
+
+A scenario matrix (checksum on/off x resilience on/off x deploy sequences) is
+expanded into scenarios that run in parallel on a process pool. Each scenario
+gets its own working directory, config.ini and ports, starts the four
+simulator processes there exactly like the GUI does, replays its steps and
+reports per check what the TCU and ECU did, plus the ECU's final slot state
+read back from its NVRAM.
+
+Usage:
+    python scenario_runner.py                                  # built-in matrix
+    python scenario_runner.py matrix.json --jobs 8 --output results.json
+
+Matrix file (every key optional; missing keys use DEFAULT_MATRIX):
+    {"checksum": [true, false], "resilience": [true, false], "time_scale": 0,
+     "sequences": {"oem_update": ["deploy oem", "check"],
+                   "attack": ["deploy malicious", "check"]}}
+
+Steps: "deploy oem", "deploy malicious", "check", "wait <seconds>".
+"""
+import argparse
+import configparser
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from shared_utils import (FirmwareStore, DEFAULT_STORE_ROOT, find_latest_version, next_minor_version,
+                          build_compressed_variants, decode_frame)
+from ecu_receiver import EcuNode, SlotStorage
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MATRIX = {
+    "checksum": [True, False],
+    "resilience": [True, False],
+    "time_scale": 0,
+    "sequences": {
+        "oem_update": ["deploy oem", "check"],
+        "attack": ["deploy malicious", "check"],
+        "attack_then_oem": ["deploy malicious", "check", "deploy oem", "check"],
+    },
+}
+
+STARTUP_TIMEOUT = 20
+CHECK_TIMEOUT = 120
+MANIFEST_SETTLE_SECONDS = 1.0  # Servers' manifest watchers poll every 0.5 s
+TCU_DONE_STATUSES = ("Success", "Idle", "Crashed")
+
+def expand_matrix(matrix):
+    """Returns one scenario dict per combination of the matrix axes."""
+    matrix = {**DEFAULT_MATRIX, **matrix}
+    scenarios = []
+    for checksum, resilience, (seq_name, steps) in itertools.product(
+            matrix["checksum"], matrix["resilience"], matrix["sequences"].items()):
+        scenarios.append({
+            "name": f"{seq_name}-checksum_{'on' if checksum else 'off'}-resilience_{'on' if resilience else 'off'}",
+            "sequence": seq_name,
+            "checksum": checksum,
+            "resilience": resilience,
+            "steps": steps,
+            "time_scale": matrix["time_scale"],
+        })
+    return scenarios
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class EventLog:
+    """Follows one component's stdout file and decodes its frames."""
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.pending = b""
+
+    def poll(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        events = []
+        for raw in lines:
+            line = raw.decode("utf-8", "replace").rstrip("\r")
+            frame = decode_frame(line)
+            events.extend(frame if frame is not None else [{"t": "log", "m": line}])
+        return events
+
+class Scenario:
+    def __init__(self, spec, work_dir):
+        self.spec = spec
+        self.work_dir = work_dir
+        self.ports = {"oem": free_port(), "malicious": free_port(), "ecu": free_port()}
+        self.processes = {}
+        self.logs = {}
+        self.store = FirmwareStore(os.path.join(work_dir, DEFAULT_STORE_ROOT))
+
+    def path(self, *parts):
+        return os.path.join(self.work_dir, *parts)
+
+    def write_config(self):
+        config = configparser.ConfigParser()
+        config['TCU'] = {'current_version': '1.0'}
+        config['Server'] = {'oem_url': f"http://127.0.0.1:{self.ports['oem']}",
+                            'malicious_url': f"http://127.0.0.1:{self.ports['malicious']}"}
+        config['Security'] = {'checksum_verification_enabled': str(self.spec["checksum"]),
+                              'ecu_resilience_enabled': str(self.spec["resilience"])}
+        config['Folders'] = {'ecu_shared_folder': 'shared_for_ecu', 'tcu_download_folder': 'tcu_downloads',
+                             'tcu_image_folder': 'tcu_images', 'ecu_slot_folder': 'ecu_slots'}
+        config['Simulation'] = {'time_scale': str(self.spec["time_scale"])}
+        config['IPC'] = {'ecu_socket': 'ecu_control.sock', 'ecu_port': str(self.ports["ecu"])}
+        with open(self.path('config.ini'), 'w') as f: config.write(f)
+
+    def start(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.write_config()
+        self.store.put_bytes(self.path("updates"), "firmware_v1.1.bin", b"Initial legitimate firmware v1.1.")
+        os.makedirs(self.path("malicious_updates"), exist_ok=True)
+        env = dict(os.environ, OTA_TIME_SCALE=str(self.spec["time_scale"]))
+        commands = {
+            'server': ['oem_server.py', '--port', str(self.ports['oem'])],
+            'malicious_server': ['malicious_server.py', '--port', str(self.ports['malicious'])],
+            'ecu': ['ecu_receiver.py'],
+            'tcu': ['tcu_client.py'],
+        }
+        for name, (script, *args) in commands.items():
+            log_path = self.path(f"{name}.log")
+            with open(log_path, "wb") as out:
+                self.processes[name] = subprocess.Popen(
+                    [sys.executable, os.path.join(SCRIPT_DIR, script), *args], cwd=self.work_dir, env=env,
+                    stdin=subprocess.PIPE if name == 'tcu' else subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT)
+            self.logs[name] = EventLog(log_path)
+        self.wait_until_ready()
+
+    def wait_until_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        pending_ports = {self.ports['oem'], self.ports['malicious']}
+        ecu_listening = False
+        while time.monotonic() < deadline:
+            for port in list(pending_ports):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                    pending_ports.discard(port)
+                except OSError:
+                    pass
+            ecu_listening = ecu_listening or any(
+                e["t"] == "status" and e["m"] == "Listening" for e in self.logs['ecu'].poll())
+            if not pending_ports and ecu_listening:
+                return
+            for name, process in self.processes.items():
+                if process.poll() is not None:
+                    raise RuntimeError(f"{name} exited during startup (code {process.returncode})")
+            time.sleep(0.05)
+        raise RuntimeError("Simulator processes did not become ready in time")
+
+    def deploy(self, source):
+        folders = [self.path("updates"), self.path("malicious_updates")]
+        version = next_minor_version(find_latest_version(folders, self.store))
+        if source == "oem":
+            filename = f"firmware_v{version}.bin"
+            entry = self.store.put_bytes(folders[0], filename, f"Content v{version}".encode())
+            build_compressed_variants(os.path.join(folders[0], filename), self.path("update_variants"), entry["checksum"])
+        else:
+            filename = f"malicious_firmware_v{version}.bin"
+            self.store.put_bytes(folders[1], filename, f"Malicious payload v{version}".encode())
+        time.sleep(MANIFEST_SETTLE_SECONDS)
+        return {"action": f"deploy {source}", "filename": filename}
+
+    def check(self):
+        tcu = self.processes['tcu']
+        self.logs['tcu'].poll()  # Skip anything logged before this check
+        started = time.monotonic()
+        tcu.stdin.write(b"CHECK\n")
+        tcu.stdin.flush()
+        record = {"action": "check", "offered": None, "ecu_ack": None, "error": None, "tcu_status": None}
+        checking = False
+        while time.monotonic() - started < CHECK_TIMEOUT:
+            for event in self.logs['tcu'].poll():
+                message = event["m"].strip()
+                if event["t"] == "status":
+                    if message == "Checking":
+                        checking = True
+                    elif checking and message in TCU_DONE_STATUSES:
+                        record["tcu_status"] = message
+                        record["seconds"] = round(time.monotonic() - started, 3)
+                        return record
+                elif message.startswith("New version found:"):
+                    record["offered"] = message.split(":", 1)[1].strip()
+                elif message.startswith("ACK received from ECU:"):
+                    record["ecu_ack"] = message.split(":", 1)[1].strip().rstrip(".")
+                elif "CHECKSUM MISMATCH" in message or "Error" in message or "Timed out" in message:
+                    record["error"] = message
+            if tcu.poll() is not None:
+                record["error"] = f"TCU exited (code {tcu.returncode})"
+                break
+            time.sleep(0.02)
+        record["seconds"] = round(time.monotonic() - started, 3)
+        record["error"] = record["error"] or "check timed out"
+        return record
+
+    def final_state(self):
+        config = configparser.ConfigParser()
+        config.read(self.path('config.ini'))
+        node = EcuNode()
+        SlotStorage(self.path('ecu_slots')).load(node)
+        return {
+            "tcu_version": config.get('TCU', 'current_version', fallback=None),
+            "ecu_active_slot": node.active_slot,
+            "ecu_active_version": node.active_version,
+            "ecu_slot_versions": node.slot_versions,
+            "ecu_boot_state": node.boot_state,
+        }
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            if process.stdin:
+                process.stdin.close()
+
+def run_scenario(spec, work_root):
+    """Runs one scenario in its own directory under work_root. Runs in a pool worker."""
+    work_dir = tempfile.mkdtemp(prefix=spec["name"] + "-", dir=work_root)
+    scenario = Scenario(spec, work_dir)
+    result = {"name": spec["name"], "sequence": spec["sequence"], "checksum": spec["checksum"],
+              "resilience": spec["resilience"], "work_dir": work_dir, "ports": scenario.ports, "steps": []}
+    started = time.monotonic()
+    try:
+        scenario.start()
+        result["startup_seconds"] = round(time.monotonic() - started, 3)
+        for step in spec["steps"]:
+            action, _, arg = step.partition(" ")
+            if action == "deploy":
+                result["steps"].append(scenario.deploy(arg))
+            elif action == "check":
+                result["steps"].append(scenario.check())
+            elif action == "wait":
+                time.sleep(float(arg))
+            else:
+                raise ValueError(f"Unknown step '{step}'")
+        time.sleep(0.5)  # Let the ECU persist its last outcome
+        result["final"] = scenario.final_state()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        scenario.stop()
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+def run_matrix(matrix, jobs=None, work_root=None):
+    scenarios = expand_matrix(matrix)
+    work_root = work_root or tempfile.mkdtemp(prefix="ota_scenarios-")
+    os.makedirs(work_root, exist_ok=True)
+    # Scenarios mostly wait on their simulator processes, so run more than one per core
+    jobs = jobs or min(len(scenarios), max(4, 2 * (os.cpu_count() or 1)))
+    started = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_scenario, spec, work_root) for spec in scenarios]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = result.get("error") or ", ".join(
+                s.get("ecu_ack") or s.get("error") or s.get("tcu_status") or ""
+                for s in result["steps"] if s["action"] == "check")
+            print(f"[{len(results)}/{len(scenarios)}] {result['name']}: {status} ({result['seconds']} s)", file=sys.stderr)
+    results.sort(key=lambda r: r["name"])
+    return {
+        "work_root": work_root,
+        "jobs": jobs,
+        "scenarios": len(results),
+        "failed_to_run": sum(1 for r in results if "error" in r),
+        "wall_seconds": round(time.monotonic() - started, 3),
+        "serial_seconds": round(sum(r["seconds"] for r in results), 3),
+        "results": results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simulator scenarios headless and in parallel.")
+    parser.add_argument("matrix", nargs="?", help="Matrix JSON file (default: built-in matrix)")
+    parser.add_argument("--jobs", type=int, default=None, help="Parallel scenarios (default: 2 per CPU, at least 4)")
+    parser.add_argument("--work-root", help="Directory for the scenario working directories")
+    parser.add_argument("--output", help="Write the JSON summary here instead of stdout")
+    args = parser.parse_args(argv)
+
+    matrix = {}
+    if args.matrix:
+        with open(args.matrix) as f:
+            matrix = json.load(f)
+    summary = run_matrix(matrix, args.jobs, args.work_root)
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if summary["failed_to_run"] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
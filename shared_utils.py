@@ -1,23 +1,45 @@
 # shared_utils.py
 import hashlib
+import bisect
 import re
 import os
+import configparser
+import struct
+import socket
+import gzip
+import shutil
+import json
+import sys
+import threading
+import time
+import uuid
+import contextlib
+import atexit
+import select
+import ctypes
+import ctypes.util
 
-def find_latest_version(folders_to_scan):
+def find_latest_version(folders_to_scan, store=None):
     """
-    Scans a list of folders to find the highest version number from filenames.
-    e.g., "firmware_v1.2.bin" -> (1, 2)
+    Finds the highest version published in a list of folders, e.g.
+    "firmware_v1.2.bin" -> (1, 2). Versions come from the firmware store's
+    catalog; files dropped into a folder by hand are read from their names.
     """
+    store = store or FirmwareStore()
+    catalog = store.catalog()
     latest_version_tuple = (0, 0)
     for folder in folders_to_scan:
-        if not os.path.exists(folder):
-            continue
-        for filename in os.listdir(folder):
-            match = re.search(r'v([\d.]+)', filename)
-            if match:
-                version_tuple = version_to_tuple(match.group(1))
-                if version_tuple > latest_version_tuple:
-                    latest_version_tuple = version_tuple
+        versions = [e["version"] for e in catalog.get(store.folder_key(folder), {}).values()]
+        if os.path.exists(folder):
+            cataloged = catalog.get(store.folder_key(folder), {})
+            for filename in os.listdir(folder):
+                match = re.search(r'v([\d.]+)', filename)
+                if match and filename not in cataloged:
+                    versions.append(match.group(1))
+        for version in versions:
+            version_tuple = version_to_tuple(version)
+            if version_tuple > latest_version_tuple:
+                latest_version_tuple = version_tuple
     return latest_version_tuple
 
 def calculate_sha256(filepath):
@@ -25,7 +47,7 @@ def calculate_sha256(filepath):
     sha256_hash = hashlib.sha256()
     try:
         with open(filepath, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
+            for byte_block in iter(lambda: f.read(1024 * 1024), b""):
                 sha256_hash.update(byte_block)
         return sha256_hash.hexdigest()
     except (IOError, FileNotFoundError):
@@ -33,16 +55,1214 @@ def calculate_sha256(filepath):
 
 def version_to_tuple(v_str):
     """
-    Converts a version string 'x.y.z' to a tuple of ints (major, minor)
-    for robust comparison.
+    Converts a version string 'x.y.z...' to a tuple of ints for robust
+    comparison, e.g. '1.10.2' -> (1, 10, 2). The result has at least
+    (major, minor); zeros past that are dropped, so '1.2' == '1.2.0'.
     """
     try:
         if v_str is None: return (0, 0)
-        parts = str(v_str).strip().split('.')
-        
-        major = int(parts[0]) if len(parts) > 0 and parts[0].isdigit() else 0
-        minor = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
-        
-        return (major, minor)
+        parts = []
+        for part in str(v_str).strip().strip('.').split('.'):
+            digits = re.match(r'\d*', part).group()
+            parts.append(int(digits) if digits else 0)
+        while len(parts) > 2 and parts[-1] == 0: parts.pop()
+        while len(parts) < 2: parts.append(0)
+        return tuple(parts)
+    except (ValueError, TypeError):
+        return (0, 0)
+
+def next_minor_version(version_tuple):
+    """The version the simulator deploys after `version_tuple`: (1, 2) or (1, 2, 3) -> '1.3'."""
+    return f"{version_tuple[0]}.{version_tuple[1] + 1}"
+
+# --- UPDATE MANIFEST ---
+# Servers answer /check-update from this in-memory index instead of listing
+# and hashing the updates folder on every request.
+VERSION_PATTERN = re.compile(r'v([\d.]+)')
+
+class UpdateManifest:
+    """
+    In-memory index of the firmware files in one folder.
+    Checksums are cached by (path, size, mtime) so a file is only hashed
+    again when it actually changes on disk. With a FirmwareStore, checksums
+    of stored files come from its catalog, and files dropped in by hand are
+    hashed once and moved into the store.
+    """
+    def __init__(self, folder, store=None):
+        self.folder = folder
+        self.store = store
+        self._lock = threading.Lock()
+        self._entries = {}          # filename -> {"version", "version_tuple", "checksum", ...}
+        self._checksum_cache = {}   # (path, size, mtime_ns) -> sha256
+        self._latest = None
+        self._watcher = None
+        self._listeners = []
+
+    def refresh(self):
+        """
+        Re-stats the folder and re-hashes only new or modified files.
+        Returns True if the manifest changed.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        seen = {}
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                match = VERSION_PATTERN.search(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                st = entry.stat()
+                seen[entry.name] = (entry.path, st.st_size, st.st_mtime_ns, match.group(1))
+
+        with self._lock:
+            current = {name: (e["path"], e["size"], e["mtime_ns"], e["version"]) for name, e in self._entries.items()}
+        if seen == current:
+            return False
+
+        entries = {}
+        live_keys = set()
+        for name, (path, size, mtime_ns, version) in seen.items():
+            key = (path, size, mtime_ns)
+            live_keys.add(key)
+            checksum = self._checksum_cache.get(key)
+            if checksum is None and self.store is not None:
+                checksum = self.store.lookup(self.folder, name, size, mtime_ns)
+                if checksum is None:
+                    try:
+                        # Hash once while adopting; the file becomes a link to its blob
+                        stored = self.store.adopt(self.folder, name)
+                    except OSError:
+                        continue  # Removed between scandir and hashing
+                    checksum, size, mtime_ns = stored["checksum"], stored["size"], stored["mtime_ns"]
+                    key = (path, size, mtime_ns)
+                    live_keys.add(key)
+            if checksum is None:
+                checksum = calculate_sha256(path)
+                if checksum is None:
+                    continue  # Removed between scandir and hashing
+            self._checksum_cache[key] = checksum
+            entries[name] = {
+                "filename": name,
+                "path": path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "version": version,
+                "version_tuple": version_to_tuple(version),
+                "checksum": checksum,
+            }
+
+        # Drop checksums of files that no longer exist
+        for key in list(self._checksum_cache):
+            if key not in live_keys:
+                del self._checksum_cache[key]
+
+        latest = None
+        for entry in entries.values():
+            if latest is None or entry["version_tuple"] > latest["version_tuple"]:
+                latest = entry
+
+        with self._lock:
+            self._entries = entries
+            self._latest = latest
+        for callback in list(self._listeners):
+            try:
+                callback(self)
+            except Exception:
+                pass
+        return True
+
+    def latest(self):
+        """Returns the entry with the highest version, or None. Never touches disk."""
+        with self._lock:
+            return self._latest
+
+    def get(self, filename):
+        with self._lock:
+            return self._entries.get(filename)
+
+    def entries(self):
+        """Returns all entries sorted by version, oldest first."""
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda e: e["version_tuple"])
+
+    def add_listener(self, callback):
+        """Registers callback(manifest), called after every change."""
+        self._listeners.append(callback)
+
+    def start_watcher(self, interval=0.5):
+        """
+        Refreshes the manifest in a background thread whenever the folder
+        changes: at once where inotify reports it, else within `interval`.
+        """
+        if self._watcher is not None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        fd = watch_folder_fd(self.folder, IN_MOVED_TO | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_DELETE)
+        def watch():
+            while True:
+                try:
+                    self.refresh()
+                except OSError:
+                    pass
+                if fd is not None and select.select([fd], [], [], interval)[0]:
+                    os.read(fd, 65536)
+                elif fd is None:
+                    time.sleep(interval)
+        self._watcher = threading.Thread(target=watch, name="manifest-watcher", daemon=True)
+        self._watcher.start()
+
+# --- RELEASE CATALOG ---
+# Decides what each vehicle should get. The releases are the manifest's images,
+# kept sorted by full version. Each has a channel and a staged rollout
+# percentage from release_policy.json:
+#   {"1.3": {"channel": "beta", "rollout_percent": 10}, ...}
+# Versions without an entry are stable and at 100%. A vehicle on a channel
+# sees that channel's releases and those of every more stable channel. Each
+# vehicle ID hashes to a fixed bucket in [0, ROLLOUT_BUCKETS), and a release
+# reaches the buckets below its percentage, so raising the percentage only
+# ever adds vehicles. Each channel keeps a table that maps every bucket to the
+# newest release reaching it, so answering a vehicle costs one hash and one
+# list index. Vehicles that send no ID only get fully rolled-out releases.
+RELEASE_CHANNELS = ("stable", "beta", "dev")  # Most stable first
+DEFAULT_CHANNEL = "stable"
+DEFAULT_RELEASE_POLICY = "release_policy.json"
+ROLLOUT_BUCKETS = 10000  # 0.01% steps
+VEHICLE_ID_HEADER = "X-Vehicle-ID"
+CHANNEL_HEADER = "X-Update-Channel"
+
+def rollout_bucket(vehicle_id):
+    digest = hashlib.sha256(vehicle_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % ROLLOUT_BUCKETS
+
+class ReleaseCatalog:
+    def __init__(self, manifest, policy_path=DEFAULT_RELEASE_POLICY, policy=None):
+        """With policy_path=None the rules come from `policy` ({version: rule}) and set_policy()."""
+        self.manifest = manifest
+        self.policy_path = policy_path
+        self._lock = threading.Lock()
+        self._policy = {version_to_tuple(v): dict(rule) for v, rule in (policy or {}).items()}
+        self._policy_stat = None
+        self._state = self._build([], {})  # Replaced whole on rebuild, so reads take no lock
+        self._watcher = None
+        self._listeners = []
+
+    # --- POLICY ---
+    def load_policy(self):
+        """Returns {version tuple: {"channel", "rollout_percent"}}, re-read only when the file changed."""
+        if self.policy_path is None:
+            return self._policy
+        try:
+            st = os.stat(self.policy_path)
+            stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            stat = None
+        if stat != self._policy_stat:
+            policy = {}
+            if stat is not None:
+                try:
+                    with open(self.policy_path, encoding='utf-8') as f:
+                        raw = json.load(f)
+                    for version, rule in raw.items():
+                        policy[version_to_tuple(version)] = rule
+                except (OSError, ValueError, AttributeError):
+                    return self._policy  # Keep the last good policy
+            self._policy, self._policy_stat = policy, stat
+        return self._policy
+
+    def set_policy(self, version, channel=None, rollout_percent=None):
+        """Updates one version's rule in the policy file (written atomically) and rebuilds."""
+        if self.policy_path is None:
+            raw = {".".join(map(str, v)): rule for v, rule in self._policy.items()}
+        else:
+            try:
+                with open(self.policy_path, encoding='utf-8') as f:
+                    raw = json.load(f)
+            except (OSError, ValueError):
+                raw = {}
+        key = ".".join(map(str, version_to_tuple(version)))
+        rule = raw.get(key, {})
+        if channel is not None:
+            if channel not in RELEASE_CHANNELS:
+                raise ValueError(f"Unknown channel '{channel}' (expected one of {', '.join(RELEASE_CHANNELS)})")
+            rule["channel"] = channel
+        if rollout_percent is not None:
+            rule["rollout_percent"] = max(0.0, min(100.0, float(rollout_percent)))
+        raw[key] = rule
+        if self.policy_path is None:
+            self._policy = {version_to_tuple(v): r for v, r in raw.items()}
+        else:
+            tmp_path = self.policy_path + ".tmp"
+            with open(tmp_path, "w", encoding='utf-8') as f:
+                json.dump(raw, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.policy_path)
+        self.rebuild()
+        return rule
+
+    # --- INDEX ---
+    def rebuild(self, manifest=None):
+        """Re-indexes the manifest's entries; register it with manifest.add_listener to follow deploys."""
+        entries = self.manifest.entries()  # Sorted oldest first; taken before self._lock, never inside it
+        with self._lock:
+            policy = self.load_policy()
+            by_version = {}
+            for entry in entries:
+                rule = policy.get(entry["version_tuple"], {})
+                channel = rule.get("channel", DEFAULT_CHANNEL)
+                percent = max(0.0, min(100.0, float(rule.get("rollout_percent", 100.0))))
+                by_version[entry["version_tuple"]] = dict(
+                    entry, version=".".join(map(str, entry["version_tuple"])),
+                    channel=channel if channel in RELEASE_CHANNELS else DEFAULT_CHANNEL,
+                    rollout_percent=percent, rollout_reach=int(round(percent * ROLLOUT_BUCKETS / 100.0)))
+            self._state = self._build(sorted(by_version.values(), key=lambda r: r["version_tuple"]), by_version)
+        for callback in list(self._listeners):
+            try:
+                callback(self)
+            except Exception:
+                pass
+
+    @staticmethod
+    def _build(releases, by_version):
+        channels = {}
+        for rank, channel in enumerate(RELEASE_CHANNELS):
+            visible = [r for r in releases if RELEASE_CHANNELS.index(r["channel"]) <= rank]
+            table = [None] * ROLLOUT_BUCKETS
+            covered = 0
+            full = None
+            for release in reversed(visible):
+                reach = release["rollout_reach"]
+                if reach > covered:
+                    table[covered:reach] = [release] * (reach - covered)
+                    covered = reach
+                if reach == ROLLOUT_BUCKETS:
+                    full = release
+                    break
+            channels[channel] = {"releases": visible, "versions": [r["version_tuple"] for r in visible],
+                                 "table": table, "full": full}
+        return {"releases": releases, "by_version": by_version, "channels": channels}
+
+    def _channel(self, channel):
+        channels = self._state["channels"]
+        return channels.get(channel) or channels[DEFAULT_CHANNEL]
+
+    # --- LOOKUPS ---
+    def releases(self, channel=None):
+        """Releases sorted oldest first; with a channel, only those visible on it."""
+        return list(self._state["releases"] if channel is None else self._channel(channel)["releases"])
+
+    def get(self, version):
+        """The release with this version (string or tuple), whatever its channel and rollout."""
+        key = version if isinstance(version, tuple) else version_to_tuple(version)
+        return self._state["by_version"].get(key)
+
+    def latest(self, channel=DEFAULT_CHANNEL, below=None):
+        """Newest release visible on the channel, optionally older than `below`, ignoring rollout. O(log n)."""
+        index = self._channel(channel)
+        pos = len(index["versions"]) if below is None else bisect.bisect_left(index["versions"], version_to_tuple(below))
+        return index["releases"][pos - 1] if pos else None
+
+    def release_for(self, vehicle_id, channel=DEFAULT_CHANNEL):
+        """Newest release this vehicle is in the rollout of, or None. Constant time."""
+        if not vehicle_id:
+            return self._channel(channel)["full"]
+        return self.release_for_bucket(rollout_bucket(vehicle_id), channel)
+
+    def release_for_bucket(self, bucket, channel=DEFAULT_CHANNEL):
+        """release_for() with the vehicle's rollout bucket already computed."""
+        return self._channel(channel)["table"][bucket]
+
+    # --- CHANGE NOTIFICATION ---
+    def add_listener(self, callback):
+        """Registers callback(catalog), called after every rebuild."""
+        self._listeners.append(callback)
+
+    def refresh(self):
+        """Rebuilds if the policy file changed. Returns True if it did."""
+        with self._lock:
+            before = self._policy_stat
+            self.load_policy()
+            changed = self._policy_stat != before
+        if changed:
+            self.rebuild()
+        return changed
+
+    def start_watcher(self, interval=0.5):
+        """Picks up policy file edits in a background thread; manifest changes arrive through its listener."""
+        if self._watcher is not None:
+            return
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except OSError:
+                    pass
+        self._watcher = threading.Thread(target=watch, name="release-watcher", daemon=True)
+        self._watcher.start()
+
+# --- CONTENT-ADDRESSED FIRMWARE STORE ---
+# Every distinct image is stored once as blobs/<first 2 hex>/<sha256>. Blobs
+# are read-only and never written in place, only replaced by name; a blob is
+# re-hashed before it is linked again, so one damaged by a privileged in-place
+# write is replaced rather than spread. Files are always copied in, never
+# linked, so a blob shares no inode with a file its owner may still edit.
+# The versioned names the servers publish (updates/firmware_v1.2.bin)
+# are hard links to their blob (copies where links are unsupported), recorded
+# in catalog.json as {folder: {filename: {"checksum", "size", "mtime_ns", "version"}}},
+# with folders relative to the directory that holds the store.
+DEFAULT_STORE_ROOT = "firmware_store"
+
+try:
+    import fcntl
+except ImportError:  # Windows: catalog writes are not locked across processes
+    fcntl = None
+
+def _remove_readonly(func, path, _exc):
+    """rmtree error handler: Windows refuses to delete read-only files, so make it writable and retry."""
+    os.chmod(path, 0o644)
+    func(path)
+
+def remove_tree(path):
+    """shutil.rmtree that also clears the read-only blobs and published links of a store."""
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(path, onexc=_remove_readonly)
+    else:
+        shutil.rmtree(path, onerror=_remove_readonly)
+
+class FirmwareStore:
+    def __init__(self, root=DEFAULT_STORE_ROOT):
+        self.root = root
+        self.base = os.path.dirname(os.path.abspath(root))
+        self.blob_dir = os.path.join(root, "blobs")
+        self.catalog_path = os.path.join(root, "catalog.json")
+        self._lock = threading.Lock()
+        self._catalog = {}
+        self._catalog_stat = None
+
+    def folder_key(self, folder):
+        return os.path.relpath(os.path.abspath(folder), self.base).replace(os.sep, "/")
+
+    def blob_path(self, checksum):
+        return os.path.join(self.blob_dir, checksum[:2], checksum)
+
+    # --- CATALOG ---
+    def catalog(self):
+        """Returns the catalog, re-read only when catalog.json changed on disk."""
+        try:
+            st = os.stat(self.catalog_path)
+        except OSError:
+            return {}
+        with self._lock:
+            if (st.st_size, st.st_mtime_ns) != self._catalog_stat:
+                try:
+                    with open(self.catalog_path, encoding='utf-8') as f:
+                        self._catalog = json.load(f)
+                except ValueError:
+                    self._catalog = {}
+                self._catalog_stat = (st.st_size, st.st_mtime_ns)
+            return self._catalog
+
+    def _update_catalog(self, change):
+        """Applies change(catalog) and writes it atomically, locked against other processes."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "catalog.lock"), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            catalog = json.loads(json.dumps(self.catalog()))  # Private copy to modify
+            change(catalog)
+            tmp_path = self.catalog_path + ".tmp"
+            with open(tmp_path, "w", encoding='utf-8') as f:
+                json.dump(catalog, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.catalog_path)
+        return catalog
+
+    def lookup(self, folder, filename, size, mtime_ns):
+        """Returns the stored checksum of a published file if it is unchanged since it was stored."""
+        entry = self.catalog().get(self.folder_key(folder), {}).get(filename)
+        if entry and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            return entry["checksum"]
+        return None
+
+    def entries(self, folder):
+        return dict(self.catalog().get(self.folder_key(folder), {}))
+
+    # --- WRITING ---
+    def _blob_intact(self, checksum):
+        return calculate_sha256(self.blob_path(checksum)) == checksum
+
+    def _store_blob(self, src_path, checksum):
+        """
+        Links (or copies) src_path, a private incoming file, in as the
+        read-only blob for checksum unless an intact blob is already there.
+        """
+        blob = self.blob_path(checksum)
+        if self._blob_intact(checksum):
+            return blob
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f"{blob}.{os.getpid()}.tmp"
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, blob)
+        return blob
+
+    def _publish(self, folder, filename, checksum):
+        """Points folder/filename at the blob and records it in the catalog."""
+        blob = self.blob_path(checksum)
+        path = os.path.join(folder, filename)
+        os.makedirs(folder, exist_ok=True)
+        try:
+            same = os.path.samefile(blob, path)
+        except OSError:
+            same = False
+        if not same:
+            tmp_path = os.path.join(folder, f".{filename}.link")
+            try:
+                os.link(blob, tmp_path)
+            except OSError:
+                shutil.copyfile(blob, tmp_path)
+            os.replace(tmp_path, path)
+        st = os.stat(path)
+        match = VERSION_PATTERN.search(filename)
+        entry = {"checksum": checksum, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                 "version": match.group(1).strip(".") if match else None}
+        self._update_catalog(lambda c: c.setdefault(self.folder_key(folder), {}).__setitem__(filename, entry))
+        return entry
+
+    def put_bytes(self, folder, filename, data):
+        """Stores data and publishes it as folder/filename. Returns the catalog entry."""
+        checksum = hashlib.sha256(data).hexdigest()
+        if not self._blob_intact(checksum):
+            os.makedirs(self.blob_dir, exist_ok=True)
+            tmp_path = os.path.join(self.blob_dir, f".{os.getpid()}.incoming")
+            with open(tmp_path, "wb") as f: f.write(data)
+            self._store_blob(tmp_path, checksum)
+            os.remove(tmp_path)
+        return self._publish(folder, filename, checksum)
+
+    def put_file(self, folder, filename, src_path):
+        """Stores a copy of src_path (hashed once, while copying) and publishes it."""
+        os.makedirs(self.blob_dir, exist_ok=True)
+        tmp_path = os.path.join(self.blob_dir, f".{os.getpid()}.incoming")
+        sha256_hash = hashlib.sha256()
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for block in iter(lambda: src.read(1024 * 1024), b""):
+                sha256_hash.update(block)
+                dst.write(block)
+        checksum = sha256_hash.hexdigest()
+        self._store_blob(tmp_path, checksum)
+        os.remove(tmp_path)
+        return self._publish(folder, filename, checksum)
+
+    def adopt(self, folder, filename):
+        """
+        Takes a file already in a published folder into the store: copies and
+        hashes it once, keeps one blob per content and replaces the file (and
+        any duplicates) with links to the read-only blob.
+        """
+        return self.put_file(folder, filename, os.path.join(folder, filename))
+
+    # --- MAINTENANCE ---
+    def sync(self):
+        """Drops catalog entries whose published file is gone or was replaced."""
+        def prune(catalog):
+            for folder, files in catalog.items():
+                for filename, entry in list(files.items()):
+                    try:
+                        st = os.stat(os.path.join(self.base, folder, filename))
+                        if (st.st_size, st.st_mtime_ns) == (entry["size"], entry["mtime_ns"]):
+                            continue
+                    except OSError:
+                        pass
+                    del files[filename]
+        return self._update_catalog(prune)
+
+    def gc(self):
+        """Deletes blobs no catalog entry refers to. Returns (blobs removed, bytes freed)."""
+        live = {e["checksum"] for files in self.sync().values() for e in files.values()}
+        removed = freed = 0
+        if not os.path.isdir(self.blob_dir):
+            return removed, freed
+        for prefix in os.listdir(self.blob_dir):
+            prefix_dir = os.path.join(self.blob_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name not in live and not name.endswith(".tmp"):
+                    path = os.path.join(prefix_dir, name)
+                    freed += os.path.getsize(path)
+                    try:
+                        os.remove(path)
+                    except PermissionError:  # Windows: the blob is read-only
+                        _remove_readonly(os.remove, path, None)
+                    removed += 1
+        return removed, freed
+
+    def stats(self):
+        """Published files and bytes versus distinct blobs and bytes actually stored."""
+        catalog = self.catalog()
+        published = [e for files in catalog.values() for e in files.values()]
+        blobs = {e["checksum"]: e["size"] for e in published}
+        return {
+            "published_files": len(published),
+            "published_bytes": sum(e["size"] for e in published),
+            "blobs": len(blobs),
+            "stored_bytes": sum(blobs.values()),
+        }
+
+
+# --- FILE CHANGE NOTIFICATION ---
+# inotify through libc, so a process can sleep until a folder changes.
+# IN_MOVED_TO catches files renamed into place, IN_CLOSE_WRITE plain writes.
+# Platforms without inotify poll instead.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+
+def _load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+def watch_folder_fd(folder, mask=IN_MOVED_TO | IN_CLOSE_WRITE):
+    """Returns an inotify fd that becomes readable on `mask` events in `folder` (default: a file written or renamed in), or None."""
+    libc = _load_inotify()
+    if libc is None:
+        return None
+    fd = libc.inotify_init1(IN_CLOEXEC)
+    if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(folder), mask) >= 0:
+        return fd
+    if fd >= 0:
+        os.close(fd)
+    return None
+
+# --- SHARED CONFIG ---
+# One parsed copy of config.ini per process. Reads never touch disk; writes
+# re-read the file under a lock, apply the change, bump [Meta] version and
+# replace the file atomically, so concurrent writers (the GUI toggles, the
+# TCU recording its new version) cannot lose each other's changes. A watcher
+# thread reloads the file as soon as another process replaces it.
+DEFAULT_CONFIG_PATH = "config.ini"
+CONFIG_META_SECTION = "Meta"
+
+class ConfigService:
+    def __init__(self, path=DEFAULT_CONFIG_PATH):
+        self.path = path
+        self.version = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._config = configparser.ConfigParser()  # Replaced on change, never modified
+        self._stat = None
+        self._listeners = []
+        self._watcher = None
+        self.reload()
+
+    # --- READING ---
+    def snapshot(self):
+        """The current ConfigParser. Treat it as read-only; use set()/update() to change values."""
+        return self._config
+
+    def get(self, section, option, fallback=None):
+        return self._config.get(section, option, fallback=fallback)
+
+    def getboolean(self, section, option, fallback=None):
+        return self._config.getboolean(section, option, fallback=fallback)
+
+    def getint(self, section, option, fallback=None):
+        return self._config.getint(section, option, fallback=fallback)
+
+    def getfloat(self, section, option, fallback=None):
+        return self._config.getfloat(section, option, fallback=fallback)
+
+    def reload(self):
+        """Re-reads the file if it changed on disk. Returns True if the values changed."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+                stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except OSError:
+                stat = None
+            if stat == self._stat:
+                return False
+            config = self._read()
+            self._stat = stat
+            old, self._config = self._config, config
+            self.version = config.getint(CONFIG_META_SECTION, 'version', fallback=0)
+            changed = self._diff(old, config)
+        if changed:
+            for callback in list(self._listeners):
+                try:
+                    callback(self, changed)
+                except Exception:
+                    pass
+        return bool(changed)
+
+    def _read(self):
+        config = configparser.ConfigParser()
+        try:
+            config.read(self.path, encoding='utf-8')
+        except configparser.Error:
+            return self._config  # Half-edited by hand: keep the last good values
+        return config
+
+    @staticmethod
+    def _diff(old, new):
+        """Set of (section, option) whose value differs, ignoring [Meta]."""
+        def values(config):
+            return {(s, o): v for s in config.sections() if s != CONFIG_META_SECTION for o, v in config.items(s, raw=True)}
+        a, b = values(old), values(new)
+        return {key for key in a.keys() | b.keys() if a.get(key) != b.get(key)}
+
+    # --- WRITING ---
+    def update(self, values, only_missing=False):
+        """
+        Applies {section: {option: value}} to the file and returns the new
+        version. With only_missing, existing options are left alone (defaults).
+        Nothing is written if no value changes.
+        """
+        with self._write_lock, open(self.path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            config = configparser.ConfigParser()
+            config.read(self.path, encoding='utf-8')
+            changed = False
+            for section, options in values.items():
+                if not config.has_section(section):
+                    config.add_section(section)
+                for option, value in options.items():
+                    value = str(value)
+                    if config.has_option(section, option) and (only_missing or config.get(section, option, raw=True) == value):
+                        continue
+                    config.set(section, option, value)
+                    changed = True
+            if changed:
+                if not config.has_section(CONFIG_META_SECTION):
+                    config.add_section(CONFIG_META_SECTION)
+                version = config.getint(CONFIG_META_SECTION, 'version', fallback=0) + 1
+                config.set(CONFIG_META_SECTION, 'version', str(version))
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding='utf-8') as f:
+                    config.write(f)
+                os.replace(tmp_path, self.path)
+        self.reload()
+        return self.version
+
+    def set(self, section, option, value):
+        return self.update({section: {option: value}})
+
+    # --- CHANGE NOTIFICATION ---
+    def add_listener(self, callback):
+        """Registers callback(service, changed), where changed is a set of (section, option)."""
+        self._listeners.append(callback)
+
+    def start_watcher(self, interval=0.5):
+        """Reloads the config in a background thread whenever the file is replaced or written."""
+        if self._watcher is not None:
+            return
+        fd = watch_folder_fd(os.path.dirname(os.path.abspath(self.path)))
+        def watch():
+            while True:
+                if fd is not None:
+                    os.read(fd, 4096)  # Sleeps in the kernel until something in the folder changes
+                else:
+                    time.sleep(interval)
+                try:
+                    self.reload()
+                except OSError:
+                    pass
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+config_service = ConfigService()
+
+
+# --- SIMULATION CLOCK ---
+# All pacing delays go through this clock so a whole update cycle can be
+# compressed. time_scale multiplies every delay:
+#   1.0  -> real time (demos)
+#   0.01 -> 100x faster (regression runs)
+#   0    -> no delay at all (load testing)
+DEFAULT_TIME_SCALE = 1.0
+
+def load_time_scale(config_path='config.ini'):
+    """
+    Reads the time scale from the OTA_TIME_SCALE environment variable,
+    falling back to [Simulation] time_scale in config.ini.
+    """
+    value = os.environ.get('OTA_TIME_SCALE')
+    if value is None:
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        value = config.get('Simulation', 'time_scale', fallback=DEFAULT_TIME_SCALE)
+    try:
+        return max(0.0, float(value))
     except (ValueError, TypeError):
-        return (0, 0)
\ No newline at end of file
+        return DEFAULT_TIME_SCALE
+
+class SimClock:
+    """
+    Virtual clock. sleep() waits time_scale * seconds of wall time but
+    always advances the virtual time by the full amount, so durations
+    reported through now() match what a real-time run would show.
+    """
+    def __init__(self, time_scale=DEFAULT_TIME_SCALE):
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._skipped = 0.0  # Virtual seconds that were not spent in wall time
+
+    def sleep(self, seconds, min_real=0.0):
+        """
+        Simulated delay. min_real keeps polling loops from spinning when
+        the scale is (close to) zero.
+        """
+        if seconds <= 0:
+            return
+        real = self.real_seconds(seconds, min_real)
+        if real > 0:
+            time.sleep(real)
+        if real < seconds:
+            with self._lock:
+                self._skipped += seconds - real
+
+    def real_seconds(self, seconds, min_real=0.0):
+        """Wall time a simulated wait of `seconds` takes, e.g. for a socket timeout."""
+        return max(seconds * self.time_scale, min_real)
+
+    def now(self):
+        """Monotonic virtual time in seconds."""
+        with self._lock:
+            return time.monotonic() + self._skipped
+
+sim_clock = SimClock(load_time_scale())
+
+def _follow_time_scale(service, changed):
+    # The environment variable pins the scale; otherwise config edits apply at once
+    if ('Simulation', 'time_scale') in changed and os.environ.get('OTA_TIME_SCALE') is None:
+        try:
+            sim_clock.time_scale = max(0.0, service.getfloat('Simulation', 'time_scale', fallback=DEFAULT_TIME_SCALE))
+        except ValueError:
+            pass
+
+config_service.add_listener(_follow_time_scale)
+
+# --- TIMING SPANS ---
+# Each component records the phases of an update cycle as spans tagged with
+# the cycle's update ID. The TCU creates the ID and passes it on in the
+# X-Update-ID header and in its control channel messages. Spans are appended
+# to one JSON-lines file shared by all components:
+#   {"update_id", "component", "span", "start": epoch seconds,
+#    "duration_ms": wall time, "sim_ms": simulated time, ...attributes}
+# span_report.py turns the file into per-cycle timelines and histograms.
+DEFAULT_SPAN_FILE = "timing_spans.jsonl"
+UPDATE_ID_HEADER = "X-Update-ID"
+
+def new_update_id():
+    return uuid.uuid4().hex[:16]
+
+def load_span_file(config_path='config.ini'):
+    """
+    Reads the span file from the OTA_SPAN_FILE environment variable, falling
+    back to [Tracing] span_file in config.ini. An empty value disables spans.
+    """
+    value = os.environ.get('OTA_SPAN_FILE')
+    if value is None:
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        value = config.get('Tracing', 'span_file', fallback=DEFAULT_SPAN_FILE)
+    return value.strip()
+
+class SpanRecorder:
+    def __init__(self, component, path=None):
+        self.component = component
+        self.path = load_span_file() if path is None else path
+        self._lock = threading.Lock()
+        self._file = None
+
+    @contextlib.contextmanager
+    def span(self, name, update_id, **attrs):
+        """
+        Times the block as one span. The block receives the attribute dict
+        and may add to it, e.g. an outcome known only at the end.
+        """
+        start = time.time()
+        started = time.perf_counter()
+        started_sim = sim_clock.now()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            self.record(name, update_id, start, time.perf_counter() - started, sim_clock.now() - started_sim, **attrs)
+
+    def record(self, name, update_id, start, seconds, sim_seconds=None, **attrs):
+        """Writes one finished span; start is epoch seconds, durations are seconds."""
+        if not self.path:
+            return
+        record = {"update_id": update_id, "component": self.component, "span": name, "start": round(start, 6),
+                  "duration_ms": round(seconds * 1000, 3),
+                  "sim_ms": round((seconds if sim_seconds is None else sim_seconds) * 1000, 3)}
+        record.update(attrs)
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    # Append mode: lines from several processes never overwrite each other
+                    self._file = open(self.path, "a", encoding='utf-8', buffering=1)
+                self._file.write(line)
+            except OSError:
+                pass
+
+def install_flask_spans(app, recorder):
+    """
+    Records one span per request of a Flask app, named after the view
+    function and tagged with the caller's X-Update-ID. The span ends when
+    the server closes the response, so it covers streaming the whole file.
+    """
+    from flask import request
+    from werkzeug.wsgi import ClosingIterator
+    id_key = "HTTP_" + UPDATE_ID_HEADER.upper().replace("-", "_")
+
+    @app.before_request
+    def name_request_span():
+        request.environ["ota.span"] = request.endpoint
+
+    inner = app.wsgi_app
+    def traced_app(environ, start_response):
+        start, started, started_sim = time.time(), time.perf_counter(), sim_clock.now()
+        status = []
+        def capture_status(status_line, headers, exc_info=None):
+            status[:] = [int(status_line.split(None, 1)[0])]
+            return start_response(status_line, headers, exc_info)
+        def finish():
+            recorder.record(environ.get("ota.span") or "unknown", environ.get(id_key), start,
+                            time.perf_counter() - started, sim_clock.now() - started_sim,
+                            status=status[0] if status else None)
+        return ClosingIterator(inner(environ, capture_status), finish)
+    app.wsgi_app = traced_app
+
+
+# --- BINARY DELTAS ---
+# Delta format: header (magic, target size, target sha256) followed by ops.
+#   'C' + offset(u64) + length(u32): copy bytes from the base image
+#   'I' + length(u32) + data:        insert literal bytes
+DELTA_MAGIC = b"OTADELTA1"
+DELTA_BLOCK_SIZE = 64
+_DELTA_HEADER = struct.Struct(">Q32s")
+_DELTA_COPY = struct.Struct(">QI")
+_DELTA_INSERT = struct.Struct(">I")
+
+def make_delta(base, target, block_size=DELTA_BLOCK_SIZE):
+    """
+    Builds a delta that turns `base` into `target` (both bytes).
+    Base blocks are indexed at aligned offsets; the target is scanned byte
+    by byte and every match is extended forward as far as it goes.
+    """
+    index = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        index.setdefault(base[offset:offset + block_size], offset)
+
+    out = bytearray(DELTA_MAGIC)
+    out += _DELTA_HEADER.pack(len(target), hashlib.sha256(target).digest())
+    literal_start = 0
+    last_copy = None  # [offset, length] of the pending copy op
+
+    def flush_literal(end):
+        if end > literal_start:
+            out.extend(b"I" + _DELTA_INSERT.pack(end - literal_start))
+            out.extend(target[literal_start:end])
+
+    def flush_copy():
+        if last_copy:
+            out.extend(b"C" + _DELTA_COPY.pack(*last_copy))
+
+    i = 0
+    n = len(target)
+    while i + block_size <= n:
+        src = index.get(target[i:i + block_size])
+        if src is None:
+            i += 1
+            continue
+        length = block_size
+        while src + length < len(base) and i + length < n and base[src + length] == target[i + length]:
+            length += 1
+        if i > literal_start:
+            flush_copy()
+            last_copy = None
+            flush_literal(i)
+        if last_copy and last_copy[0] + last_copy[1] == src:
+            last_copy[1] += length  # Contiguous with the previous copy
+        else:
+            flush_copy()
+            last_copy = [src, length]
+        i += length
+        literal_start = i
+    if n > literal_start:
+        flush_copy()
+        last_copy = None
+        flush_literal(n)
+    flush_copy()
+    return bytes(out)
+
+def apply_delta(base, delta):
+    """
+    Rebuilds the target image from `base` and a delta made by make_delta.
+    Raises ValueError if the delta is malformed or the result does not
+    match the size and SHA-256 recorded in the delta header.
+    """
+    if not delta.startswith(DELTA_MAGIC):
+        raise ValueError("Not an OTA delta")
+    pos = len(DELTA_MAGIC)
+    target_size, target_digest = _DELTA_HEADER.unpack_from(delta, pos)
+    pos += _DELTA_HEADER.size
+    out = bytearray()
+    try:
+        while pos < len(delta):
+            op = delta[pos:pos + 1]
+            pos += 1
+            if op == b"C":
+                offset, length = _DELTA_COPY.unpack_from(delta, pos)
+                pos += _DELTA_COPY.size
+                if offset + length > len(base):
+                    raise ValueError("Delta copies past the end of the base image")
+                out += base[offset:offset + length]
+            elif op == b"I":
+                (length,) = _DELTA_INSERT.unpack_from(delta, pos)
+                pos += _DELTA_INSERT.size
+                out += delta[pos:pos + length]
+                pos += length
+            else:
+                raise ValueError(f"Unknown delta op {op!r}")
+    except struct.error as e:
+        raise ValueError(f"Truncated delta: {e}")
+    if len(out) != target_size or hashlib.sha256(out).digest() != target_digest:
+        raise ValueError("Delta result does not match the recorded target image")
+    return bytes(out)
+
+# --- PRE-COMPRESSED VARIANTS ---
+# Built once when an image is deployed and named by the image's SHA-256, so a
+# variant can never be served for a different image. The OEM server picks one
+# by Accept-Encoding; the TCU hashes the decompressed stream.
+DEFAULT_VARIANTS_DIR = "update_variants"
+VARIANT_MAX_RATIO = 0.9  # Keep a variant only if it saves at least 10%
+
+try:
+    import brotli  # Optional: adds 'br' variants
+except ImportError:
+    brotli = None
+
+def _gzip_file(src_path, dst_path):
+    with open(src_path, "rb") as src, gzip.GzipFile(dst_path, "wb", compresslevel=9, mtime=0) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def _brotli_file(src_path, dst_path):
+    compressor = brotli.Compressor(quality=11)
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for block in iter(lambda: src.read(1024 * 1024), b""):
+            dst.write(compressor.process(block))
+        dst.write(compressor.finish())
+
+# Content-Encoding -> (file extension, compressor), in server preference order
+VARIANT_ENCODINGS = {"br": ("br", _brotli_file)} if brotli else {}
+VARIANT_ENCODINGS["gzip"] = ("gz", _gzip_file)
+
+def variant_path(variants_dir, checksum, encoding):
+    return os.path.join(variants_dir, f"{checksum}.{VARIANT_ENCODINGS[encoding][0]}")
+
+def build_compressed_variants(image_path, variants_dir=DEFAULT_VARIANTS_DIR, checksum=None):
+    """
+    Writes a compressed copy of the image for each supported encoding and
+    returns {encoding: size} for the ones kept. Existing variants are reused.
+    """
+    checksum = checksum or calculate_sha256(image_path)
+    original_size = os.path.getsize(image_path)
+    os.makedirs(variants_dir, exist_ok=True)
+    built = {}
+    for encoding, (_, compress) in VARIANT_ENCODINGS.items():
+        path = variant_path(variants_dir, checksum, encoding)
+        if not os.path.exists(path):
+            compress(image_path, path + ".tmp")
+            if os.path.getsize(path + ".tmp") > original_size * VARIANT_MAX_RATIO:
+                os.remove(path + ".tmp")
+                continue
+            os.replace(path + ".tmp", path)
+        built[encoding] = os.path.getsize(path)
+    return built
+
+
+# --- TCU <-> ECU CONTROL CHANNEL ---
+# Stand-in for the in-vehicle bus. A Unix domain socket where available,
+# localhost TCP otherwise. Messages are newline-delimited JSON objects with
+# a "type" field:
+#   image_ready  TCU -> ECU  {"filename", "checksum", "size"}
+#   progress     ECU -> TCU  {"filename", "stage", "percent"}
+#   result       ECU -> TCU  {"filename", "status": "SUCCESS" | "FAILURE", ...}
+DEFAULT_ECU_SOCKET = "ecu_control.sock"
+DEFAULT_ECU_PORT = 5010
+
+def control_channel_address(config):
+    """Returns (family, address) for the ECU control channel from [IPC] in config.ini."""
+    if hasattr(socket, 'AF_UNIX'):
+        return socket.AF_UNIX, config.get('IPC', 'ecu_socket', fallback=DEFAULT_ECU_SOCKET)
+    return socket.AF_INET, ('127.0.0.1', config.getint('IPC', 'ecu_port', fallback=DEFAULT_ECU_PORT))
+
+def open_control_listener(config):
+    family, address = control_channel_address(config)
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        if os.path.exists(address): os.remove(address)  # Stale socket from a previous run
+    else:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen()
+    return server
+
+def connect_control_channel(config, timeout=5):
+    family, address = control_channel_address(config)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(address)
+    return sock
+
+def send_control_message(sock, msg_type, **fields):
+    fields['type'] = msg_type
+    sock.sendall((json.dumps(fields) + "\n").encode('utf-8'))
+
+def read_control_messages(sock):
+    """Yields decoded messages from a control channel socket until it closes."""
+    buffer = b""
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        buffer += data
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+# --- GUI EVENT PROTOCOL ---
+# Components report to the GUI (or any headless consumer) on stdout. Each
+# write is one frame: a line holding FRAME_PREFIX followed by a JSON array of
+# events, each {"t": type, "m": message, "c": color or null, "ts": monotonic}.
+# Lines without the prefix (Flask banners, tracebacks) are still plain text.
+# Events are coalesced at the source: a frame goes out FRAME_FLUSH_INTERVAL
+# after its first event or as soon as it holds FRAME_MAX_EVENTS, so a burst
+# of log lines costs the reader one wakeup instead of one per line.
+FRAME_PREFIX = "@OTA1 "
+PROGRESS_MIN_INTERVAL = 0.1  # Seconds between progress events sent to the GUI
+FRAME_FLUSH_INTERVAL = 0.05  # Seconds an event may wait for others to share its frame
+FRAME_MAX_EVENTS = 200       # Events that force a frame out before the interval ends
+
+class EventEmitter:
+    """
+    Buffers typed events and writes them as frames. Outside a batch() block
+    events are flushed by a timer flush_interval after the first one, or
+    once max_events are buffered; inside one they go out as a single frame
+    when the block ends. Progress events are rate-limited at the source:
+    intermediate values are dropped, but the latest one is always sent
+    before the next other event, and 0/100 always go out. Buffered events
+    are flushed at exit and before a fork, so none are lost or duplicated.
+    """
+    def __init__(self, stream=None, progress_interval=PROGRESS_MIN_INTERVAL,
+                 flush_interval=FRAME_FLUSH_INTERVAL, max_events=FRAME_MAX_EVENTS):
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._batch_depth = 0
+        self._last_progress = 0.0
+        self._pending_progress = None
+        self._timer = None
+        atexit.register(self.flush)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self.flush, after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # The timer thread does not exist in the child, and the lock may have
+        # been held by a parent thread that did not survive the fork.
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._timer = None
+
+    def emit(self, msg_type, message, color=None):
+        now = time.monotonic()
+        event = {"t": msg_type.lower(), "m": str(message), "c": color, "ts": now}
+        with self._lock:
+            if event["t"] == 'progress':
+                final = event["m"] in ('0', '100')
+                if not final and now - self._last_progress < self.progress_interval:
+                    self._pending_progress = event
+                    return
+                self._pending_progress = None
+                self._last_progress = now
+            elif self._pending_progress is not None:
+                self._buffer.append(self._pending_progress)
+                self._pending_progress = None
+            self._buffer.append(event)
+            if self._batch_depth == 0:
+                if self.flush_interval <= 0 or len(self._buffer) >= self.max_events:
+                    self.flush()
+                elif self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                if self._timer is not threading.current_thread():
+                    self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            frame = FRAME_PREFIX + json.dumps(self._buffer, separators=(',', ':')) + "\n"
+            self._buffer = []
+            stream = self.stream or sys.stdout
+            stream.write(frame)
+            stream.flush()
+
+    def batch(self):
+        """Context manager that sends all events emitted inside it as one frame."""
+        emitter = self
+        class _Batch:
+            def __enter__(self):
+                with emitter._lock:
+                    emitter._batch_depth += 1
+                return emitter
+            def __exit__(self, *exc):
+                with emitter._lock:
+                    emitter._batch_depth -= 1
+                    if emitter._batch_depth == 0:
+                        emitter.flush()
+                return False
+        return _Batch()
+
+def decode_frame(line):
+    """
+    Returns the events of a frame line as a list of dicts, or None if the
+    line is not a frame (plain text output).
+    """
+    if not line.startswith(FRAME_PREFIX):
+        return None
+    try:
+        events = json.loads(line[len(FRAME_PREFIX):])
+    except ValueError:
+        return None
+    return events if isinstance(events, list) else None
+
+gui_events = EventEmitter()
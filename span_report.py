@@ -0,0 +1,134 @@
+# span_report.py
+"""
+Turns the timing spans written by the simulator components into per-cycle
+timelines and rolling per-phase histograms, as JSON.
+
+Every TCU check is one cycle with its own update ID; the servers and the ECU
+tag their spans with the same ID. Only the last --window cycles are kept while
+the span file is streamed, so memory stays bounded however long the file is.
+
+Usage:
+    python span_report.py                            # timing_spans.jsonl
+    python span_report.py spans.jsonl --window 50 --clock sim -o report.json
+    python span_report.py --update-id 3f2a...        # one cycle's timeline
+"""
+import argparse
+import json
+import sys
+from collections import OrderedDict
+from fleet_benchmark import percentile
+from shared_utils import DEFAULT_SPAN_FILE
+
+# Upper bounds of the histogram buckets in milliseconds (powers of two)
+BUCKET_BOUNDS_MS = [2 ** i for i in range(0, 18)]
+SPAN_FIELDS = {"update_id", "component", "span", "start", "duration_ms", "sim_ms"}
+
+def read_cycles(lines, window, update_id=None):
+    """
+    Groups spans by update ID, keeping the `window` most recently started
+    cycles. Returns (cycles, number of spans without an update ID).
+    """
+    cycles = OrderedDict()
+    unattributed = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        uid = record.get("update_id")
+        if uid is None:
+            unattributed += 1
+            continue
+        if update_id is not None and uid != update_id:
+            continue
+        if uid not in cycles:
+            cycles[uid] = []
+            while len(cycles) > window:
+                cycles.popitem(last=False)
+        cycles[uid].append(record)
+    return cycles, unattributed
+
+def timeline(update_id, records, clock):
+    """One cycle: its phases in start order, with offsets from the first span."""
+    records = sorted(records, key=lambda r: r["start"])
+    t0 = records[0]["start"]
+    cycle = next((r for r in records if r["component"] == "tcu" and r["span"] == "cycle"), None)
+    phases = []
+    for r in records:
+        phase = {"component": r["component"], "span": r["span"],
+                 "offset_ms": round((r["start"] - t0) * 1000, 3), "ms": r[clock]}
+        phase.update({k: v for k, v in r.items() if k not in SPAN_FIELDS})
+        phases.append(phase)
+    return {
+        "update_id": update_id,
+        "start": t0,
+        "outcome": cycle.get("outcome") if cycle else None,
+        "total_ms": cycle[clock] if cycle else None,
+        "phases": phases,
+    }
+
+def histogram(values):
+    values = sorted(values)
+    buckets = OrderedDict((f"<={bound}", 0) for bound in BUCKET_BOUNDS_MS)
+    buckets["inf"] = 0
+    for value in values:
+        for bound in BUCKET_BOUNDS_MS:
+            if value <= bound:
+                buckets[f"<={bound}"] += 1
+                break
+        else:
+            buckets["inf"] += 1
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None,
+        "buckets_ms": {k: v for k, v in buckets.items() if v},
+    }
+
+def build_report(lines, window=100, clock="duration_ms", update_id=None):
+    cycles, unattributed = read_cycles(lines, window, update_id)
+    timelines = [timeline(uid, records, clock) for uid, records in cycles.items()]
+    by_phase = {}
+    for t in timelines:
+        for phase in t["phases"]:
+            by_phase.setdefault(f"{phase['component']}.{phase['span']}", []).append(phase["ms"])
+    outcomes = {}
+    for t in timelines:
+        outcomes[t["outcome"]] = outcomes.get(t["outcome"], 0) + 1
+    return {
+        "clock": clock,
+        "window": window,
+        "cycles": len(timelines),
+        "unattributed_spans": unattributed,
+        "outcomes": outcomes,
+        "histograms": {name: histogram(values) for name, values in sorted(by_phase.items())},
+        "timelines": timelines,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-cycle timelines and phase histograms from timing spans.")
+    parser.add_argument("span_file", nargs="?", default=DEFAULT_SPAN_FILE)
+    parser.add_argument("--window", type=int, default=100, help="Number of most recent cycles to report on")
+    parser.add_argument("--clock", choices=["real", "sim"], default="real",
+                        help="Wall-clock durations, or simulated ones (what a time_scale=1 run would take)")
+    parser.add_argument("--update-id", help="Report only this cycle")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args(argv)
+
+    clock = "sim_ms" if args.clock == "sim" else "duration_ms"
+    with open(args.span_file, encoding='utf-8') as f:
+        report = build_report(f, args.window, clock, args.update_id)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
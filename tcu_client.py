@@ -1,34 +1,314 @@
 # tcu_client.py
 import requests
-import time
+import hashlib
 import os
 import shutil
-import configparser
 import sys
-from shared_utils import version_to_tuple, calculate_sha256
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from shared_utils import (version_to_tuple, calculate_sha256, apply_delta, sim_clock, gui_events,
+                          connect_control_channel, send_control_message, read_control_messages,
+                          VARIANT_ENCODINGS, SpanRecorder, new_update_id, UPDATE_ID_HEADER, config_service,
+                          VEHICLE_ID_HEADER, CHANNEL_HEADER, DEFAULT_CHANNEL)
 
 def log_to_gui(message_type, message, color=None):
-    """Prints a formatted string for the GUI to capture."""
-    if color:
-        print(f"{message_type.upper()}:{message}:{color}", flush=True)
-    else:
-        print(f"{message_type.upper()}:{message}", flush=True)
+    """Sends a typed event to the GUI as a frame on stdout."""
+    gui_events.emit(message_type, message, color)
+
+spans = SpanRecorder('tcu')
+
+INSTALLED_IMAGE_NAME = "installed.img"
+PARTIAL_SUFFIX = ".part"
+SIDECAR_SUFFIX = ".part.json"
+SIDECAR_SAVE_INTERVAL = 1024 * 1024  # Record progress at least every MiB
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Encodings of the server's pre-compressed variants this TCU can decode
+ACCEPT_ENCODING = ", ".join(VARIANT_ENCODINGS)
+
+CHECK_TIMEOUT = 3
+WATCH_READ_TIMEOUT = 40  # The server sends a keep-alive every 15 s; silence past this means a dead stream
+WATCH_RECONNECT_MIN = 0.2  # Even after a clean end of stream, so a server that keeps closing is not hammered
+WATCH_RECONNECT_MAX = 10
+WATCH_STABLE_SECONDS = 1  # A stream open this long resets the reconnect backoff
+ACK_TIMEOUT = 30  # Simulated seconds of silence from the ECU before giving up
+ACK_TIMEOUT_MIN_REAL = 5  # Real seconds, so a fast-forwarded ECU still has time to do its real work
+
+# --- CONNECTION POOLING ---
+# One persistent session per server, so the check and the download that
+# follows reuse the same warm keep-alive connection.
+_sessions = {}
+_sessions_lock = threading.Lock()
+_check_executor = None
 
-def check_single_server(server_url):
-    """Checks one server for an update (Anonymous logic)."""
+# --- CONDITIONAL CHECKS ---
+# server URL -> (reported version, ETag, answer) from the last successful check.
+# The ETag is sent back as If-None-Match; a 304 reuses the stored answer, so
+# an idle fleet's polls carry no body.
+_last_checks = {}
+
+def get_session(server_url):
+    with _sessions_lock:
+        session = _sessions.get(server_url)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[server_url] = session
+        return session
+
+def configured_servers(config):
+    """Returns every '<name>_url' entry of [Server] in config order, e.g. oem, malicious."""
+    if not config.has_section('Server'): return []
+    return [value for key, value in config.items('Server') if key.endswith('_url') and value]
+
+def rollout_headers(config):
+    """
+    The update channel from [TCU], and the vehicle ID only if one is
+    configured: by default the TCU stays anonymous and is offered fully
+    rolled-out releases only.
+    """
+    headers = {CHANNEL_HEADER: config.get('TCU', 'channel', fallback=DEFAULT_CHANNEL)}
+    vehicle_id = config.get('TCU', 'vehicle_id', fallback='')
+    if vehicle_id:
+        headers[VEHICLE_ID_HEADER] = vehicle_id
+    return headers
+
+def check_single_server(server_url, current_version=None, update_id=None, extra_headers=None):
+    """Checks one server for an update (Anonymous logic unless a vehicle ID is configured)."""
     if not server_url: return None
     try:
-        # Reverted: No VIN headers included
-        response = requests.get(f"{server_url}/check-update", timeout=3)
+        # The installed version is sent so the server can offer a delta against it
+        headers = dict(extra_headers or {})
+        if current_version:
+            headers['X-Current-Version'] = current_version
+        if update_id:
+            headers[UPDATE_ID_HEADER] = update_id
+        last = _last_checks.get(server_url)
+        if last and last[0] == current_version:
+            headers['If-None-Match'] = last[1]
+        response = get_session(server_url).get(f"{server_url}/check-update", headers=headers, timeout=CHECK_TIMEOUT)
+        if response.status_code == 304 and last:
+            return last[2]
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException:
+        info = response.json()
+        if response.headers.get('ETag'):
+            _last_checks[server_url] = (current_version, response.headers['ETag'], info)
+        return info
+    except (requests.exceptions.RequestException, ValueError):
         return None
 
-def download_and_process(config, firmware_info, checksum_verification_enabled):
+def check_all_servers(server_urls, current_version=None, update_id=None, extra_headers=None):
+    """
+    Queries all servers at the same time. The results are decided once every
+    server has answered or failed, or when CHECK_TIMEOUT runs out, so one
+    slow mirror costs at most one timeout instead of adding to the others.
+    Returns the answers in the same order as server_urls (None for no answer).
+    """
+    global _check_executor
+    if not server_urls: return []
+    if _check_executor is None:
+        _check_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="server-check")
+    futures = [_check_executor.submit(check_single_server, url, current_version, update_id, extra_headers) for url in server_urls]
+    wait(futures, timeout=CHECK_TIMEOUT + 0.5)
+    return [f.result() if f.done() else None for f in futures]
+
+def select_best_update(current_version_tuple, server_infos):
+    """Picks the highest version above the current one; earlier servers win ties."""
+    best_update = None
+    best_version_tuple = current_version_tuple
+    for info in server_infos:
+        if info and version_to_tuple(info.get("version")) > best_version_tuple:
+            best_update = info
+            best_version_tuple = version_to_tuple(info.get("version"))
+    return best_update
+
+def checksum_accepted(local_checksum, advertised_checksum, verification_enabled):
+    """The verify step: a mismatch only stops the update while verification is enabled."""
+    return not verification_enabled or local_checksum == advertised_checksum
+
+def installed_image_path(config):
+    image_dir = config.get('Folders', 'tcu_image_folder', fallback='tcu_images')
+    os.makedirs(image_dir, exist_ok=True)
+    return os.path.join(image_dir, INSTALLED_IMAGE_NAME)
+
+def load_partial_offset(temp_filepath, expected_checksum):
+    """
+    Returns (byte offset to resume from, server ETag of the partial), or
+    (0, None). A partial download is only reused if its sidecar was written
+    for the same advertised checksum.
+    """
+    partial_path = temp_filepath + PARTIAL_SUFFIX
+    sidecar_path = temp_filepath + SIDECAR_SUFFIX
+    try:
+        with open(sidecar_path) as f:
+            sidecar = json.load(f)
+        if sidecar.get('checksum') == expected_checksum:
+            return min(int(sidecar.get('offset', 0)), os.path.getsize(partial_path)), sidecar.get('etag')
+    except (OSError, ValueError, TypeError):
+        pass
+    for path in (partial_path, sidecar_path):
+        if os.path.exists(path): os.remove(path)
+    return 0, None
+
+def save_partial_offset(temp_filepath, expected_checksum, offset, etag=None):
+    sidecar_path = temp_filepath + SIDECAR_SUFFIX
+    with open(sidecar_path + ".tmp", 'w') as f:
+        json.dump({'checksum': expected_checksum, 'offset': offset, 'etag': etag}, f)
+    os.replace(sidecar_path + ".tmp", sidecar_path)
+
+def hash_existing_prefix(partial_path, offset):
+    """Feeds the already downloaded bytes of a resumed file into a fresh hasher."""
+    sha256_hash = hashlib.sha256()
+    with open(partial_path, 'rb') as f:
+        remaining = offset
+        while remaining > 0:
+            block = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not block: break
+            sha256_hash.update(block)
+            remaining -= len(block)
+    return sha256_hash
+
+def download_full_image(session, download_url, temp_filepath, expected_checksum, expected_size=None, update_id=None):
+    """
+    Streams the image into a .part file next to temp_filepath, resuming
+    with an HTTP Range request if an earlier attempt left a partial file.
+    Fresh downloads accept a compressed variant, which is decompressed as it
+    streams; the .part file and the SHA-256 always cover the decompressed
+    image, so a resume can ask for plain bytes from that offset. The hash
+    is computed while writing, so the file is never read back.
+    Returns the hex digest of the downloaded image.
+    """
+    partial_path = temp_filepath + PARTIAL_SUFFIX
+    offset, etag = load_partial_offset(temp_filepath, expected_checksum)
+    if expected_size is not None and offset > expected_size:
+        offset = 0
+    headers = {'Range': f"bytes={offset}-", 'Accept-Encoding': 'identity'} if offset else {'Accept-Encoding': ACCEPT_ENCODING}
+    if offset and etag:
+        # The server only honours the Range if the file is still the one we started
+        headers['If-Range'] = etag
+    id_header = {UPDATE_ID_HEADER: update_id} if update_id else {}
+    
+    dl_response = session.get(download_url, headers={**headers, **id_header}, stream=True, timeout=10)
+    if dl_response.status_code == 416:
+        # Partial is no longer valid for what the server has; start over
+        dl_response.close()
+        offset = 0
+        dl_response = session.get(download_url, headers={'Accept-Encoding': ACCEPT_ENCODING, **id_header}, stream=True, timeout=10)
+    dl_response.raise_for_status()
+    
+    if offset and dl_response.status_code == 206:
+        log_to_gui('log', f" Resuming download at byte {offset}.")
+    else:
+        offset = 0  # Server ignored the Range header or the file changed; take the full body
+    content_length = dl_response.headers.get('content-length')
+    encoding = dl_response.headers.get('content-encoding', 'identity')
+    # A compressed variant has its own ETag, which would never match the plain image on resume
+    etag = dl_response.headers.get('ETag') if encoding == 'identity' else None
+    if encoding != 'identity':
+        # Content-Length counts compressed bytes; progress and checks use the image size
+        log_to_gui('log', f" Receiving {encoding}-compressed image ({content_length} bytes on the wire).")
+        total_size = expected_size or 0
+    else:
+        total_size = offset + int(content_length) if content_length else 0
+    if expected_size is not None and total_size and total_size != expected_size:
+        dl_response.close()
+        raise IOError(f"Size mismatch: server sends {total_size} bytes, expected {expected_size}")
+    
+    sha256_hash = hash_existing_prefix(partial_path, offset) if offset else hashlib.sha256()
+    bytes_downloaded = offset
+    last_saved = offset
+    with open(partial_path, 'r+b' if offset else 'wb') as f:
+        f.seek(offset)
+        f.truncate()
+        save_partial_offset(temp_filepath, expected_checksum, offset, etag)
+        for chunk in dl_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+            sha256_hash.update(chunk)
+            bytes_downloaded += len(chunk)
+            if total_size and bytes_downloaded > total_size:
+                raise IOError(f"Size mismatch: received more than {total_size} bytes")
+            if bytes_downloaded - last_saved >= SIDECAR_SAVE_INTERVAL:
+                f.flush()
+                save_partial_offset(temp_filepath, expected_checksum, bytes_downloaded, etag)
+                last_saved = bytes_downloaded
+            if total_size > 0:
+                log_to_gui('progress', f"{(bytes_downloaded / total_size) * 100}")
+        f.flush()
+        save_partial_offset(temp_filepath, expected_checksum, bytes_downloaded, etag)
+    
+    if total_size and bytes_downloaded != total_size:
+        raise IOError(f"Size mismatch: received {bytes_downloaded} of {total_size} bytes")
+    os.replace(partial_path, temp_filepath)
+    os.remove(temp_filepath + SIDECAR_SUFFIX)
+    return sha256_hash.hexdigest()
+
+def rebuild_from_delta(config, server_url, firmware_info, temp_filepath, update_id=None):
+    """
+    Downloads the delta offered by the server and applies it to the image
+    this TCU installed last. Returns the digest of the rebuilt image, or
+    None if no usable base image exists or the result does not match the
+    advertised checksum, in which case the caller falls back to the full image.
+    """
+    delta_info = firmware_info['delta']
+    base_path = installed_image_path(config)
+    if calculate_sha256(base_path) != delta_info.get('base_checksum'):
+        log_to_gui('log', " No matching base image for delta. Using full image.")
+        return None
+    try:
+        log_to_gui('log', f" Downloading delta from v{delta_info['base_version']} ({delta_info['size']} bytes)...")
+        headers = {UPDATE_ID_HEADER: update_id} if update_id else {}
+        dl_response = get_session(server_url).get(f"{server_url}/download-delta/{delta_info['filename']}", headers=headers, timeout=10)
+        dl_response.raise_for_status()
+        with open(base_path, 'rb') as f:
+            image = apply_delta(f.read(), dl_response.content)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        log_to_gui('log', f" Delta failed ({e}). Using full image.")
+        return None
+    digest = hashlib.sha256(image).hexdigest()
+    if digest != firmware_info.get('checksum'):
+        log_to_gui('log', " Rebuilt image does not match advertised checksum. Using full image.")
+        return None
+    with open(temp_filepath, 'wb') as f:
+        f.write(image)
+    log_to_gui('progress', '100')
+    log_to_gui('log', f" Rebuilt full image from delta ({len(dl_response.content)} of {len(image)} bytes downloaded).")
+    return digest
+
+def keep_installed_image(config, image_path):
+    """Keeps a link (or copy) of the image being installed as the next delta base."""
+    pending_path = installed_image_path(config) + ".pending"
+    if os.path.exists(pending_path): os.remove(pending_path)
+    try:
+        os.link(image_path, pending_path)
+    except OSError:
+        shutil.copyfile(image_path, pending_path)
+    return pending_path
+
+def handoff_to_ecu(temp_filepath, ecu_folder, filename):
+    """
+    Moves the verified image into the ECU folder so it appears there
+    complete and in one step. A rename is used when both folders are on the
+    same filesystem; otherwise the image is copied under a hidden temporary
+    name first and then renamed into place.
+    """
+    os.makedirs(ecu_folder, exist_ok=True)
+    final_path = os.path.join(ecu_folder, filename)
+    try:
+        os.replace(temp_filepath, final_path)
+    except OSError:
+        staging_path = os.path.join(ecu_folder, f".{filename}.incoming")
+        shutil.copyfile(temp_filepath, staging_path)
+        os.replace(staging_path, final_path)
+        os.remove(temp_filepath)
+    return final_path
+
+def download_and_process(config, firmware_info, checksum_verification_enabled, update_id=None):
     log_to_gui('status', 'Downloading', '#ffc107')
     log_to_gui('progress', '0')
-    time.sleep(0.75)
+    sim_clock.sleep(0.75)
 
     # Reverted: URL lookup is based on the 'source' key from the server response
     source = firmware_info.get("source", "unknown")
@@ -42,121 +322,224 @@ def download_and_process(config, firmware_info, checksum_verification_enabled):
         filename = firmware_info['filename']
         download_url = f"{server_url}/download/{filename}"
         
-        dl_response = requests.get(download_url, stream=True, timeout=10)
-        dl_response.raise_for_status()
-        
-        total_size = int(dl_response.headers.get('content-length', 0))
         temp_dir = config['Folders']['tcu_download_folder']
         os.makedirs(temp_dir, exist_ok=True)
         temp_filepath = os.path.join(temp_dir, filename)
         
-        bytes_downloaded = 0
-        with open(temp_filepath, 'wb') as f:
-            for chunk in dl_response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                bytes_downloaded += len(chunk)
-                if total_size > 0:
-                    log_to_gui('progress', f"{(bytes_downloaded / total_size) * 100}")
-        
-        log_to_gui('log', " Download complete.")
-        log_to_gui('progress', '100')
-        time.sleep(0.75)
-
-        log_to_gui('status', 'Verifying', '#9c27b0')
-        log_to_gui('log', " Verifying file integrity...")
-        time.sleep(0.75)
-        local_checksum = calculate_sha256(temp_filepath)
-        
-        # Security Toggle: Restored from reference
-        if checksum_verification_enabled and local_checksum != firmware_info['checksum']:
-            log_to_gui('log', " CHECKSUM MISMATCH! Deleting file.")
-            os.remove(temp_filepath)
-            return False
-        
-        log_to_gui('log', " Checksum match! File is valid.")
-        time.sleep(0.75)
-        
-        ecu_folder = config['Folders']['ecu_shared_folder']
-        os.makedirs(ecu_folder, exist_ok=True)
-        shutil.move(temp_filepath, os.path.join(ecu_folder, filename))
-        log_to_gui('log', f" Transferred '{filename}' to ECU folder.")
+        with spans.span('download', update_id, filename=filename) as download_attrs:
+            local_checksum = None
+            if firmware_info.get('delta'):
+                local_checksum = rebuild_from_delta(config, server_url, firmware_info, temp_filepath, update_id)
+            download_attrs['mode'] = 'delta' if local_checksum else 'full'
+            if local_checksum is None:
+                local_checksum = download_full_image(get_session(server_url), download_url, temp_filepath, firmware_info.get('checksum'), firmware_info.get('size'), update_id)
+            
+            log_to_gui('log', " Download complete.")
+            log_to_gui('progress', '100')
+            sim_clock.sleep(0.75)
+
+        with spans.span('verify', update_id, enabled=checksum_verification_enabled) as verify_attrs:
+            log_to_gui('status', 'Verifying', '#9c27b0')
+            log_to_gui('log', " Verifying file integrity...")
+            sim_clock.sleep(0.75)
+            # The checksum was computed while the image streamed in
+            
+            # Security Toggle: Restored from reference
+            verify_attrs['match'] = local_checksum == firmware_info['checksum']
+            if not checksum_accepted(local_checksum, firmware_info['checksum'], checksum_verification_enabled):
+                log_to_gui('log', " CHECKSUM MISMATCH! Deleting file.")
+                os.remove(temp_filepath)
+                return False
+            
+            log_to_gui('log', " Checksum match! File is valid.")
+            sim_clock.sleep(0.75)
         
-        return wait_for_ecu_ack(config, filename)
+        channel = connect_control_channel(config)
+        try:
+            with spans.span('transfer', update_id, filename=filename):
+                # Announce first so the ECU knows where to report before it sees the file
+                send_control_message(channel, 'image_ready', filename=filename, checksum=local_checksum, update_id=update_id)
+                pending_image = keep_installed_image(config, temp_filepath)
+                handoff_to_ecu(temp_filepath, config['Folders']['ecu_shared_folder'], filename)
+                log_to_gui('log', f" Transferred '{filename}' to ECU folder.")
+            
+            with spans.span('ack_wait', update_id) as ack_attrs:
+                acked = wait_for_ecu_ack(channel, filename)
+                ack_attrs['acked'] = acked
+        finally:
+            channel.close()
+        if acked:
+            os.replace(pending_image, installed_image_path(config))
+        elif os.path.exists(pending_image):
+            os.remove(pending_image)
+        return acked
 
     except Exception as e:
         log_to_gui('log', f" Download/Processing Error: {e}")
         return False
 
-def wait_for_ecu_ack(config, filename):
+def wait_for_ecu_ack(channel, filename):
+    """Follows the ECU's progress on the control channel. True only if the flash succeeded."""
     log_to_gui('status', 'Awaiting ACK', '#673ab7')
     log_to_gui('log', f"   Waiting for ECU acknowledgment for {filename}...")
-    ack_folder = config['Folders']['tcu_ack_folder']
-    os.makedirs(ack_folder, exist_ok=True)
-    ack_path = os.path.join(ack_folder, f"{filename}.ack")
-    
-    for _ in range(30): 
-        if os.path.exists(ack_path):
-            # Reverted: Does not check file content
-            os.remove(ack_path) 
-            log_to_gui('log', f" ACK received from ECU.")
-            return True
-        time.sleep(1)
+    channel.settimeout(sim_clock.real_seconds(ACK_TIMEOUT, min_real=ACK_TIMEOUT_MIN_REAL))
+    try:
+        for message in read_control_messages(channel):
+            if message.get('filename') != filename:
+                continue
+            if message.get('type') == 'progress':
+                log_to_gui('log', f"   ECU {message.get('stage')}: {message.get('percent')}%")
+            elif message.get('type') == 'result':
+                status = message.get('status')
+                log_to_gui('log', f" ACK received from ECU: {status}.")
+                return status == "SUCCESS"
+    except OSError:
+        pass
         
     log_to_gui('log', " Timed out waiting for ECU.")
     return False
 
-def perform_single_update_check():
-    """Main update logic: Finds highest version between servers."""
+def perform_single_update_check(update_id=None):
+    """
+    Main update logic: Finds highest version between servers.
+    Returns the cycle outcome: 'updated', 'failed', 'no_update' or 'error'.
+    """
     try:
-        config = configparser.ConfigParser()
-        config.read('config.ini')
+        config = config_service.snapshot()
         current_version_str = config.get('TCU', 'current_version', fallback='1.0')
-        oem_url = config.get('Server', 'oem_url')
-        malicious_url = config.get('Server', 'malicious_url')
         checksum_enabled = config.getboolean('Security', 'checksum_verification_enabled', fallback=True)
         current_version_tuple = version_to_tuple(current_version_str)
 
         log_to_gui('status', 'Checking', '#2196F3')
         log_to_gui('log', f" TCU (v{current_version_str}) checking for updates...")
         
-        oem_info = check_single_server(oem_url)
-        malicious_info = check_single_server(malicious_url)
+        with spans.span('check', update_id, current_version=current_version_str):
+            server_infos = check_all_servers(configured_servers(config), current_version_str, update_id, rollout_headers(config))
         
-        best_update = None
-        best_version_tuple = current_version_tuple
-
         # Logic to select the highest version available
-        if oem_info and version_to_tuple(oem_info.get("version")) > best_version_tuple:
-            best_update = oem_info
-            best_version_tuple = version_to_tuple(oem_info.get("version"))
-        
-        if malicious_info and version_to_tuple(malicious_info.get("version")) > best_version_tuple:
-            best_update = malicious_info
-            best_version_tuple = version_to_tuple(malicious_info.get("version"))
+        best_update = select_best_update(current_version_tuple, server_infos)
 
         if best_update:
             log_to_gui('log', f" New version found: {best_update['version']}")
-            if download_and_process(config, best_update, checksum_enabled):
+            if download_and_process(config, best_update, checksum_enabled, update_id):
                 # Update local config only on successful transfer and ACK
-                config.set('TCU', 'current_version', best_update['version'])
-                with open('config.ini', 'w') as configfile: config.write(configfile)
-                log_to_gui('log', f" Update successful.")
-                log_to_gui('status', 'Success', '#4CAF50')
-            else:
-                log_to_gui('status', 'Idle', 'gray')
+                config_service.set('TCU', 'current_version', best_update['version'])
+                with gui_events.batch():
+                    log_to_gui('log', f" Update successful.")
+                    log_to_gui('status', 'Success', '#4CAF50')
+                return 'updated'
+            log_to_gui('status', 'Idle', 'gray')
+            return 'failed'
         else:
             log_to_gui('log', " No updates available.")
             log_to_gui('status', 'Idle', 'gray')
+            return 'no_update'
     
     except Exception as e:
         log_to_gui('log', f"TCU ERROR: {e}")
         log_to_gui('status', 'Crashed', '#f44336')
+        return 'error'
+
+# --- PUSH MODE ---
+# With [TCU] push_updates = true the TCU also subscribes to the OEM server's
+# /watch-updates event stream and starts an update cycle as soon as it is
+# offered a version newer than the installed one, instead of waiting for a
+# CHECK. The stream reader only flags the notification; a separate thread
+# runs the cycle, so the stream keeps being read while an update is under
+# way. CHECK commands on stdin keep working; cycles never overlap.
+_cycle_lock = threading.Lock()
+_push_requested = threading.Event()
+
+def run_update_cycle(trigger):
+    with _cycle_lock:
+        # One ID per cycle ties together the spans of every component
+        update_id = new_update_id()
+        with spans.span('cycle', update_id, trigger=trigger) as cycle:
+            cycle['outcome'] = perform_single_update_check(update_id)
+
+def read_sse(response):
+    """Yields (event, id, data) for each server-sent event in a streaming response."""
+    event, event_id, data = "message", None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, event_id, "\n".join(data)
+            event, data = "message", []
+            continue
+        if line.startswith(":"):
+            continue  # Keep-alive comment
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+        elif field == "id":
+            event_id = value
+
+def handle_release_notification(offer):
+    current_version = config_service.get('TCU', 'current_version', fallback='1.0')
+    if version_to_tuple(offer.get('version')) > version_to_tuple(current_version):
+        log_to_gui('log', f" Update notification: v{offer['version']} available.")
+        _push_requested.set()
+
+def push_cycle_worker():
+    """Runs one update cycle per burst of notifications; the cycle itself picks the newest offer."""
+    while True:
+        _push_requested.wait()
+        _push_requested.clear()
+        run_update_cycle('push')
+
+def watch_for_updates():
+    """Follows the OEM server's notification stream, reconnecting with backoff when it is unreachable."""
+    session = requests.Session()  # Not a pooled session: this connection stays open
+    last_event_id = None
+    delay = 0
+    threading.Thread(target=push_cycle_worker, name="push-cycles", daemon=True).start()
+    while True:
+        if delay:
+            time.sleep(delay)
+        config = config_service.snapshot()
+        server_url = config.get('Server', 'oem_url', fallback=None)
+        if not server_url:
+            delay = WATCH_RECONNECT_MAX
+            continue
+        headers = rollout_headers(config)
+        headers['Accept'] = 'text/event-stream'
+        if last_event_id:
+            headers['Last-Event-ID'] = last_event_id  # Only hear about offers we have not seen
+        opened = None
+        try:
+            with session.get(f"{server_url}/watch-updates", headers=headers, stream=True,
+                             timeout=(CHECK_TIMEOUT, WATCH_READ_TIMEOUT)) as response:
+                response.raise_for_status()
+                opened = time.monotonic()
+                for event, event_id, data in read_sse(response):
+                    last_event_id = event_id or last_event_id
+                    if event == "release":
+                        handle_release_notification(json.loads(data))
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        # Failed or ended (a worker reload ends the stream cleanly): back off
+        # while connections keep ending quickly, else reconnect after the minimum
+        if opened is not None and time.monotonic() - opened >= WATCH_STABLE_SECONDS:
+            delay = WATCH_RECONNECT_MIN
+        else:
+            delay = min(max(delay * 2, WATCH_RECONNECT_MIN), WATCH_RECONNECT_MAX)
 
 def main_loop():
+    config_service.start_watcher()
     log_to_gui('status', 'Idle', 'gray')
+    watcher = None
+    if config_service.getboolean('TCU', 'push_updates', fallback=False):
+        watcher = threading.Thread(target=watch_for_updates, name="update-watcher", daemon=True)
+        watcher.start()
+        log_to_gui('log', " Push mode: waiting for update notifications from the OEM server.")
     for command in sys.stdin:
         if command.strip() == "CHECK":
-            perform_single_update_check()
+            run_update_cycle('manual')
+    if watcher is not None:
+        watcher.join()  # No more commands, but notifications still start updates
 
 if __name__ == '__main__':
     main_loop()
\ No newline at end of file